@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Compare navie.diff.unified_diff with difflib.unified_diff on 10k to 100k line files.
+
+Usage:
+    python bench/bench_diff.py [--repeat N]
+"""
+
+import argparse
+import difflib
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from navie.diff import unified_diff
+
+
+def source_lines(count, rng):
+    return [f"    value_{i} = compute({rng.random():.6f})\n" for i in range(count)]
+
+
+def generated_lines(count, rng):
+    # JSON-like, with many repeated lines
+    pattern = ["{\n", '  "id": {},\n', '  "value": null,\n', '  "tags": [],\n', "},\n"]
+    return [pattern[i % 5].replace("{}", str(i // 5)) for i in range(count)]
+
+
+def scatter_edits(lines, edits, rng):
+    lines = list(lines)
+    for _ in range(edits):
+        index = rng.randrange(len(lines))
+        if rng.random() < 0.5:
+            lines[index] = f"    edited_{index} = True\n"
+        else:
+            lines.insert(index, f"    inserted_{index} = True\n")
+    return lines
+
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"{'case':<28} {'lines':>7} {'navie s':>9} {'difflib s':>10} {'same':>5}")
+    for name, make in (("source", source_lines), ("generated", generated_lines)):
+        for count in (10_000, 50_000, 100_000):
+            for edits in (0, 10, 200):
+                a = make(count, rng)
+                b = scatter_edits(a, edits, rng)
+                navie_time, navie_diff = timed(
+                    lambda: unified_diff(a, b, "a", "b"), args.repeat
+                )
+                difflib_time, difflib_diff = timed(
+                    lambda: "".join(difflib.unified_diff(a, b, "a", "b")),
+                    args.repeat,
+                )
+                print(
+                    f"{name + f' ({edits} edits)':<28} {count:>7} {navie_time:>9.3f} "
+                    f"{difflib_time:>10.3f} {str(navie_diff == difflib_diff):>5}"
+                )
+
+
+if __name__ == "__main__":
+    main()
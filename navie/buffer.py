@@ -0,0 +1,188 @@
+import os
+import shutil
+import tempfile
+from bisect import bisect_right
+from typing import Optional
+
+from navie.diff import unified_diff
+from navie.extract_changes import FileUpdate
+from navie.locator import BlockLocator, Match
+
+
+def split_lines(text: str) -> list[str]:
+    """Split text into lines that keep their newline, like readlines() does."""
+    lines = text.split("\n")
+    last = lines.pop()
+    lines = [line + "\n" for line in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+
+class DocumentBuffer:
+    """
+    The base and modified content of a file, held in memory as lines. Changes are
+    applied to the buffer; the file on disk is only rewritten by write(), which replaces
+    it atomically.
+
+    Like the rest of the edit pipeline, the file is read with universal newlines.
+    """
+
+    def __init__(self, path: str, text: Optional[str] = None):
+        self.path = path
+        if text is None:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+        self.base_lines = split_lines(text)
+        self.lines = list(self.base_lines)
+        self._offsets: Optional[list[int]] = None
+        self._edited = False
+
+    @staticmethod
+    def from_bytes(path: str, data: bytes) -> "DocumentBuffer":
+        text = data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+        return DocumentBuffer(path, text)
+
+    @property
+    def text(self) -> str:
+        return "".join(self.lines)
+
+    @property
+    def changed(self) -> bool:
+        return self._edited and self.lines != self.base_lines
+
+    def set_text(self, text: str):
+        self.lines = split_lines(text)
+        self._offsets = None
+        self._edited = True
+
+    def offsets(self) -> list[int]:
+        """The character offset at which each line starts, plus the total length."""
+        if self._offsets is None:
+            offsets = [0]
+            for line in self.lines:
+                offsets.append(offsets[-1] + len(line))
+            self._offsets = offsets
+        return self._offsets
+
+    def line_at(self, offset: int) -> int:
+        """The 0-based index of the line containing a character offset."""
+        return bisect_right(self.offsets(), offset) - 1
+
+    def replace_lines(self, start: int, end: int, new_lines: list[str]):
+        """Replace lines[start:end] (0-based, end exclusive)."""
+        self.lines[start:end] = new_lines
+        self._offsets = None
+        self._edited = True
+
+    def replace_range(self, start: int, end: int, replacement: str):
+        """Replace the characters text[start:end]."""
+        offsets = self.offsets()
+        first = self.line_at(start)
+        last = max(first, self.line_at(max(start, end - 1)))
+        if end > offsets[-1] or last >= len(self.lines):
+            last = len(self.lines) - 1
+        prefix = self.lines[first][: start - offsets[first]] if self.lines else ""
+        suffix = self.lines[last][end - offsets[last] :] if self.lines else ""
+        self.replace_lines(
+            first,
+            last + 1,
+            split_lines(prefix + replacement + suffix),
+        )
+
+    def apply(self, update: FileUpdate) -> bool:
+        """
+        Apply a change whose original code occurs verbatim in the buffer. Returns False if
+        it doesn't.
+        """
+        text = self.text
+        if not update.original:
+            return False
+        index = text.find(update.original)
+        if index == -1:
+            return False
+        self.replace_range(index, index + len(update.original), update.modified)
+        return True
+
+    def locate(self, original: str) -> Optional[Match]:
+        """
+        Find the lines matching a block of original code, even if it differs in whitespace
+        or in a few lines. The match score says how confident the match is.
+        """
+        return BlockLocator(self.lines).locate(original)
+
+    def apply_match(self, match: Match, original: str, modified: str):
+        """Replace the matched lines with the modified code."""
+        new_text = modified
+        if match.kind != "exact":
+            new_text = _reindent(modified, original, self.lines[match.start : match.end])
+        # A deletion leaves no line behind, not an empty one
+        if new_text and self.lines[match.end - 1].endswith("\n"):
+            new_text += "\n"
+        self.replace_lines(match.start, match.end, split_lines(new_text))
+
+    def match_diff(self, match: Match, original: str) -> str:
+        """How the matched lines differ from the original code, as a unified diff."""
+        return unified_diff(
+            split_lines(original.strip("\n") + "\n"),
+            self.lines[match.start : match.end],
+            fromfile="original",
+            tofile=f"{self.path}:{match.start + 1}-{match.end}",
+        )
+
+    def diff(self, fromfile: str, tofile: str) -> str:
+        if not self.changed:
+            return ""
+        return unified_diff(self.base_lines, self.lines, fromfile=fromfile, tofile=tofile)
+
+    def write(self, path: Optional[str] = None):
+        """
+        Write the buffer through a temporary file in the same directory, renamed over the
+        target, so the file is never left partially written.
+        """
+        path = path or self.path
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(
+            dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.text)
+            if os.path.exists(path):
+                shutil.copymode(path, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def snapshot(self, directory: str, name: str):
+        """Write the base and current content into a directory, for debugging."""
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{name}.base"), "w", encoding="utf-8") as f:
+            f.write("".join(self.base_lines))
+        with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+            f.write(self.text)
+
+
+def _indentation(lines) -> Optional[str]:
+    for line in lines:
+        if line.strip():
+            return line[: len(line) - len(line.lstrip())]
+    return None
+
+
+def _reindent(modified: str, original: str, matched_lines: list[str]) -> str:
+    # When the original code was matched ignoring whitespace, shift the modified code
+    # from the original's indentation to the file's.
+    original_indent = _indentation(original.split("\n"))
+    file_indent = _indentation(matched_lines)
+    if original_indent is None or file_indent is None or original_indent == file_indent:
+        return modified
+
+    lines = []
+    for line in modified.split("\n"):
+        if line.startswith(original_indent) and line.strip():
+            line = file_indent + line[len(original_indent) :]
+        lines.append(line)
+    return "\n".join(lines)
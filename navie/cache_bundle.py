@@ -0,0 +1,262 @@
+"""
+Export the caches that with_cache builds into a portable bundle, and import them into
+another work tree, so that a warm cache can be shipped as a build artifact.
+
+A bundle is a zip file with:
+
+- manifest.json: the bundle's id, the repository it came from, the id of the bundle it
+  is an increment of (if any), and one entry per cache entry, with the entry's work dir
+  (relative to the exported root), operation, cache key and object.
+- objects/<sha256>.json: the cached results, named by the hash of their content, so a
+  result shared by several entries is stored once.
+
+Exporting with a base bundle only includes the entries that aren't in the base. Importing
+writes entries into the keyed store of each work dir (see with_cache.KEYED_CACHE_DIR),
+which merges them with the existing cache: entries that are already cached locally are
+left alone. Imports can be restricted to some operations or work dirs.
+
+    python -m navie.cache_bundle export .navie navie-cache.zip [--base previous.zip]
+    python -m navie.cache_bundle import navie-cache.zip .navie [--operation plan]
+"""
+
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import subprocess
+import time
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import Iterator, Optional
+
+from navie.with_cache import KEYED_CACHE_DIR, keyed_cache_file, read_cache, write_cache
+
+BUNDLE_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+OBJECTS_DIR = "objects"
+CACHE_FILE = "cache.json"
+
+
+def repo_fingerprint(root: str = ".") -> dict:
+    """The origin and commit of the git repository containing root, where known."""
+
+    def git(*args):
+        try:
+            result = subprocess.run(
+                ["git", "-C", root, *args], capture_output=True, text=True
+            )
+        except FileNotFoundError:
+            return None
+        return result.stdout.strip() or None if result.returncode == 0 else None
+
+    return {
+        "remote": git("config", "--get", "remote.origin.url"),
+        "head": git("rev-parse", "HEAD"),
+    }
+
+
+def cache_entries(root: str) -> Iterator[tuple[str, str, object]]:
+    """(work dir relative to root, cache key, result) for each cache entry under root."""
+    seen = set()
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        if os.path.basename(directory) == KEYED_CACHE_DIR:
+            work_dir = os.path.dirname(directory)
+            cache_files = [
+                os.path.join(directory, name)
+                for name in sorted(files)
+                if name.endswith(".json")
+            ]
+        elif CACHE_FILE in files:
+            work_dir = directory
+            cache_files = [os.path.join(directory, CACHE_FILE)]
+        else:
+            continue
+
+        path = str(PurePosixPath(*os.path.relpath(work_dir, root).split(os.sep)))
+        for cache_file in cache_files:
+            try:
+                with open(cache_file, "r") as f:
+                    cache = json.load(f)
+                key = cache["key"]
+            except (ValueError, KeyError, TypeError):
+                continue
+            if (path, key) in seen:
+                continue
+            seen.add((path, key))
+            yield path, key, cache["result"]
+
+
+def read_manifest(bundle_path: str) -> dict:
+    with zipfile.ZipFile(bundle_path, "r") as bundle:
+        return json.loads(bundle.read(MANIFEST_NAME))
+
+
+def _bundle_id(entries: list[dict]) -> str:
+    hasher = hashlib.sha256()
+    for entry in sorted(entries, key=lambda e: (e["path"], e["key"])):
+        hasher.update(f"{entry['path']}\0{entry['key']}\0{entry['object']}\n".encode())
+    return hasher.hexdigest()
+
+
+def export_bundle(
+    root: str,
+    bundle_path: str,
+    base: Optional[str] = None,
+    operations: Optional[list[str]] = None,
+) -> dict:
+    """
+    Write the cache entries under root into a bundle, and return its manifest. With a
+    base bundle, the entries that the base already has are left out.
+    """
+    base_manifest = read_manifest(base) if base else None
+    base_entries = (
+        {(e["path"], e["key"]) for e in base_manifest["entries"]} if base_manifest else set()
+    )
+
+    entries = []
+    objects: dict[str, bytes] = {}
+    for path, key, result in cache_entries(root):
+        operation = PurePosixPath(path).name
+        if operations and operation not in operations:
+            continue
+        if (path, key) in base_entries:
+            continue
+        data = json.dumps(result, sort_keys=True).encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        objects[digest] = data
+        entries.append(
+            {"path": path, "operation": operation, "key": key, "object": digest}
+        )
+
+    manifest = {
+        "version": BUNDLE_VERSION,
+        "id": _bundle_id(entries),
+        "base": base_manifest["id"] if base_manifest else None,
+        "created_at": time.time(),
+        "repo": repo_fingerprint(root),
+        "entries": entries,
+    }
+
+    tmp_path = f"{bundle_path}.{os.getpid()}.tmp"
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED) as bundle:
+        for digest, data in sorted(objects.items()):
+            bundle.writestr(f"{OBJECTS_DIR}/{digest}.json", data)
+        bundle.writestr(MANIFEST_NAME, json.dumps(manifest, indent=2))
+    os.replace(tmp_path, bundle_path)
+    return manifest
+
+
+def _safe_path(path: str) -> bool:
+    parts = PurePosixPath(path).parts
+    return not PurePosixPath(path).is_absolute() and ".." not in parts
+
+
+def import_bundle(
+    bundle_path: str,
+    root: str,
+    operations: Optional[list[str]] = None,
+    paths: Optional[list[str]] = None,
+    require_same_repo: bool = False,
+) -> dict:
+    """
+    Merge the entries of a bundle into the caches under root. operations and paths
+    (glob patterns of work dirs) select the entries to import. Returns the number of
+    entries imported and skipped.
+    """
+    counts = {"imported": 0, "skipped": 0}
+    with zipfile.ZipFile(bundle_path, "r") as bundle:
+        manifest = json.loads(bundle.read(MANIFEST_NAME))
+        if manifest.get("version") != BUNDLE_VERSION:
+            raise ValueError(
+                f"Unsupported cache bundle version: {manifest.get('version')}"
+            )
+        if require_same_repo:
+            remote = repo_fingerprint(root)["remote"]
+            if manifest["repo"].get("remote") != remote:
+                raise ValueError(
+                    f"Cache bundle is from {manifest['repo'].get('remote')}, not {remote}"
+                )
+
+        for entry in manifest["entries"]:
+            if operations and entry["operation"] not in operations:
+                continue
+            if paths and not any(fnmatch.fnmatch(entry["path"], p) for p in paths):
+                continue
+            if not _safe_path(entry["path"]):
+                raise ValueError(f"Invalid path in cache bundle: {entry['path']}")
+
+            work_dir = os.path.join(root, *PurePosixPath(entry["path"]).parts)
+            target = keyed_cache_file(work_dir, entry["key"])
+            cache_file = os.path.join(work_dir, CACHE_FILE)
+            if target.exists() or read_cache(Path(cache_file), entry["key"]):
+                counts["skipped"] += 1
+                continue
+
+            data = bundle.read(f"{OBJECTS_DIR}/{entry['object']}.json")
+            if hashlib.sha256(data).hexdigest() != entry["object"]:
+                raise ValueError(f"Corrupt object in cache bundle: {entry['object']}")
+            write_cache(target, entry["key"], json.loads(data))
+            counts["imported"] += 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and import navie caches")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Write caches into a bundle")
+    export_parser.add_argument("root", help="Directory of the work dirs to export")
+    export_parser.add_argument("bundle", help="Bundle file to write")
+    export_parser.add_argument(
+        "--base", help="Only export the entries that this earlier bundle doesn't have"
+    )
+    export_parser.add_argument(
+        "--operation", action="append", dest="operations", help="Operation to export"
+    )
+
+    import_parser = subparsers.add_parser("import", help="Merge a bundle into caches")
+    import_parser.add_argument("bundle", help="Bundle file to read")
+    import_parser.add_argument("root", help="Directory of the work dirs to import into")
+    import_parser.add_argument(
+        "--operation", action="append", dest="operations", help="Operation to import"
+    )
+    import_parser.add_argument(
+        "--path", action="append", dest="paths", help="Glob pattern of work dirs to import"
+    )
+    import_parser.add_argument(
+        "--require-same-repo",
+        action="store_true",
+        help="Refuse bundles exported from a repository with a different origin",
+    )
+
+    list_parser = subparsers.add_parser("list", help="Show the entries of a bundle")
+    list_parser.add_argument("bundle", help="Bundle file to read")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        manifest = export_bundle(
+            args.root, args.bundle, base=args.base, operations=args.operations
+        )
+        print(f"Exported {len(manifest['entries'])} cache entries to {args.bundle}")
+    elif args.command == "import":
+        counts = import_bundle(
+            args.bundle,
+            args.root,
+            operations=args.operations,
+            paths=args.paths,
+            require_same_repo=args.require_same_repo,
+        )
+        print(
+            f"Imported {counts['imported']} cache entries "
+            f"({counts['skipped']} already cached)"
+        )
+    else:
+        manifest = read_manifest(args.bundle)
+        for entry in manifest["entries"]:
+            print(f"{entry['operation']}\t{entry['path']}\t{entry['key'][:16]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""
+Best-of-N code generation. Candidate edits are generated concurrently at different
+temperatures, and each is written into its own workspace: a copy of the working tree
+made of hard links (or a git worktree), so that setting one up costs a directory walk
+rather than a copy of the repository. A test command runs in every workspace in
+parallel, and the first candidate to pass it wins.
+
+Hard-linked workspaces share file contents with the working tree. Edits are safe,
+because DocumentBuffer.write replaces files rather than writing into them, but a test
+command that modifies tracked files in place would modify them in the working tree too.
+Use worktree workspaces for such commands.
+"""
+
+import copy
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
+
+from navie.buffer import DocumentBuffer
+from navie.mode.prompt import PrefixStats
+
+DEFAULT_TEMPERATURES = (0.0, 0.3, 0.6, 0.9)
+# Directories that aren't linked into hard-linked workspaces
+IGNORED_DIRECTORIES = (".git", ".navie")
+
+
+class Workspace:
+    """An isolated copy of a source directory, as hard links or as a git worktree."""
+
+    def __init__(self, source_dir: str, path: str, method: str = "hardlink"):
+        if method not in ("hardlink", "worktree"):
+            raise ValueError(f"Unknown workspace method: {method}")
+        self.source_dir = os.path.abspath(source_dir)
+        self.path = os.path.abspath(path)
+        self.method = method
+
+    def create(self):
+        self.remove()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if self.method == "worktree":
+            _git_worktree(self.source_dir, self.path)
+        else:
+            _link_tree(self.source_dir, self.path)
+
+    def remove(self):
+        if self.method == "worktree":
+            subprocess.run(
+                ["git", "-C", self.source_dir, "worktree", "remove", "--force", self.path],
+                capture_output=True,
+            )
+        if os.path.lexists(self.path):
+            shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _link_tree(source_dir: str, path: str):
+    for directory, subdirectories, files in os.walk(source_dir):
+        subdirectories[:] = [d for d in subdirectories if d not in IGNORED_DIRECTORIES]
+        target_directory = os.path.join(path, os.path.relpath(directory, source_dir))
+        os.makedirs(target_directory, exist_ok=True)
+        for subdirectory in subdirectories:
+            source = os.path.join(directory, subdirectory)
+            if os.path.islink(source):
+                os.symlink(
+                    os.readlink(source), os.path.join(target_directory, subdirectory)
+                )
+        for name in files:
+            source = os.path.join(directory, name)
+            target = os.path.join(target_directory, name)
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), target)
+                continue
+            try:
+                os.link(source, target)
+            except OSError:
+                # Across devices, or on a file system without hard links
+                shutil.copy2(source, target)
+
+
+def _git_worktree(source_dir: str, path: str):
+    # The worktree starts at HEAD; uncommitted changes to tracked files are carried over.
+    subprocess.run(
+        ["git", "-C", source_dir, "worktree", "add", "--detach", path, "HEAD"],
+        check=True,
+        capture_output=True,
+    )
+    changes = subprocess.run(
+        ["git", "-C", source_dir, "diff", "HEAD", "--binary"],
+        check=True,
+        capture_output=True,
+    ).stdout
+    if changes:
+        subprocess.run(
+            ["git", "-C", path, "apply", "--whitespace=nowarn"],
+            input=changes,
+            check=True,
+            capture_output=True,
+        )
+
+
+class Candidate:
+    def __init__(self, index: int, temperature: float, workspace: Workspace):
+        self.index = index
+        self.temperature = temperature
+        self.workspace = workspace
+        # Diffs of the files this candidate changed, by path
+        self.diffs: dict[str, str] = {}
+        self.passed = False
+        self.returncode: Optional[int] = None
+        self.elapsed: Optional[float] = None
+        self.output = ""
+
+    def apply(self, files=None, target_dir: str = "."):
+        """Copy the files changed by this candidate (or some of them) to the target."""
+        for file in files if files is not None else self.diffs:
+            source = os.path.join(self.workspace.path, os.path.relpath(file))
+            with open(source, "r", encoding="utf-8") as f:
+                text = f.read()
+            DocumentBuffer(source, text).write(os.path.join(target_dir, file))
+
+    def __repr__(self):
+        return (
+            f"Candidate({self.index} temperature={self.temperature} passed={self.passed})"
+        )
+
+
+class BestOfN:
+    """
+    Generate candidates for an Edit whose plan is ready, and test each in its own
+    workspace. run() returns the first candidate to pass, or None.
+    """
+
+    def __init__(
+        self,
+        edit,
+        test_command: str,
+        candidates: int = 4,
+        temperatures=DEFAULT_TEMPERATURES,
+        method: str = "hardlink",
+        max_workers: Optional[int] = None,
+    ):
+        self.edit = edit
+        self.test_command = test_command
+        self.candidates = candidates
+        self.temperatures = temperatures
+        self.method = method
+        self.max_workers = max_workers or candidates
+        self.results: list[Candidate] = []
+
+        self._stopped = threading.Event()
+        self._processes: list[subprocess.Popen] = []
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def run(self) -> Optional[Candidate]:
+        """
+        Returns as soon as a candidate passes. The other candidates stop at their next
+        step, and cleanup() waits for them.
+        """
+        winner = None
+        executor = self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            futures = [
+                executor.submit(self._run_candidate, index)
+                for index in range(self.candidates)
+            ]
+            for future in as_completed(futures):
+                try:
+                    candidate = future.result()
+                except Exception as e:
+                    print(f"Candidate failed: {e}")
+                    continue
+                if candidate.passed:
+                    winner = candidate
+                    self._stop()
+                    break
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return winner
+
+    def cleanup(self):
+        """Wait for the candidates that are still running, and remove every workspace."""
+        self._stop()
+        if self._executor:
+            self._executor.shutdown(wait=True)
+        for candidate in self.results:
+            candidate.workspace.remove()
+
+    def _stop(self):
+        with self._lock:
+            self._stopped.set()
+            for process in self._processes:
+                _kill_group(process)
+
+    def _run_candidate(self, index: int) -> Candidate:
+        temperature = self.temperatures[index % len(self.temperatures)]
+        workspace = Workspace(
+            os.getcwd(),
+            os.path.join(self.edit.work_dir, "workspace", str(index)),
+            self.method,
+        )
+        candidate = Candidate(index, temperature, workspace)
+        with self._lock:
+            self.results.append(candidate)
+        if self._stopped.is_set():
+            return candidate
+
+        workspace.create()
+        if self._stopped.is_set():
+            return candidate
+
+        # A copy of the Edit with state of its own, since candidates run concurrently
+        edit = copy.copy(self.edit)
+        edit.work_dir = os.path.join(self.edit.work_dir, "candidate", str(index))
+        edit.temperature = temperature
+        edit.output_dir = workspace.path
+        edit.interactive = False
+        edit.prefix_stats = PrefixStats()
+        edit.prefetched = []
+        edit._speculative = {}
+        edit._speculation_executor = None
+        edit._prefetch_executor = None
+
+        def confirm_diff(file, diff):
+            # The files of a candidate that has lost aren't written
+            if self._stopped.is_set():
+                return False
+            candidate.diffs[file] = diff
+            return True
+
+        edit.apply(confirm_diff)
+
+        if not candidate.diffs:
+            candidate.output = "No changes"
+            return candidate
+
+        start = time.monotonic()
+        # Checked and spawned under the lock, so _stop sees every process. Each test
+        # runs in a session of its own, so that _stop kills the shell and its children.
+        with self._lock:
+            if self._stopped.is_set():
+                return candidate
+            process = subprocess.Popen(
+                self.test_command,
+                shell=True,
+                cwd=workspace.path,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                start_new_session=True,
+            )
+            self._processes.append(process)
+        candidate.output, _ = process.communicate()
+        candidate.elapsed = time.monotonic() - start
+        candidate.returncode = process.returncode
+        candidate.passed = process.returncode == 0 and not self._stopped.is_set()
+        return candidate
+
+
+def _kill_group(process: subprocess.Popen):
+    if process.poll() is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
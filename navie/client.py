@@ -1,10 +1,21 @@
+from contextlib import contextmanager
 from logging import Logger, StreamHandler
 import os
-from subprocess import run
+from subprocess import CalledProcessError, CompletedProcess, Popen, run
 from sys import stderr
+import threading
 import time
+from typing import Optional
 
+from navie import hedge, trace
 from navie.config import Config
+from navie.replay import Invocation, record, replay
+from navie.scratch import Scratch
+from navie.trajectory import call_id_of, next_call_id, segment_path, write_meta
+from navie.validators import InvalidOutput
+
+# How often the output file is checked for new output, when it's being watched
+OUTPUT_POLL_SECONDS = 0.05
 
 
 class Client:
@@ -15,25 +26,31 @@ class Client:
         temperature=None,
         token_limit=None,
         trajectory_file=None,
+        trajectory_dir=None,
+        scratch=None,
+        on_output=None,
+        validator=None,
     ):
         self.work_dir = work_dir
+        # Where payloads are written, and how they're passed to appmap
+        self.scratch = scratch or Scratch(work_dir, transport="files")
+        # Called with the output so far, each time appmap writes more of it
+        self.on_output = on_output
+        # Checks the output as it's written, stopping appmap once it can't be valid
+        self.validator = validator
         self.trajectory_file = trajectory_file
+        self.trajectory_dir = trajectory_dir
         self.temperature = 0.0 if temperature is None else temperature
         self.token_limit = token_limit
 
     def apply(self, file_path, replace, search=None) -> bool:
         log_file = os.path.join(self.work_dir, "apply.log")
-        search_file = os.path.join(self.work_dir, "search.txt")
-        replace_file = os.path.join(self.work_dir, "replace.txt")
-
-        with open(replace_file, "w") as replace_f:
-            replace_f.write(replace)
+        replace_file = self.scratch.expose(self.scratch.put("replace.txt", replace))
 
         cmd = [*Config.get_appmap_command(), "apply"]
 
         if search is not None:
-            with open(search_file, "w") as search_f:
-                search_f.write(search)
+            search_file = self.scratch.expose(self.scratch.put("search.txt", search))
             cmd += ["-s", search_file]
 
         cmd += ["-r", replace_file, file_path]
@@ -54,59 +71,50 @@ class Client:
             output_path=output_file,
             prompt_path=prompt_file,
         )
-        exit_status = self._execute(command, log_file)
+        exit_status = self._execute(command, log_file, operation="compute_update")
         return exit_status == 0
 
     def ask(self, question_file, output_file, context_file=None, prompt_file=None):
         log_file = os.path.join(self.work_dir, "ask.log")
-        input_file = os.path.join(self.work_dir, "ask.txt")
-
-        with open(question_file, "r") as question_f:
-            question = question_f.read()
+        question = self.scratch.read(question_file)
 
-        with open(input_file, "w") as input_f:
-            input_tokens = ["@explain"]
-            if context_file:
-                input_tokens.append("/nocontext")
-            input_tokens.append(question)
-            input_f.write(" ".join(input_tokens))
+        input_tokens = ["@explain"]
+        if context_file:
+            input_tokens.append("/nocontext")
+        input_tokens.append(question)
+        self.scratch.put("ask.txt", " ".join(input_tokens))
 
         command = self._build_command(
             input_path=question_file,
             output_path=output_file,
             prompt_path=prompt_file,
         )
-        self._execute(command, log_file)
+        self._execute(command, log_file, operation="ask")
 
     def terms(self, issue_file, output_file):
         log_file = os.path.join(self.work_dir, "terms.log")
-        input_file = os.path.join(self.work_dir, "terms.txt")
-        prompt_file = os.path.join(self.work_dir, "terms.prompt.md")
-
-        with open(issue_file, "r") as issue_f:
-            issue_content = issue_f.read()
+        issue_content = self.scratch.read(issue_file)
 
-        with open(input_file, "w") as input_f:
-            input_tokens = ["@generate"]
-            input_tokens.append("/nocontext")
-            input_tokens.append(issue_content)
-            input_f.write(" ".join(input_tokens))
+        input_tokens = ["@generate"]
+        input_tokens.append("/nocontext")
+        input_tokens.append(issue_content)
+        input_file = self.scratch.put("terms.txt", " ".join(input_tokens))
 
-        with open(prompt_file, "w") as prompt_f:
-            prompt_f.write(
-                f"""Generate a list of all file names, module names, class names, function names and varable names that are mentioned in the
+        prompt_file = self.scratch.put(
+            "terms.prompt.md",
+            f"""Generate a list of all file names, module names, class names, function names and varable names that are mentioned in the
 described issue. Do not emit symbols that are part of the programming language itself. Do not emit symbols that are part
 of test frameworks. Focus on library and application code only. Emit the results as a JSON list. Do not emit text, markdown, 
 or explanations.
-"""
-            )
+""",
+        )
 
         command = self._build_command(
             input_path=input_file,
             output_path=output_file,
             prompt_path=prompt_file,
         )
-        self._execute(command, log_file)
+        self._execute(command, log_file, operation="terms")
 
     def context(
         self,
@@ -118,8 +126,7 @@ or explanations.
     ):
         log_file = os.path.join(self.work_dir, "search_terms.log")
 
-        with open(query_file, "r") as f:
-            query_content = f.read()
+        query_content = self.scratch.read(query_file)
 
         question = ["@context /nofence /format=yaml"]
         if not vectorize_query:
@@ -129,31 +136,27 @@ or explanations.
         if include_pattern:
             question.append(f"/include={include_pattern}")
 
-        question_file = os.path.join(self.work_dir, "context.txt")
-        with open(question_file, "w") as apply_f:
-            apply_f.write(
-                f"""{" ".join(question)}
+        question_file = self.scratch.put(
+            "context.txt",
+            f"""{" ".join(question)}
                         
 {query_content}
-"""
-            )
+""",
+        )
 
         command = self._build_command(input_path=question_file, output_path=output_file)
-        self._execute(command, log_file)
+        self._execute(command, log_file, operation="context")
 
     def plan(self, issue_file, output_file, context_file=None, prompt_file=None):
         log_file = os.path.join(self.work_dir, "plan.log")
-        input_file = os.path.join(self.work_dir, "plan.txt")
 
-        with open(issue_file, "r") as issue_f:
-            issue_content = issue_f.read()
+        issue_content = self.scratch.read(issue_file)
 
-        with open(input_file, "w") as plan_f:
-            input_tokens = ["@plan"]
-            if context_file:
-                input_tokens.append("/nocontext")
-            input_tokens.append(issue_content)
-            plan_f.write(" ".join(input_tokens))
+        input_tokens = ["@plan"]
+        if context_file:
+            input_tokens.append("/nocontext")
+        input_tokens.append(issue_content)
+        input_file = self.scratch.put("plan.txt", " ".join(input_tokens))
 
         command = self._build_command(
             input_path=input_file,
@@ -161,7 +164,7 @@ or explanations.
             context_path=context_file,
             prompt_path=prompt_file,
         )
-        self._execute(command, log_file)
+        self._execute(command, log_file, operation="plan")
 
     def search(
         self,
@@ -172,36 +175,31 @@ or explanations.
         format_file=None,
     ):
         log_file = os.path.join(self.work_dir, "search.log")
-        input_file = os.path.join(self.work_dir, "search.txt")
 
-        with open(query_file, "r") as query_f:
-            query_content = query_f.read()
+        query_content = self.scratch.read(query_file)
 
-        with open(input_file, "w") as search_f:
-            input_tokens = ["@search"]
-            if context_file:
-                input_tokens.append("/nocontext")
-            if format_file:
-                input_tokens.append("/noformat")
-            input_tokens.append(query_content)
-            input = " ".join(input_tokens)
-            search_f.write(input)
+        input_tokens = ["@search"]
+        if context_file:
+            input_tokens.append("/nocontext")
+        if format_file:
+            input_tokens.append("/noformat")
+        input_tokens.append(query_content)
+        input_file = self.scratch.put("search.txt", " ".join(input_tokens))
 
         if format_file:
             if not prompt_file:
                 prompt_file = format_file
             else:
                 # Append format instructions to the prompt
-                with open(format_file) as format_f:
-                    format = format_f.read()
+                format_instructions = self.scratch.read(format_file)
 
-                with open(prompt_file, "a") as prompt_f:
-                    prompt_f.write(
-                        f"""
+                self.scratch.append(
+                    prompt_file,
+                    f"""
 
-{format}
-"""
-                    )
+{format_instructions}
+""",
+                )
 
         command = self._build_command(
             input_path=input_file,
@@ -209,28 +207,26 @@ or explanations.
             context_path=context_file,
             prompt_path=prompt_file,
         )
-        self._execute(command, log_file)
+        self._execute(command, log_file, operation="search")
 
     def list_files(self, plan_file, output_file):
         log_file = os.path.join(self.work_dir, "list_files.log")
-        input_file = os.path.join(self.work_dir, "list_files.txt")
 
-        with open(plan_file, "r") as plan_f:
-            plan_content = plan_f.read()
+        plan_content = self.scratch.read(plan_file)
 
-        with open(input_file, "w") as question_f:
-            question_f.write(
-                f"""@list-files /format=json /nofence
+        input_file = self.scratch.put(
+            "list_files.txt",
+            f"""@list-files /format=json /nofence
                              
 {plan_content}
-"""
-            )
+""",
+        )
 
         command = self._build_command(
             input_path=input_file,
             output_path=output_file,
         )
-        self._execute(command, log_file)
+        self._execute(command, log_file, operation="list_files")
 
     def generate(
         self,
@@ -240,19 +236,15 @@ or explanations.
         prompt_file=None,
     ):
         log_file = os.path.join(self.work_dir, "generate.log")
-        input_file = os.path.join(self.work_dir, "generate.txt")
 
-        with open(plan_file, "r") as plan_f:
-            plan_content = plan_f.read()
-        with open(input_file, "w") as input_f:
-            input_tokens = ["@generate"]
-            input_tokens.append("/noformat")
-            if context_file:
-                input_tokens.append("/nocontext")
-            input_tokens.append(plan_content)
-            input = " ".join(input_tokens)
+        plan_content = self.scratch.read(plan_file)
 
-            input_f.write(input)
+        input_tokens = ["@generate"]
+        input_tokens.append("/noformat")
+        if context_file:
+            input_tokens.append("/nocontext")
+        input_tokens.append(plan_content)
+        input_file = self.scratch.put("generate.txt", " ".join(input_tokens))
 
         command = self._build_command(
             input_path=input_file,
@@ -260,7 +252,7 @@ or explanations.
             context_path=context_file,
             prompt_path=prompt_file,
         )
-        self._execute(command, log_file)
+        self._execute(command, log_file, operation="generate")
 
     def test(
         self,
@@ -270,19 +262,14 @@ or explanations.
         prompt_file=None,
     ):
         log_file = os.path.join(self.work_dir, "test.log")
-        input_file = os.path.join(self.work_dir, "test.txt")
-
-        with open(issue_file, "r") as issue_f:
-            issue_content = issue_f.read()
 
-        with open(input_file, "w") as input_f:
-            input_tokens = ["@test", "/noformat"]
-            if context_file:
-                input_tokens.append("/nocontext")
-            input_tokens.append(issue_content)
-            input = " ".join(input_tokens)
+        issue_content = self.scratch.read(issue_file)
 
-            input_f.write(input)
+        input_tokens = ["@test", "/noformat"]
+        if context_file:
+            input_tokens.append("/nocontext")
+        input_tokens.append(issue_content)
+        input_file = self.scratch.put("test.txt", " ".join(input_tokens))
 
         command = self._build_command(
             input_path=input_file,
@@ -290,7 +277,7 @@ or explanations.
             context_path=context_file,
             prompt_path=prompt_file,
         )
-        self._execute(command, log_file)
+        self._execute(command, log_file, operation="test")
 
     def _prepare_env(self):
         env = os.environ.copy()
@@ -310,18 +297,91 @@ or explanations.
         cmd = [*Config.get_appmap_command(), "navie", "--log-navie"]
 
         if input_path:
-            cmd += ["-i", input_path]
+            cmd += ["-i", self.scratch.expose(input_path)]
         if context_path:
-            cmd += ["-c", context_path]
+            cmd += ["-c", self.scratch.expose(context_path)]
         if prompt_path:
-            cmd += ["-p", prompt_path]
-        if self.trajectory_file:
+            cmd += ["-p", self.scratch.expose(prompt_path)]
+        if self.trajectory_dir:
+            # Each call gets its own segment, so concurrent calls don't share a file
+            segment_file = segment_path(
+                self.trajectory_dir, self.work_dir, next_call_id()
+            )
+            os.makedirs(self.trajectory_dir, exist_ok=True)
+            cmd += ["--trajectory-file", segment_file]
+        elif self.trajectory_file:
             cmd += ["--trajectory-file", self.trajectory_file]
         cmd += ["-o", output_path]
 
         return cmd
 
-    def _execute(self, command: list[str], log_file: str):
+    def _execute(self, command: list[str], log_file: str, operation=None):
+        invocation = Invocation(command) if self.trajectory_dir else None
+        if not invocation or not invocation.trajectory_path:
+            return self._execute_traced(command, log_file, operation)
+
+        question = self.scratch.read(invocation.input_paths["input"])
+        meta = {
+            "work_dir": os.path.abspath(self.work_dir),
+            "operation": question[:64].split(" ", 1)[0].strip(),
+            "issue": Config.get_issue_id(),
+            "model": os.getenv("APPMAP_NAVIE_MODEL"),
+            "temperature": self.temperature,
+            "token_limit": self.token_limit,
+            "started_at": time.time(),
+            "input_bytes": self._total_size(invocation.input_paths.values()),
+            "call_id": call_id_of(invocation.trajectory_path),
+        }
+
+        start = time.perf_counter()
+        try:
+            result = self._execute_traced(command, log_file, operation)
+            meta["status"] = "ok"
+            return result
+        except Exception:
+            meta["status"] = "error"
+            raise
+        finally:
+            meta["elapsed"] = time.perf_counter() - start
+            if invocation.output_path:
+                meta["output_bytes"] = self._total_size([invocation.output_path])
+            write_meta(invocation.trajectory_path, meta)
+
+    def _execute_traced(self, command: list[str], log_file: str, operation=None):
+        with trace.span("client.execute", log_file=log_file) as execute_span:
+            invocation = Invocation(command) if trace.enabled() else None
+            if invocation:
+                execute_span.set(
+                    subcommand=invocation.subcommand,
+                    input_bytes=self._total_size(invocation.input_paths.values()),
+                )
+
+            # Recorded sessions are served without running appmap at all
+            replay_file = Config.get_replay_file()
+            if replay_file:
+                execute_span.set(replay=True)
+                result = replay(replay_file, command, self._prepare_env(), log_file)
+            else:
+                record_file = Config.get_record_file()
+                if record_file:
+                    execute_span.set(record=True)
+                    result = record(
+                        record_file,
+                        command,
+                        self._prepare_env(),
+                        lambda: self._run(command, log_file, operation),
+                    )
+                else:
+                    result = self._run(command, log_file, operation)
+
+            if invocation and invocation.output_path:
+                execute_span.set(
+                    output_bytes=self._total_size([invocation.output_path])
+                )
+            return result
+
+    def _run(self, command: list[str], log_file: str, operation=None):
+        guard = _OutputGuard(self.validator, self.on_output) if self.validator else None
         try:
             with open(log_file, "w") as log:
                 logger = Logger(__name__, "INFO")
@@ -331,15 +391,20 @@ or explanations.
                 @retry(tries=3, delay=10, logger=logger, backoff=1.5)
                 def exec():
                     logger.debug("$ %s", " ".join(command))
-                    return run(
-                        command,
-                        stdout=log,
-                        stderr=log,
-                        env=self._prepare_env(),
-                        check=True,
-                    )
-
-                return exec()
+                    # Pipes are fed anew on each attempt
+                    with self.scratch.serving(), _watch_output(
+                        command, guard or self.on_output
+                    ):
+                        try:
+                            return self._spawn(command, log, guard, operation)
+                        except CalledProcessError:
+                            # Stopped by the guard. The caller asks again with a
+                            # correction, rather than retrying the same request.
+                            if guard and guard.reason:
+                                return None
+                            raise
+
+                result = exec()
 
         except Exception:
             # Print a tail of the log file for reference
@@ -349,6 +414,115 @@ or explanations.
                     print(line, end="", file=stderr)
             raise
 
+        if guard and guard.reason:
+            raise InvalidOutput(guard.reason)
+        return result
+
+    def _spawn(self, command: list[str], log, guard=None, operation=None):
+        popen_args = {"stdout": log, "stderr": log, "env": self._prepare_env()}
+        on_spawn = guard.spawned if guard else None
+        if self._may_hedge(command, operation):
+            return hedge.hedger().run(
+                command, operation, self.scratch.read, on_spawn=on_spawn, **popen_args
+            )
+        if not guard:
+            return run(command, check=True, **popen_args)
+
+        process = Popen(command, **popen_args)
+        guard.spawned(process)
+        try:
+            returncode = process.wait()
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        if returncode != 0:
+            raise CalledProcessError(returncode, command)
+        return CompletedProcess(command, 0)
+
+    def _may_hedge(self, command: list[str], operation) -> bool:
+        if not operation or not Config.get_hedge():
+            return False
+        # A shared trajectory file can't be given to a duplicate call
+        if self.trajectory_file and not self.trajectory_dir:
+            return False
+        return Invocation(command).subcommand == "navie"
+
+    def _total_size(self, paths) -> int:
+        return sum(self.scratch.size(path) for path in paths)
+
+
+@contextmanager
+def _watch_output(command: list[str], on_output):
+    if not on_output or "-o" not in command:
+        yield
+        return
+
+    output_path = command[command.index("-o") + 1]
+    stopped = threading.Event()
+
+    def watch():
+        size = None
+        while True:
+            # One last check once the command has finished
+            finished = stopped.wait(OUTPUT_POLL_SECONDS)
+            try:
+                current_size = os.path.getsize(output_path)
+            except FileNotFoundError:
+                current_size = size
+            if current_size != size:
+                size = current_size
+                try:
+                    # The output may end part way through a character
+                    with open(output_path, "r", errors="replace") as f:
+                        output = f.read()
+                except OSError:
+                    # Moved or removed since; it's read again on the next check
+                    size = None
+                else:
+                    try:
+                        on_output(output)
+                    except Exception as e:
+                        print(f"Output listener failed: {e}", file=stderr)
+            if finished:
+                return
+
+    thread = threading.Thread(target=watch, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+class _OutputGuard:
+    """An output listener that stops the child once its output can't be valid."""
+
+    def __init__(self, validator, on_output=None):
+        self.validator = validator
+        self.on_output = on_output
+        self.reason = None
+        self._processes = []
+        self._lock = threading.Lock()
+
+    def spawned(self, process: Popen):
+        with self._lock:
+            self._processes.append(process)
+            if self.reason:
+                process.kill()
+
+    def __call__(self, output: str):
+        reason = None if self.reason else self.validator.feed(output)
+        if reason:
+            with self._lock:
+                self.reason = reason
+                for process in self._processes:
+                    if process.poll() is None:
+                        process.kill()
+        if self.on_output:
+            self.on_output(output)
+
 
 def retry(tries=3, delay=10, logger=None, backoff=1.5):
     def decorator(func):
@@ -356,14 +530,16 @@ def retry(tries=3, delay=10, logger=None, backoff=1.5):
             attempt = 0
             while attempt < tries:
                 try:
-                    return func(*args, **kwargs)
+                    with trace.span("client.attempt", attempt=attempt + 1):
+                        return func(*args, **kwargs)
                 except Exception as e:
                     attempt += 1
                     if logger:
                         logger.error(f"Attempt {attempt}/{tries} failed: {e}")
                     if attempt == tries:
                         raise
-                    time.sleep(delay * (backoff**attempt))
+                    with trace.span("client.backoff", attempt=attempt):
+                        time.sleep(delay * (backoff**attempt))
 
         return wrapper
 
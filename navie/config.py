@@ -6,10 +6,48 @@ class Config:
     DEFAULT_APPMAP_COMMAND = "appmap"
     DEFAULT_CLEAN = False
     DEFAULT_TRAJECTORY_FILE = None
+    DEFAULT_RECORD_FILE = None
+    DEFAULT_REPLAY_FILE = None
+    DEFAULT_REPLAY_TIMING = False
+    DEFAULT_TRACE_FILE = None
+    DEFAULT_TRACE_FORMAT = None
+    DEFAULT_TRAJECTORY_DIR = None
+    DEFAULT_ISSUE_ID = None
+    DEFAULT_SYMBOL_INDEX_DIR = None
+    DEFAULT_TRANSPORT = "files"
+    DEFAULT_SCRATCH_DIR = None
+    DEFAULT_DEBUG = False
+    DEFAULT_DAEMON = "auto"
+    DEFAULT_SIMILARITY_DIR = None
+    DEFAULT_HEDGE = False
+    DEFAULT_HEDGE_PERCENTILE = 95
+    DEFAULT_HEDGE_MAX_RATE = 0.1
+    DEFAULT_VALIDATE = True
 
     appmap_command = os.getenv("APPMAP_COMMAND", DEFAULT_APPMAP_COMMAND).split()
     clean = os.getenv("APPMAP_NAVIE_CLEAN", str(DEFAULT_CLEAN))
     trajectory_file = os.getenv("APPMAP_NAVIE_TRAJECTORY_FILE", None)
+    record_file = os.getenv("APPMAP_NAVIE_RECORD_FILE", DEFAULT_RECORD_FILE)
+    replay_file = os.getenv("APPMAP_NAVIE_REPLAY_FILE", DEFAULT_REPLAY_FILE)
+    replay_timing = os.getenv("APPMAP_NAVIE_REPLAY_TIMING", str(DEFAULT_REPLAY_TIMING))
+    trace_file = os.getenv("APPMAP_NAVIE_TRACE_FILE", DEFAULT_TRACE_FILE)
+    trace_format = os.getenv("APPMAP_NAVIE_TRACE_FORMAT", DEFAULT_TRACE_FORMAT)
+    trajectory_dir = os.getenv("APPMAP_NAVIE_TRAJECTORY_DIR", DEFAULT_TRAJECTORY_DIR)
+    issue_id = os.getenv("APPMAP_NAVIE_ISSUE_ID", DEFAULT_ISSUE_ID)
+    symbol_index_dir = os.getenv(
+        "APPMAP_NAVIE_SYMBOL_INDEX_DIR", DEFAULT_SYMBOL_INDEX_DIR
+    )
+    transport = os.getenv("APPMAP_NAVIE_TRANSPORT", DEFAULT_TRANSPORT)
+    scratch_dir = os.getenv("APPMAP_NAVIE_SCRATCH_DIR", DEFAULT_SCRATCH_DIR)
+    debug = os.getenv("APPMAP_NAVIE_DEBUG", str(DEFAULT_DEBUG))
+    daemon = os.getenv("APPMAP_NAVIE_DAEMON", DEFAULT_DAEMON)
+    similarity_dir = os.getenv("APPMAP_NAVIE_SIMILARITY_DIR", DEFAULT_SIMILARITY_DIR)
+    hedge = os.getenv("APPMAP_NAVIE_HEDGE", str(DEFAULT_HEDGE))
+    hedge_percentile = os.getenv(
+        "APPMAP_NAVIE_HEDGE_PERCENTILE", str(DEFAULT_HEDGE_PERCENTILE)
+    )
+    hedge_max_rate = os.getenv("APPMAP_NAVIE_HEDGE_MAX_RATE", str(DEFAULT_HEDGE_MAX_RATE))
+    validate = os.getenv("APPMAP_NAVIE_VALIDATE", str(DEFAULT_VALIDATE))
 
     @staticmethod
     def get_appmap_command() -> list[str]:
@@ -34,3 +72,139 @@ class Config:
     @staticmethod
     def set_trajectory_file(trajectory_file):
         Config.trajectory_file = trajectory_file
+
+    @staticmethod
+    def get_record_file() -> Optional[str]:
+        return Config.record_file
+
+    @staticmethod
+    def set_record_file(record_file):
+        Config.record_file = record_file
+
+    @staticmethod
+    def get_replay_file() -> Optional[str]:
+        return Config.replay_file
+
+    @staticmethod
+    def set_replay_file(replay_file):
+        Config.replay_file = replay_file
+
+    @staticmethod
+    def get_replay_timing() -> bool:
+        return Config.replay_timing.lower() == "true"
+
+    @staticmethod
+    def set_replay_timing(replay_timing):
+        Config.replay_timing = replay_timing
+
+    @staticmethod
+    def get_trace_file() -> Optional[str]:
+        return Config.trace_file
+
+    @staticmethod
+    def set_trace_file(trace_file):
+        Config.trace_file = trace_file
+
+    @staticmethod
+    def get_trace_format() -> Optional[str]:
+        return Config.trace_format
+
+    @staticmethod
+    def set_trace_format(trace_format):
+        Config.trace_format = trace_format
+
+    @staticmethod
+    def get_trajectory_dir() -> Optional[str]:
+        return Config.trajectory_dir
+
+    @staticmethod
+    def set_trajectory_dir(trajectory_dir):
+        Config.trajectory_dir = trajectory_dir
+
+    @staticmethod
+    def get_issue_id() -> Optional[str]:
+        return Config.issue_id
+
+    @staticmethod
+    def set_issue_id(issue_id):
+        Config.issue_id = issue_id
+
+    @staticmethod
+    def get_symbol_index_dir() -> Optional[str]:
+        return Config.symbol_index_dir
+
+    @staticmethod
+    def set_symbol_index_dir(symbol_index_dir):
+        Config.symbol_index_dir = symbol_index_dir
+
+    @staticmethod
+    def get_transport() -> str:
+        return Config.transport
+
+    @staticmethod
+    def set_transport(transport):
+        Config.transport = transport
+
+    @staticmethod
+    def get_scratch_dir() -> Optional[str]:
+        return Config.scratch_dir
+
+    @staticmethod
+    def set_scratch_dir(scratch_dir):
+        Config.scratch_dir = scratch_dir
+
+    @staticmethod
+    def get_debug() -> bool:
+        return Config.debug.lower() == "true"
+
+    @staticmethod
+    def set_debug(debug):
+        Config.debug = debug
+
+    @staticmethod
+    def get_daemon() -> str:
+        return Config.daemon
+
+    @staticmethod
+    def set_daemon(daemon):
+        Config.daemon = daemon
+
+    @staticmethod
+    def get_similarity_dir() -> Optional[str]:
+        return Config.similarity_dir
+
+    @staticmethod
+    def set_similarity_dir(similarity_dir):
+        Config.similarity_dir = similarity_dir
+
+    @staticmethod
+    def get_hedge() -> bool:
+        return Config.hedge.lower() == "true"
+
+    @staticmethod
+    def set_hedge(hedge):
+        Config.hedge = hedge
+
+    @staticmethod
+    def get_hedge_percentile() -> float:
+        return float(Config.hedge_percentile)
+
+    @staticmethod
+    def set_hedge_percentile(hedge_percentile):
+        Config.hedge_percentile = hedge_percentile
+
+    @staticmethod
+    def get_hedge_max_rate() -> float:
+        return float(Config.hedge_max_rate)
+
+    @staticmethod
+    def set_hedge_max_rate(hedge_max_rate):
+        Config.hedge_max_rate = hedge_max_rate
+
+    @staticmethod
+    def get_validate() -> bool:
+        return Config.validate.lower() == "true"
+
+    @staticmethod
+    def set_validate(validate):
+        Config.validate = validate
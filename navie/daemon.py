@@ -0,0 +1,651 @@
+"""
+A resident navie process for one repository, so that repeated runs don't start cold.
+
+The daemon listens for HTTP on localhost and accepts plan, context, generate and edit
+jobs. Jobs are queued by priority (higher first, then in order of submission) and run on
+a bounded pool of worker threads. Edit jobs write to the working tree, so they run one
+at a time, in a lane of their own. Between jobs the daemon keeps:
+
+- the results of recent jobs, in memory, so an identical job is answered without reading
+  the on-disk cache;
+- the symbol index (when APPMAP_NAVIE_SYMBOL_INDEX_DIR is configured), updated
+  incrementally before each job rather than reloaded.
+
+Start it in the repository root:
+
+    python -m navie.daemon [--port PORT] [--workers N]
+
+It writes its address to .navie/daemon.json, where DaemonClient.discover() finds it.
+The CLIs use a running daemon automatically unless APPMAP_NAVIE_DAEMON is "off".
+
+Edit jobs rewrite the working tree, so requests must prove that they can read the
+discovery file: it holds a random token, readable only by its owner, which every request
+sends in the X-Navie-Token header. POST bodies must be application/json, which a web page
+can't send cross-origin without a preflight that the daemon doesn't answer.
+
+Endpoints (JSON in and out):
+
+    POST /jobs                 {"kind", "params", "priority", "work_dir", "root"} -> job
+    GET  /jobs                 all jobs
+    GET  /jobs/<id>?wait=<s>   a job, waiting up to s seconds for it to finish
+    POST /jobs/<id>/cancel     cancel a job
+    GET  /health
+    POST /shutdown
+
+A queued job is canceled outright. A running job can't be interrupted; its result is
+discarded, and an edit job stops writing files at the next one.
+"""
+
+import argparse
+import hashlib
+import heapq
+import hmac
+import itertools
+import json
+import os
+import secrets
+import signal
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+from navie import trace
+from navie.config import Config
+from navie.editor import Editor
+from navie.hedge import hedger
+from navie.symbol_index import open_index
+
+DISCOVERY_FILE = os.path.join(".navie", "daemon.json")
+TOKEN_HEADER = "X-Navie-Token"
+DEFAULT_WORKERS = 4
+# The number of job results kept in memory
+MEMORY_CACHE_SIZE = 256
+# The longest a single status request waits for a job to finish
+MAX_WAIT_SECONDS = 60
+# Finished jobs, with their results, are forgotten after JOB_TTL_SECONDS, and beyond
+# the MAX_FINISHED_JOBS most recent
+JOB_TTL_SECONDS = 3600
+MAX_FINISHED_JOBS = 1000
+
+# The Edit attributes that an edit job can set
+EDIT_OPTIONS = (
+    "files",
+    "slice_files",
+    "debug_snapshots",
+    "min_confidence",
+    "batch",
+    "chunk_large_files",
+    "prefetch_files",
+    "early_generation",
+    "temperature",
+)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELED = "canceled"
+FINISHED = (DONE, FAILED, CANCELED)
+
+
+class JobFailed(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, id: str, kind: str, params: dict, priority: int, work_dir: str):
+        self.id = id
+        self.kind = kind
+        self.params = params
+        self.priority = priority
+        self.work_dir = work_dir
+        self.status = QUEUED
+        self.result = None
+        self.error: Optional[str] = None
+        self.cached = False
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.canceled = threading.Event()
+        self.finished = threading.Event()
+
+    @property
+    def key(self) -> str:
+        return hashlib.sha256(
+            json.dumps(
+                [self.kind, self.work_dir, self.params], sort_keys=True
+            ).encode("utf-8")
+        ).hexdigest()
+
+    def finish(self, status: str, result=None, error: Optional[str] = None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished_at = time.time()
+        self.finished.set()
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "priority": self.priority,
+            "work_dir": self.work_dir,
+            "cached": self.cached,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    """Jobs by priority, highest first; jobs of equal priority in submission order."""
+
+    def __init__(self):
+        self._heap: list[tuple[int, int, Job]] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def put(self, job: Job):
+        with self._condition:
+            heapq.heappush(self._heap, (-job.priority, next(self._sequence), job))
+            self._condition.notify()
+
+    def get(self) -> Optional[Job]:
+        """The next job that hasn't been canceled, or None once the queue is closed."""
+        with self._condition:
+            while True:
+                while self._heap:
+                    _, _, job = heapq.heappop(self._heap)
+                    if not job.canceled.is_set():
+                        return job
+                if self._closed:
+                    return None
+                self._condition.wait()
+
+    def __len__(self):
+        with self._condition:
+            return sum(1 for _, _, job in self._heap if not job.canceled.is_set())
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+def _editor(job: Job) -> Editor:
+    return Editor(
+        job.work_dir,
+        temperature=job.params.get("temperature"),
+        token_limit=job.params.get("token_limit"),
+    )
+
+
+def _run_plan(job: Job):
+    params = job.params
+    return _editor(job).plan(
+        params["issue"],
+        context=params.get("context"),
+        options=params.get("options"),
+        prompt=params.get("prompt"),
+        cache=params.get("cache", True),
+    )
+
+
+def _run_context(job: Job):
+    params = job.params
+    return _editor(job).context(
+        params["query"],
+        options=params.get("options"),
+        vectorize_query=params.get("vectorize_query", True),
+        exclude_pattern=params.get("exclude_pattern"),
+        include_pattern=params.get("include_pattern"),
+        cache=params.get("cache", True),
+    )
+
+
+def _run_generate(job: Job):
+    params = job.params
+    return _editor(job).generate(
+        plan=params["plan"],
+        context=params.get("context"),
+        options=params.get("options"),
+        prompt=params.get("prompt"),
+        cache=params.get("cache", True),
+    )
+
+
+def _run_edit(job: Job):
+    # Imported here because navie.mode.edit pulls in the interactive UI modules
+    from navie.mode.edit import Edit
+
+    params = job.params
+    edit = Edit(job.work_dir, params["problem_statement"])
+    edit.interactive = False
+    for option in EDIT_OPTIONS:
+        if option in params:
+            setattr(edit, option, params[option])
+
+    plan = edit.plan()
+    diffs = {}
+
+    def confirm_diff(file, diff):
+        if job.canceled.is_set():
+            return False
+        diffs[file] = diff
+        return True
+
+    edit.apply(confirm_diff)
+    return {"plan": plan, "files_to_edit": edit.files_to_edit, "diffs": diffs}
+
+
+JOB_KINDS = {
+    "plan": _run_plan,
+    "context": _run_context,
+    "generate": _run_generate,
+    "edit": _run_edit,
+}
+# Jobs that change the working tree aren't answered from memory, and run one at a time
+UNCACHED_KINDS = ("edit",)
+SERIAL_KINDS = ("edit",)
+
+
+class Daemon:
+    def __init__(
+        self,
+        root: str = ".",
+        host: str = "127.0.0.1",
+        port: int = 0,
+        workers: int = DEFAULT_WORKERS,
+    ):
+        self.root = os.path.abspath(root)
+        self.workers = workers
+        self.queue = JobQueue()
+        self.serial_queue = JobQueue()
+        self.jobs: dict[str, Job] = {}
+        self.results: OrderedDict[str, object] = OrderedDict()
+        self.symbol_index = None
+        self.token = secrets.token_hex(32)
+
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._threads: list[threading.Thread] = []
+        self.server = ThreadingHTTPServer((host, port), _handler(self))
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Start the workers and write the discovery file; serve() answers requests."""
+        if Config.get_symbol_index_dir():
+            self.symbol_index = open_index(self.root, Config.get_symbol_index_dir())
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._work,
+                args=(self.queue,),
+                name=f"navie-daemon-{index}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(
+            target=self._work,
+            args=(self.serial_queue,),
+            name="navie-daemon-serial",
+            daemon=True,
+        )
+        thread.start()
+        self._threads.append(thread)
+        _write_discovery(
+            os.path.join(self.root, DISCOVERY_FILE),
+            {
+                "url": self.url,
+                "pid": os.getpid(),
+                "root": self.root,
+                "token": self.token,
+            },
+        )
+
+    def serve(self):
+        try:
+            self.server.serve_forever()
+        finally:
+            self.stop()
+
+    def shutdown(self):
+        """Stop serving; safe to call from a request handler or a signal handler."""
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    def stop(self):
+        self.queue.close()
+        self.serial_queue.close()
+        with self._lock:
+            for job in self.jobs.values():
+                if job.status == QUEUED:
+                    self._cancel(job)
+        for thread in self._threads:
+            thread.join()
+        self.server.server_close()
+        discovery_file = os.path.join(self.root, DISCOVERY_FILE)
+        if _read_discovery(discovery_file).get("pid") == os.getpid():
+            os.remove(discovery_file)
+
+    def submit(self, kind: str, params: dict, priority: int = 0, work_dir=None) -> Job:
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        work_dir = work_dir or os.path.join(".navie", "daemon", kind)
+        with self._lock:
+            self._evict_jobs()
+            job = Job(str(next(self._ids)), kind, params, priority, work_dir)
+            self.jobs[job.id] = job
+            if kind not in UNCACHED_KINDS and job.key in self.results:
+                job.cached = True
+                job.started_at = job.submitted_at
+                job.finish(DONE, self.results[job.key])
+                self.results.move_to_end(job.key)
+                return job
+        (self.serial_queue if kind in SERIAL_KINDS else self.queue).put(job)
+        return job
+
+    @property
+    def queued(self) -> int:
+        return len(self.queue) + len(self.serial_queue)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job:
+                self._cancel(job)
+            return job
+
+    def _cancel(self, job: Job):
+        if job.status in FINISHED:
+            return
+        job.canceled.set()
+        if job.status == QUEUED:
+            job.finish(CANCELED)
+
+    def _evict_jobs(self):
+        finished = [job for job in self.jobs.values() if job.status in FINISHED]
+        expired = time.time() - JOB_TTL_SECONDS
+        for index, job in enumerate(finished):
+            # A job that is finishing right now has its status before its time
+            finished_at = job.finished_at or time.time()
+            if finished_at < expired or index < len(finished) - MAX_FINISHED_JOBS:
+                del self.jobs[job.id]
+
+    def _work(self, queue: JobQueue):
+        while True:
+            job = queue.get()
+            if job is None:
+                return
+            self._run(job)
+
+    def _run(self, job: Job):
+        with self._lock:
+            if job.canceled.is_set():
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+
+        try:
+            with trace.span("daemon.job", kind=job.kind, job_id=job.id):
+                if self.symbol_index:
+                    self.symbol_index.update()
+                result = JOB_KINDS[job.kind](job)
+        except Exception as e:
+            traceback.print_exc()
+            status, result, error = FAILED, None, f"{type(e).__name__}: {e}"
+        else:
+            status, error = DONE, None
+
+        with self._lock:
+            if job.canceled.is_set():
+                job.finish(CANCELED)
+                return
+            if status == DONE and job.kind not in UNCACHED_KINDS:
+                self.results[job.key] = result
+                self.results.move_to_end(job.key)
+                while len(self.results) > MEMORY_CACHE_SIZE:
+                    self.results.popitem(last=False)
+            job.finish(status, result, error)
+
+
+def _handler(daemon: Daemon):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if not self._authorized():
+                return
+            url = urlparse(self.path)
+            parts = url.path.strip("/").split("/")
+            if parts == ["health"]:
+                return self._reply(
+                    200,
+                    {
+                        "root": daemon.root,
+                        "pid": os.getpid(),
+                        "queued": daemon.queued,
+                        "hedge": hedger().stats(),
+                    },
+                )
+            if parts == ["jobs"]:
+                with daemon._lock:
+                    jobs = [job.to_dict() for job in daemon.jobs.values()]
+                return self._reply(200, {"jobs": jobs})
+            if len(parts) == 2 and parts[0] == "jobs":
+                job = daemon.jobs.get(parts[1])
+                if not job:
+                    return self._reply(404, {"error": f"No job {parts[1]}"})
+                wait = parse_qs(url.query).get("wait")
+                if wait:
+                    job.finished.wait(min(float(wait[0]), MAX_WAIT_SECONDS))
+                return self._reply(200, job.to_dict())
+            self._reply(404, {"error": f"Not found: {url.path}"})
+
+        def do_POST(self):
+            if not self._authorized():
+                return
+            content_type = self.headers.get("Content-Type", "")
+            if content_type.split(";")[0].strip().lower() != "application/json":
+                return self._reply(415, {"error": "Requests must be application/json"})
+            parts = urlparse(self.path).path.strip("/").split("/")
+            if parts == ["shutdown"]:
+                self._reply(200, {})
+                return daemon.shutdown()
+            if len(parts) == 3 and parts[0] == "jobs" and parts[2] == "cancel":
+                job = daemon.cancel(parts[1])
+                if not job:
+                    return self._reply(404, {"error": f"No job {parts[1]}"})
+                return self._reply(200, job.to_dict())
+            if parts != ["jobs"]:
+                return self._reply(404, {"error": f"Not found: {self.path}"})
+
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError as e:
+                return self._reply(400, {"error": f"Invalid JSON: {e}"})
+            root = request.get("root")
+            if root and os.path.abspath(root) != daemon.root:
+                return self._reply(
+                    409, {"error": f"This daemon serves {daemon.root}, not {root}"}
+                )
+            try:
+                job = daemon.submit(
+                    request.get("kind"),
+                    request.get("params") or {},
+                    priority=int(request.get("priority", 0)),
+                    work_dir=request.get("work_dir"),
+                )
+            except ValueError as e:
+                return self._reply(400, {"error": str(e)})
+            self._reply(202, job.to_dict())
+
+        def _authorized(self) -> bool:
+            token = self.headers.get(TOKEN_HEADER, "")
+            if hmac.compare_digest(token.encode("utf-8"), daemon.token.encode("utf-8")):
+                return True
+            self._reply(401, {"error": f"Missing or wrong {TOKEN_HEADER}"})
+            return False
+
+        def _reply(self, status: int, body: dict):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def _write_discovery(path: str, info: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    # Only the owner may read the token
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(info, f)
+    os.replace(tmp_path, path)
+
+
+def _read_discovery(path: str) -> dict:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+class DaemonClient:
+    def __init__(self, url: str, root: str, token: str = ""):
+        self.url = url
+        self.root = root
+        self.token = token
+
+    @staticmethod
+    def discover(root: str = ".") -> Optional["DaemonClient"]:
+        """The daemon serving a directory, if one is running and daemons are enabled."""
+        if Config.get_daemon() == "off":
+            return None
+        root = os.path.abspath(root)
+        info = _read_discovery(os.path.join(root, DISCOVERY_FILE))
+        if not info or info.get("root") != root:
+            return None
+        try:
+            os.kill(info["pid"], 0)
+        except (ProcessLookupError, KeyError, TypeError):
+            return None
+        except PermissionError:
+            pass
+        client = DaemonClient(info["url"], root, info.get("token", ""))
+        try:
+            client._request("GET", "/health", timeout=1)
+        except (OSError, JobFailed):
+            return None
+        return client
+
+    def submit(self, kind: str, params: dict, priority: int = 0, work_dir=None) -> dict:
+        return self._request(
+            "POST",
+            "/jobs",
+            {
+                "kind": kind,
+                "params": params,
+                "priority": priority,
+                "work_dir": work_dir,
+                "root": self.root,
+            },
+        )
+
+    def status(self, job_id: str, wait: Optional[float] = None) -> dict:
+        query = f"?wait={wait}" if wait else ""
+        return self._request("GET", f"/jobs/{job_id}{query}", timeout=(wait or 0) + 30)
+
+    def cancel(self, job_id: str) -> dict:
+        return self._request("POST", f"/jobs/{job_id}/cancel")
+
+    def wait(self, job_id: str, timeout: Optional[float] = None):
+        """Wait for a job to finish, and return its result."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = MAX_WAIT_SECONDS
+            if deadline is not None:
+                remaining = min(remaining, max(deadline - time.monotonic(), 0.01))
+            job = self.status(job_id, wait=remaining)
+            if job["status"] == DONE:
+                return job["result"]
+            if job["status"] in FINISHED:
+                raise JobFailed(f"Job {job_id} {job['status']}: {job['error'] or ''}")
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Job {job_id} is still {job['status']}")
+
+    def run(self, kind: str, params: dict, priority: int = 0, work_dir=None):
+        """Submit a job and wait for its result. The job is canceled on interrupt."""
+        job = self.submit(kind, params, priority=priority, work_dir=work_dir)
+        try:
+            return self.wait(job["id"])
+        except KeyboardInterrupt:
+            self.cancel(job["id"])
+            raise
+
+    def _request(self, method: str, path: str, body=None, timeout: float = 30) -> dict:
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = urllib.request.Request(
+            self.url + path,
+            data=data,
+            method=method,
+            headers={"Content-Type": "application/json", TOKEN_HEADER: self.token},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.load(e).get("error", str(e))
+            except ValueError:
+                message = str(e)
+            raise JobFailed(message) from e
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve navie jobs for a repository")
+    parser.add_argument("-d", "--directory", help="Repository root")
+    parser.add_argument("--port", type=int, default=0, help="Port; 0 picks a free one")
+    parser.add_argument(
+        "--workers", type=int, default=DEFAULT_WORKERS, help="Jobs that run at once"
+    )
+    args = parser.parse_args()
+
+    if args.directory:
+        os.chdir(args.directory)
+
+    daemon = Daemon(".", port=args.port, workers=args.workers)
+    daemon.start()
+    signal.signal(signal.SIGTERM, lambda *_: daemon.shutdown())
+    print(f"Serving {daemon.root} at {daemon.url}")
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+A line diff for large files, producing the same output format as difflib.unified_diff.
+
+Lines are interned to integer ids, so comparisons are integer comparisons. The common
+prefix and suffix are trimmed first. The remainder is split recursively on patience
+anchors (lines that occur exactly once on each side), and the gaps between anchors are
+diffed with Myers' O(ND) algorithm. Gaps that Myers can't resolve within a bounded edit
+distance are reported as replaced.
+"""
+
+from bisect import bisect_left
+from collections import Counter
+from typing import Iterator, Optional
+
+# Gaps at most this large (len(a) + len(b)) go straight to Myers.
+MYERS_DIRECT_SIZE = 2000
+# Give up on Myers beyond this edit distance.
+MYERS_MAX_DISTANCE = 2000
+
+
+def intern_lines(a: list[str], b: list[str]) -> tuple[list[int], list[int]]:
+    ids: dict[str, int] = {}
+    a_ids = [ids.setdefault(line, len(ids)) for line in a]
+    b_ids = [ids.setdefault(line, len(ids)) for line in b]
+    return a_ids, b_ids
+
+
+def _myers(a, alo, ahi, b, blo, bhi, max_distance) -> Optional[list[tuple[int, int]]]:
+    """
+    Matched (i, j) line pairs of a[alo:ahi] and b[blo:bhi], in order, or None if the
+    edit distance exceeds max_distance.
+    """
+    n, m = ahi - alo, bhi - blo
+    v = {1: 0}
+    trace = []
+    for d in range(min(n + m, max_distance) + 1):
+        trace.append(v.copy())
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, n, m, alo, blo)
+    return None
+
+
+def _backtrack(trace, n, m, alo, blo) -> list[tuple[int, int]]:
+    matches = []
+    x, y = n, m
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            matches.append((alo + x, blo + y))
+        x, y = prev_x, prev_y
+    matches.reverse()
+    return matches
+
+
+def _patience_anchors(a, alo, ahi, b, blo, bhi) -> list[tuple[int, int]]:
+    a_counts = Counter(a[alo:ahi])
+    b_counts = Counter(b[blo:bhi])
+    unique_ids = {
+        line for line, count in a_counts.items() if count == 1
+    }.intersection(line for line, count in b_counts.items() if count == 1)
+    if not unique_ids:
+        return []
+
+    b_positions = {b[j]: j for j in range(blo, bhi) if b[j] in unique_ids}
+    unique = [(i, b_positions[a[i]]) for i in range(alo, ahi) if a[i] in unique_ids]
+
+    # Longest increasing subsequence of the b positions
+    tails: list[int] = []
+    tail_index: list[int] = []
+    previous: list[int] = []
+    for index, (_, j) in enumerate(unique):
+        position = bisect_left(tails, j)
+        if position == len(tails):
+            tails.append(j)
+            tail_index.append(index)
+        else:
+            tails[position] = j
+            tail_index[position] = index
+        previous.append(tail_index[position - 1] if position > 0 else -1)
+
+    anchors = []
+    index = tail_index[-1] if tail_index else -1
+    while index != -1:
+        anchors.append(unique[index])
+        index = previous[index]
+    anchors.reverse()
+    return anchors
+
+
+def _common_prefix(a, alo, ahi, b, blo, bhi) -> int:
+    # Galloping comparison of slices, so long runs are compared at C speed
+    limit = min(ahi - alo, bhi - blo)
+    size, step = 0, 1
+    while size < limit:
+        step = min(step, limit - size)
+        if a[alo + size : alo + size + step] == b[blo + size : blo + size + step]:
+            size += step
+            step *= 2
+        elif step == 1:
+            break
+        else:
+            step //= 2
+    return size
+
+
+def _common_suffix(a, alo, ahi, b, blo, bhi) -> int:
+    limit = min(ahi - alo, bhi - blo)
+    size, step = 0, 1
+    while size < limit:
+        step = min(step, limit - size)
+        if a[ahi - size - step : ahi - size] == b[bhi - size - step : bhi - size]:
+            size += step
+            step *= 2
+        elif step == 1:
+            break
+        else:
+            step //= 2
+    return size
+
+
+def _anchor_runs(anchors: list[tuple[int, int]]) -> list[tuple[int, int, int]]:
+    runs = []
+    for i, j in anchors:
+        if runs and runs[-1][0] + runs[-1][2] == i and runs[-1][1] + runs[-1][2] == j:
+            runs[-1] = (runs[-1][0], runs[-1][1], runs[-1][2] + 1)
+        else:
+            runs.append((i, j, 1))
+    return runs
+
+
+def matching_blocks(a: list[int], b: list[int]) -> list[tuple[int, int, int]]:
+    """
+    Matched blocks (i, j, size) between two interned sequences, in order, like
+    difflib.SequenceMatcher.get_matching_blocks() without the trailing sentinel.
+    """
+    blocks: list[tuple[int, int, int]] = []
+    # Work items are ranges (alo, ahi, blo, bhi) to diff, or matched blocks (i, j, size),
+    # pushed in reverse so they pop in order
+    stack: list = [(0, len(a), 0, len(b))]
+    while stack:
+        item = stack.pop()
+        if len(item) == 3:
+            blocks.append(item)
+            continue
+
+        alo, ahi, blo, bhi = item
+        prefix = _common_prefix(a, alo, ahi, b, blo, bhi)
+        if prefix:
+            blocks.append((alo, blo, prefix))
+            alo, blo = alo + prefix, blo + prefix
+        suffix = _common_suffix(a, alo, ahi, b, blo, bhi)
+        ahi, bhi = ahi - suffix, bhi - suffix
+
+        pending: list = [(ahi, bhi, suffix)] if suffix else []
+        if alo < ahi and blo < bhi:
+            resolved = None
+            anchors = []
+            if (ahi - alo) + (bhi - blo) > MYERS_DIRECT_SIZE:
+                anchors = _patience_anchors(a, alo, ahi, b, blo, bhi)
+            if not anchors:
+                resolved = _myers(a, alo, ahi, b, blo, bhi, MYERS_MAX_DISTANCE)
+
+            if resolved is not None:
+                pending.extend(reversed(_anchor_runs(resolved)))
+            elif anchors:
+                # Runs of anchors, and the ranges between them that may contain more
+                # matches
+                runs = _anchor_runs(anchors)
+                bounds = [(alo, blo, 0)] + runs + [(ahi, bhi, 0)]
+                for index in range(len(bounds) - 1, 0, -1):
+                    i1, j1, size1 = bounds[index - 1]
+                    i2, j2, _ = bounds[index]
+                    if index < len(bounds) - 1:
+                        pending.append(bounds[index])
+                    if i1 + size1 < i2 and j1 + size1 < j2:
+                        pending.append((i1 + size1, i2, j1 + size1, j2))
+            # Otherwise, nothing in the range matches
+
+        stack.extend(pending)
+    return blocks
+
+
+def opcodes(a: list[str], b: list[str]) -> list[tuple[str, int, int, int, int]]:
+    """Like difflib.SequenceMatcher(None, a, b).get_opcodes()."""
+    if a == b:
+        return [("equal", 0, len(a), 0, len(b))] if a else []
+
+    a_ids, b_ids = intern_lines(a, b)
+    codes = []
+    i = j = 0
+    for ai, bj, size in matching_blocks(a_ids, b_ids) + [(len(a), len(b), 0)]:
+        if i < ai and j < bj:
+            codes.append(("replace", i, ai, j, bj))
+        elif i < ai:
+            codes.append(("delete", i, ai, j, bj))
+        elif j < bj:
+            codes.append(("insert", i, ai, j, bj))
+        if size:
+            if codes and codes[-1][0] == "equal" and codes[-1][2] == ai:
+                tag, i1, _, j1, _ = codes[-1]
+                codes[-1] = (tag, i1, ai + size, j1, bj + size)
+            else:
+                codes.append(("equal", ai, ai + size, bj, bj + size))
+        i, j = ai + size, bj + size
+    return codes
+
+
+def grouped_opcodes(codes, n=3) -> Iterator[list[tuple[str, int, int, int, int]]]:
+    """Like difflib.SequenceMatcher.get_grouped_opcodes(n)."""
+    if not codes:
+        codes = [("equal", 0, 1, 0, 1)]
+    codes = list(codes)
+    if codes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if codes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+
+    nn = n + n
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal" and i2 - i1 > nn:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+
+def _format_range(start, stop) -> str:
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return f"{beginning}"
+    if not length:
+        beginning -= 1
+    return f"{beginning},{length}"
+
+
+def unified_diff(
+    a: list[str], b: list[str], fromfile="", tofile="", n=3, lineterm="\n"
+) -> str:
+    """
+    The unified diff of two lists of lines, formatted exactly like
+    "".join(difflib.unified_diff(a, b, fromfile, tofile, n=n, lineterm=lineterm)).
+    Returns "" when the lines are identical.
+    """
+    if a == b:
+        return ""
+
+    output = []
+    for group in grouped_opcodes(opcodes(a, b), n):
+        if not output:
+            output.append(f"--- {fromfile}{lineterm}")
+            output.append(f"+++ {tofile}{lineterm}")
+        first, last = group[0], group[-1]
+        file1_range = _format_range(first[1], last[2])
+        file2_range = _format_range(first[3], last[4])
+        output.append(f"@@ -{file1_range} +{file2_range} @@{lineterm}")
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                output.extend(" " + line for line in a[i1:i2])
+                continue
+            if tag in ("replace", "delete"):
+                output.extend("-" + line for line in a[i1:i2])
+            if tag in ("replace", "insert"):
+                output.extend("+" + line for line in b[j1:j2])
+    return "".join(output)
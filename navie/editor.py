@@ -1,15 +1,38 @@
+import contextvars
+import hashlib
 import json
+import math
 import os
 import re
 import shutil
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import cast
 
 import yaml
+from navie import trace
 from navie.config import Config
 from navie.with_cache import with_cache
 from navie.fences import extract_fenced_content
 from navie.client import Client
+from navie.scratch import Scratch
+from navie.slicer import IDENTIFIER_RE, parse_terms
+from navie.similarity import open_similarity_index
+from navie.symbol_index import open_index
+from navie.trajectory import next_call_id
+from navie.validators import MAX_REASKS, InvalidOutput, validator_for
+
+# The name of the link, in each operation's work dir, to the directory of its latest call
+LATEST_CALL_LINK = "latest"
+# The call directories kept in each operation's work dir; older ones are removed
+MAX_CALL_DIRS = 20
+CALL_ID_RE = re.compile(r"^\d{8}T\d{6}-\d+-\d+$")
+
+SIMILAR_PLAN_PROMPT = """A plan was written for a near-duplicate of this issue. Use it as a
+starting point, and revise it where this issue differs.
+
+{plan}"""
 
 
 class Editor:
@@ -23,6 +46,8 @@ class Editor:
         log=None,
         clean=Config.get_clean(),
         trajectory_file=Config.get_trajectory_file(),
+        trajectory_dir=Config.get_trajectory_dir(),
+        symbol_index=None,  # Or configure APPMAP_NAVIE_SYMBOL_INDEX_DIR to index the current directory
     ):
         self.work_dir = work_dir
         os.makedirs(self.work_dir, exist_ok=True)
@@ -46,6 +71,12 @@ class Editor:
             self.log = log_message
         self.clean = clean
         self.trajectory_file = trajectory_file
+        self.trajectory_dir = trajectory_dir
+        self._symbol_index = symbol_index
+        # The span that the operations of a sub-editor are traced under
+        self.trace_parent = None
+        self._cleaned_work_dirs = set()
+        self._cleaned_work_dirs_lock = threading.Lock()
 
         self._plan = None
         self._context = None
@@ -57,7 +88,7 @@ class Editor:
 
         :param work_dir: The name of the subdirectory to create.
         """
-        return Editor(
+        editor = Editor(
             os.path.join(self.work_dir, work_dir),
             temperature=self.temperature,
             token_limit=self.token_limit,
@@ -65,12 +96,30 @@ class Editor:
             log=self.log,
             clean=self.clean,
             trajectory_file=self.trajectory_file,
+            trajectory_dir=self.trajectory_dir,
+            symbol_index=self._symbol_index,
         )
+        with trace.within(self.trace_parent):
+            editor.trace_parent = trace.child("editor.sub_editor", work_dir=work_dir)
+        return editor
+
+    @property
+    def symbol_index(self):
+        if self._symbol_index is None and Config.get_symbol_index_dir():
+            self._symbol_index = open_index(os.getcwd(), Config.get_symbol_index_dir())
+        return self._symbol_index
+
+    @property
+    def similarity_index(self):
+        # Shared by every Editor, so that results are reused across issues
+        similarity_dir = Config.get_similarity_dir()
+        return open_similarity_index(similarity_dir) if similarity_dir else None
 
     # Set context
     def set_context(self, context):
         self._context = context
 
+    @trace.traced("editor.apply")
     def apply(self, filename, replace, search=None):
         self._log_action("@apply", filename)
 
@@ -78,11 +127,18 @@ class Editor:
             "_"
         )
 
-        work_dir = self._work_dir("apply", filename_slug)
-        succeeded = self._build_client(work_dir).apply(filename, replace, search=search)
+        work_dir = self._call_dir(self._work_dir("apply", filename_slug))
+        scratch = Scratch(work_dir)
+        try:
+            succeeded = self._build_client(work_dir, scratch).apply(
+                filename, replace, search=search
+            )
+        finally:
+            scratch.close()
         message = "Changes applied" if succeeded else "Failed to apply changes"
         self._log_response(message)
 
+    @trace.traced("editor.ask")
     def ask(
         self,
         question,
@@ -98,30 +154,31 @@ class Editor:
         work_dir = self._work_dir(question_name)
 
         def _ask() -> str:
-            input_file = os.path.join(work_dir, f"ask.input.txt")
-            output_file = os.path.join(work_dir, "ask.md")
-
-            with open(input_file, "w") as f:
+            call_dir = self._call_dir(work_dir)
+            scratch = Scratch(call_dir)
+            try:
                 content = []
                 if options:
                     content.append(options)
                 content.append(question)
-                f.write(" ".join(content))
+                input_file = scratch.put("ask.input.txt", " ".join(content))
+                output_file = scratch.path("ask.md")
 
-            context_file = self._save_context(
-                work_dir, "ask", context, auto_context, context_format
-            )
-            prompt_file = self._save_prompt(work_dir, "ask", prompt)
+                context_file = self._save_context(
+                    scratch, "ask", context, auto_context, context_format
+                )
+                prompt_file = self._save_prompt(scratch, "ask", prompt)
 
-            self._build_client(work_dir).ask(
-                input_file,
-                output_file,
-                prompt_file=prompt_file,
-                context_file=context_file,
-            )
+                self._build_client(call_dir, scratch).ask(
+                    input_file,
+                    output_file,
+                    prompt_file=prompt_file,
+                    context_file=context_file,
+                )
 
-            with open(output_file, "r") as f:
-                return f.read()
+                return self._read_output(output_file, scratch)
+            finally:
+                scratch.close()
 
         return (
             cast(
@@ -140,26 +197,45 @@ class Editor:
             else _ask()
         )
 
+    @trace.traced("editor.suggest_terms")
     def suggest_terms(self, question):
+        self._log_action("@generate (terms)", question)
+
+        if self.symbol_index:
+            local_terms = self.symbol_index.answer_terms(question)
+            trace.current().set(local=local_terms is not None)
+            if local_terms is not None:
+                self._log_response(f"{json.dumps(local_terms)} (from the symbol index)")
+                return [json.dumps(local_terms)]
+
         work_dir = self._work_dir("suggest_terms")
-        input_file = os.path.join(work_dir, "terms.input.txt")
-        output_file = os.path.join(work_dir, "terms.json")
 
-        self._log_action("@generate (terms)", question)
+        # The terms prompt is fixed, so a correction is added to the question
+        def _attempt(correction, validator) -> tuple[str, str]:
+            call_dir = self._call_dir(work_dir)
+            scratch = Scratch(call_dir)
+            try:
+                input_file = scratch.put(
+                    "terms.input.txt", _corrected(question, correction)
+                )
+                output_file = scratch.path("terms.json")
 
-        with open(input_file, "w") as f:
-            f.write(question)
+                self._build_client(call_dir, scratch, validator=validator).terms(
+                    input_file, output_file
+                )
 
-        self._build_client(work_dir).terms(input_file, output_file)
+                return self._read_output(output_file, scratch), output_file
+            finally:
+                scratch.close()
 
-        with open(output_file, "r") as f:
-            raw_terms = f.read()
-            terms = extract_fenced_content(raw_terms)
+        raw_terms, output_file = self._validated("terms", _attempt)
+        terms = extract_fenced_content(raw_terms)
 
         self._log_response("\n".join(terms), output_file=output_file)
 
         return terms
 
+    @trace.traced("editor.context")
     def context(
         self,
         query,
@@ -173,29 +249,64 @@ class Editor:
 
         self._log_action("@context", options, query)
 
-        def _context() -> dict:
-            input_file = os.path.join(work_dir, "context.input.txt")
-            output_file = os.path.join(work_dir, "context.yaml")
-
-            with open(input_file, "w") as f:
-                content = []
-                if options:
-                    content.append(options)
-                content.append(query)
-                f.write(" ".join(content))
-
-            self._build_client(work_dir).context(
-                input_file,
-                output_file,
-                exclude_pattern,
-                include_pattern,
-                vectorize_query,
-            )
+        if self.symbol_index and not (options or include_pattern or exclude_pattern):
+            local_context = self.symbol_index.answer_context(query)
+            trace.current().set(local=local_context is not None)
+            if local_context is not None:
+                self._log_response(
+                    f"{len(local_context)} context items (from the symbol index)"
+                )
+                self._context = local_context
+                return self._context
 
-            with open(output_file, "r") as f:
-                raw_context = f.read()
-                context = yaml.safe_load("\n".join(extract_fenced_content(raw_context)))
+        similarity_params = {
+            "options": options,
+            "vectorize_query": vectorize_query,
+            "exclude_pattern": exclude_pattern,
+            "include_pattern": include_pattern,
+        }
+        similarity_index = self.similarity_index if cache else None
 
+        def _context() -> dict:
+            if similarity_index:
+                similar = similarity_index.lookup("context", query, similarity_params)
+                trace.current().set(similar=similar is not None)
+                if similar:
+                    self._log_response(
+                        f"{len(similar.result or [])} context items (from a similar "
+                        f"query, similarity {similar.score:.2f})"
+                    )
+                    return similar.result
+
+            # Context retrieval takes no prompt, so a re-ask is a plain retry
+            def _attempt(correction, validator) -> tuple[str, str]:
+                call_dir = self._call_dir(work_dir)
+                scratch = Scratch(call_dir)
+                try:
+                    content = []
+                    if options:
+                        content.append(options)
+                    content.append(query)
+                    input_file = scratch.put("context.input.txt", " ".join(content))
+                    output_file = scratch.path("context.yaml")
+
+                    self._build_client(call_dir, scratch, validator=validator).context(
+                        input_file,
+                        output_file,
+                        exclude_pattern,
+                        include_pattern,
+                        vectorize_query,
+                    )
+
+                    return self._read_output(output_file, scratch), output_file
+                finally:
+                    scratch.close()
+
+            raw_context, _ = self._validated("context", _attempt)
+            context = yaml.safe_load("\n".join(extract_fenced_content(raw_context)))
+
+            if similarity_index:
+                similarity_index.add("context", query, context, similarity_params)
             return context
 
         self._context = (
@@ -214,6 +325,77 @@ class Editor:
 
         return self._context
 
+    @trace.traced("editor.context_fanout")
+    def context_fanout(
+        self,
+        query,
+        terms=None,
+        include_patterns=(),
+        exclude_pattern=None,
+        options=None,
+        vectorize_query=True,
+        max_workers=4,
+        cache=True,
+        cache_dir=None,
+    ):
+        """
+        Retrieve context with several @context queries run concurrently: the query itself,
+        one per term (by default, the terms suggested for the query), and the query again
+        restricted to each include pattern. The results are merged, de-duplicated by file
+        and line range, and ranked by relevance to the query.
+
+        Each query is cached in its own directory, named by the query and its patterns.
+        Pass a cache_dir that's shared across issues to reuse the results of the queries
+        they have in common.
+        """
+        if terms is None:
+            terms = parse_terms(self.suggest_terms(query))
+
+        queries = [(query, include, exclude_pattern) for include in [None, *include_patterns]]
+        queries.extend(
+            (term, None, exclude_pattern) for term in dict.fromkeys(terms) if term.strip()
+        )
+
+        cache_dir = cache_dir or os.path.join(self.work_dir, "context_fanout")
+
+        def run_query(query_spec):
+            sub_query, include, exclude = query_spec
+            key = hashlib.sha1(
+                json.dumps([sub_query, include, exclude, options]).encode("utf-8")
+            ).hexdigest()[:16]
+            editor = Editor(
+                os.path.join(cache_dir, key),
+                temperature=self.temperature,
+                token_limit=self.token_limit,
+                log=self.log,
+                clean=False,
+                trajectory_file=self.trajectory_file,
+                trajectory_dir=self.trajectory_dir,
+                symbol_index=self._symbol_index,
+            )
+            return editor.context(
+                sub_query,
+                options=options,
+                vectorize_query=vectorize_query,
+                exclude_pattern=exclude,
+                include_pattern=include,
+                cache=cache,
+            )
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Each query runs in a copy of this context, so its spans nest under this one
+            futures = [
+                executor.submit(contextvars.copy_context().run, run_query, query_spec)
+                for query_spec in queries
+            ]
+            results = [future.result() or [] for future in futures]
+
+        items, hits = merge_context(results)
+        self._context = rank_context(items, query, hits)
+        trace.current().set(queries=len(queries), snippets=len(self._context))
+        return self._context
+
+    @trace.traced("editor.plan")
     def plan(
         self,
         issue,
@@ -223,32 +405,67 @@ class Editor:
         prompt=None,
         cache=True,
         auto_context=True,
+        on_output=None,
     ) -> str:
+        """
+        Plan a solution to an issue. on_output, if given, is called with the plan so far
+        as it's written; it isn't called when the plan comes from the cache.
+
+        When a similarity index is configured, the plan of a near-duplicate issue is
+        given to the model as a starting point.
+        """
         work_dir = self._work_dir("plan")
-        issue_file = os.path.join(work_dir, "plan.input.txt")
-        output_file = os.path.join(work_dir, "plan.md")
 
         self._log_action("@plan", options, issue)
 
-        def _plan() -> str:
-            with open(issue_file, "w") as f:
-                content = []
-                if options:
-                    content.append(options)
-                content.append(issue)
-                f.write(" ".join(content))
-
-            context_file = self._save_context(
-                work_dir, "plan", context, auto_context, context_format
-            )
-            prompt_file = self._save_prompt(work_dir, "plan", prompt)
-
-            self._build_client(work_dir).plan(
-                issue_file, output_file, context_file, prompt_file=prompt_file
-            )
+        similarity_params = {"options": options, "context": context, "prompt": prompt}
+        similarity_index = self.similarity_index if cache else None
 
-            with open(output_file, "r") as f:
-                return f.read()
+        def _plan() -> str:
+            issue_content = issue
+            if similarity_index:
+                similar = similarity_index.lookup("plan", issue, similarity_params)
+                trace.current().set(similar=similar is not None)
+                if similar:
+                    self._log_response(
+                        f"Starting from the plan of a similar issue "
+                        f"(similarity {similar.score:.2f})"
+                    )
+                    issue_content = "\n\n".join(
+                        [issue, SIMILAR_PLAN_PROMPT.format(plan=similar.result)]
+                    )
+
+            def _attempt(correction, validator) -> tuple[str, str]:
+                call_dir = self._call_dir(work_dir)
+                scratch = Scratch(call_dir)
+                try:
+                    content = []
+                    if options:
+                        content.append(options)
+                    content.append(issue_content)
+                    issue_file = scratch.put("plan.input.txt", " ".join(content))
+                    output_file = scratch.path("plan.md")
+
+                    context_file = self._save_context(
+                        scratch, "plan", context, auto_context, context_format
+                    )
+                    prompt_file = self._save_prompt(
+                        scratch, "plan", _corrected(prompt, correction)
+                    )
+
+                    self._build_client(call_dir, scratch, on_output, validator).plan(
+                        issue_file, output_file, context_file, prompt_file=prompt_file
+                    )
+
+                    return self._read_output(output_file, scratch), output_file
+                finally:
+                    scratch.close()
+
+            plan, _ = self._validated("plan", _attempt)
+
+            if similarity_index:
+                similarity_index.add("plan", issue, plan, similarity_params)
+            return plan
 
         self._plan = (
             cast(
@@ -268,31 +485,28 @@ class Editor:
 
         return self._plan
 
+    @trace.traced("editor.list_files")
     def list_files(self, content):
         # Scan through all the files in the content and look for file-ish regepx patterns.
         # Select the ones that match up to real, existing files.
 
         self._log_action("list-files", content)
 
-        path_separator = os.path.sep
-        path_separator_escaped = re.escape(path_separator)
-        file_regexp = (
-            r"([a-zA-Z0-9_" + path_separator_escaped + r"\-]+\.(?:[a-zA-Z0-9]{1,4}))\b"
-        )
-
-        detected_files = re.findall(file_regexp, content)
-        # print(f"Path-like strings in content: {detected_files}")
+        files = find_files(content)
 
-        absolute_files = [os.path.abspath(f) for f in detected_files]
-        unique_files = list(set(absolute_files))
-        existing_files = [f for f in unique_files if os.path.exists(f)]
-        files = [os.path.relpath(f) for f in existing_files]
+        if self.symbol_index:
+            # Also files that are named by module name or by a partial path
+            for file in self.symbol_index.resolve_files(content):
+                file = os.path.relpath(os.path.join(self.symbol_index.root, file))
+                if file not in files:
+                    files.append(file)
 
         # print(f"File paths that exist on the filesystem: {files}")
         self._log_response(", ".join(files))
 
         return files
 
+    @trace.traced("editor.generate")
     def generate(
         self,
         plan=None,
@@ -315,31 +529,37 @@ class Editor:
 
         self._log_action("@generate", options, plan)
 
-        def _generate() -> str:
-            plan_file = os.path.join(work_dir, "generate.input.txt")
-            output_file = os.path.join(work_dir, "generate.md")
-
-            with open(plan_file, "w") as f:
+        def _attempt(correction, validator) -> tuple[str, str]:
+            call_dir = self._call_dir(work_dir)
+            scratch = Scratch(call_dir)
+            try:
                 content = []
                 if options:
                     content.append(options)
                 content.append(plan)
-                f.write(" ".join(content))
+                plan_file = scratch.put("generate.input.txt", " ".join(content))
+                output_file = scratch.path("generate.md")
 
-            context_file = self._save_context(
-                work_dir, "generate", context, auto_context, context_format
-            )
-            prompt_file = self._save_prompt(work_dir, "generate", prompt)
+                context_file = self._save_context(
+                    scratch, "generate", context, auto_context, context_format
+                )
+                prompt_file = self._save_prompt(
+                    scratch, "generate", _corrected(prompt, correction)
+                )
 
-            self._build_client(work_dir).generate(
-                plan_file,
-                output_file,
-                context_file=context_file,
-                prompt_file=prompt_file,
-            )
+                self._build_client(call_dir, scratch, validator=validator).generate(
+                    plan_file,
+                    output_file,
+                    context_file=context_file,
+                    prompt_file=prompt_file,
+                )
 
-            with open(output_file, "r") as f:
-                return f.read()
+                return self._read_output(output_file, scratch), output_file
+            finally:
+                scratch.close()
+
+        def _generate() -> str:
+            return self._validated("generate", _attempt)[0]
 
         return (
             cast(
@@ -357,6 +577,7 @@ class Editor:
             else _generate()
         )
 
+    @trace.traced("editor.search")
     def search(
         self,
         query,
@@ -374,38 +595,37 @@ class Editor:
         self._log_action("@search", options, query)
 
         def _search():
-            input_file = os.path.join(work_dir, "search.input.txt")
-            output_file = os.path.join(work_dir, f"search.output.{extension}")
-
-            with open(input_file, "w") as f:
+            call_dir = self._call_dir(work_dir)
+            scratch = Scratch(call_dir)
+            try:
                 content = []
                 if options:
                     content.append(options)
                 content.append(query)
-                f.write(" ".join(content))
-
-            context_file = self._save_context(
-                work_dir, "search", context, auto_context, context_format
-            )
-            prompt_file = self._save_prompt(work_dir, "search", prompt)
+                input_file = scratch.put("search.input.txt", " ".join(content))
+                output_file = scratch.path(f"search.output.{extension}")
 
-            if format:
-                format_file = os.path.join(work_dir, "search.format.txt")
-                with open(format_file, "w") as f:
-                    f.write(format)
-            else:
-                format_file = None
-
-            self._build_client(work_dir).search(
-                input_file,
-                output_file,
-                context_file=context_file,
-                prompt_file=prompt_file,
-                format_file=format_file,
-            )
+                context_file = self._save_context(
+                    scratch, "search", context, auto_context, context_format
+                )
+                prompt_file = self._save_prompt(scratch, "search", prompt)
+
+                if format:
+                    format_file = scratch.put("search.format.txt", format)
+                else:
+                    format_file = None
+
+                self._build_client(call_dir, scratch).search(
+                    input_file,
+                    output_file,
+                    context_file=context_file,
+                    prompt_file=prompt_file,
+                    format_file=format_file,
+                )
 
-            with open(output_file, "r") as f:
-                return f.read()
+                return self._read_output(output_file, scratch)
+            finally:
+                scratch.close()
 
         return (
             cast(
@@ -424,6 +644,7 @@ class Editor:
             else _search()
         )
 
+    @trace.traced("editor.test")
     def test(
         self,
         issue,
@@ -442,29 +663,31 @@ class Editor:
         self._log_action("@test", options, issue)
 
         def _test():
-            issue_file = os.path.join(work_dir, "test.input.txt")
-            output_file = os.path.join(work_dir, "test.md")
-            with open(issue_file, "w") as f:
+            call_dir = self._call_dir(work_dir)
+            scratch = Scratch(call_dir)
+            try:
                 content = []
                 if options:
                     content.append(options)
                 content.append(issue)
-                f.write(" ".join(content))
+                issue_file = scratch.put("test.input.txt", " ".join(content))
+                output_file = scratch.path("test.md")
 
-            context_file = self._save_context(
-                work_dir, "test", context, auto_context, context_format
-            )
-            prompt_file = self._save_prompt(work_dir, "test", prompt)
+                context_file = self._save_context(
+                    scratch, "test", context, auto_context, context_format
+                )
+                prompt_file = self._save_prompt(scratch, "test", prompt)
 
-            self._build_client(work_dir).test(
-                issue_file,
-                output_file,
-                context_file=context_file,
-                prompt_file=prompt_file,
-            )
+                self._build_client(call_dir, scratch).test(
+                    issue_file,
+                    output_file,
+                    context_file=context_file,
+                    prompt_file=prompt_file,
+                )
 
-            with open(output_file, "r") as f:
-                return f.read()
+                return self._read_output(output_file, scratch)
+            finally:
+                scratch.close()
 
         return (
             cast(
@@ -482,11 +705,44 @@ class Editor:
             else _test()
         )
 
-    def _build_client(self, work_dir):
+    def _build_client(self, work_dir, scratch=None, on_output=None, validator=None):
         return Client(
-            work_dir, self.temperature, self.token_limit, self.trajectory_file
+            work_dir,
+            self.temperature,
+            self.token_limit,
+            self.trajectory_file,
+            trajectory_dir=self.trajectory_dir,
+            scratch=scratch,
+            on_output=on_output,
+            validator=validator,
         )
 
+    def _validated(self, operation, attempt) -> tuple[str, str]:
+        """
+        Call attempt(correction, validator), which returns its output and the output
+        file, until the output is valid, asking again with a correction up to
+        MAX_REASKS times. The validator is for the Client, to stop the call as soon as
+        its output can't be valid; the last attempt isn't stopped, and its output is
+        returned whether it's valid or not.
+        """
+        correction = None
+        for _ in range(MAX_REASKS):
+            validator = validator_for(operation)
+            if validator is None:
+                break
+            try:
+                output, output_file = attempt(correction, validator)
+            except InvalidOutput as e:
+                reason = e.reason
+            else:
+                reason = validator.check(output)
+                if reason is None:
+                    return output, output_file
+            trace.current().add(reasks=1)
+            self._log_response(f"Invalid {operation} output ({reason}), asking again")
+            correction = validator.correction(reason)
+        return attempt(correction, None)
+
     def _log_action(self, action, *messages):
         combined_message = " ".join([m for m in messages if m is not None and m != ""])
         clean_content = re.sub(r"[\r\n\t\x0b\x0c]", " ", combined_message)
@@ -505,14 +761,14 @@ class Editor:
             self.log(f"  {output_file}")
         self.log(f"  {clean_content}")
 
-    def _save_context(self, work_dir, name, context, auto_context, context_format):
+    @trace.traced("editor.save_context")
+    def _save_context(self, scratch, name, context, auto_context, context_format):
         if context:
-            context_file = os.path.join(work_dir, f"{name}.context.{context_format}")
             if not isinstance(context, str):
                 context = yaml.dump(context)
 
-            with open(context_file, "w") as f:
-                f.write(context)
+            context_file = scratch.put(f"{name}.context.{context_format}", context)
+            trace.current().set(bytes=len(context))
         else:
             if not auto_context:
                 raise ValueError(
@@ -522,16 +778,22 @@ class Editor:
 
         return context_file
 
-    def _save_prompt(self, work_dir, name, prompt):
+    @trace.traced("editor.save_prompt")
+    def _save_prompt(self, scratch, name, prompt):
         if prompt:
-            prompt_file = os.path.join(work_dir, f"{name}.prompt.md")
-            with open(prompt_file, "w") as f:
-                f.write(prompt)
+            prompt_file = scratch.put(f"{name}.prompt.md", prompt)
+            trace.current().set(bytes=len(prompt))
         else:
             prompt_file = None
 
         return prompt_file
 
+    @trace.traced("editor.read_output")
+    def _read_output(self, output_file, scratch):
+        output = scratch.read_output(output_file)
+        trace.current().set(bytes=len(output))
+        return output
+
     def _save_cache(self, work_dir, *contents):
         # Enumerate the contents in pairs. The first item is the content, and the second item is the content name.
         for i in range(0, len(contents), 2):
@@ -570,11 +832,19 @@ class Editor:
             cached_content = f.read()
             return cached_content == content
 
+    @trace.traced("editor.work_dir")
     def _work_dir(self, *name_tokens):
-        rename_existing = self.clean
-
         name = os.path.sep.join(name_tokens)
         work_dir = os.path.join(self.work_dir, name)
+        trace.current().set(work_dir=work_dir)
+
+        # Each call has its own directory (see _call_dir), so an operation's work dir is
+        # only cleaned the first time this Editor uses it; cleaning it again could move
+        # the files of a concurrent call.
+        with self._cleaned_work_dirs_lock:
+            rename_existing = self.clean and work_dir not in self._cleaned_work_dirs
+            self._cleaned_work_dirs.add(work_dir)
+
         if rename_existing and os.path.exists(work_dir):
             # Rename the existing work dir according to the timestamp of the oldest file in the directory
             files = [
@@ -598,3 +868,134 @@ class Editor:
 
         os.makedirs(work_dir, exist_ok=True)
         return work_dir
+
+    def _call_dir(self, work_dir):
+        """
+        Create a directory for one call within an operation's work dir, so that
+        concurrent calls don't share input, output or log files. The work dir's "latest"
+        link points to the most recent call, and only the MAX_CALL_DIRS most recent
+        calls are kept.
+        """
+        call_id = next_call_id()
+        call_dir = os.path.join(work_dir, call_id)
+        os.makedirs(call_dir)
+        trace.current().set(call_dir=call_dir)
+
+        latest = os.path.join(work_dir, LATEST_CALL_LINK)
+        tmp_link = f"{latest}.{call_id}.tmp"
+        try:
+            os.symlink(call_id, tmp_link)
+            os.replace(tmp_link, latest)
+        except OSError:
+            # Without symlinks, record the name of the latest call
+            with open(f"{latest}.txt", "w") as f:
+                f.write(call_id)
+        self._prune_call_dirs(work_dir)
+        return call_dir
+
+    def _prune_call_dirs(self, work_dir):
+        # Call ids start with their time, so they sort oldest first
+        call_ids = sorted(
+            name
+            for name in os.listdir(work_dir)
+            if CALL_ID_RE.match(name)
+            and not os.path.islink(os.path.join(work_dir, name))
+        )
+        for call_id in call_ids[:-MAX_CALL_DIRS]:
+            shutil.rmtree(os.path.join(work_dir, call_id), ignore_errors=True)
+
+
+LOCATION_RE = re.compile(r"^(.*?)(?::(\d+)(?:-(\d+))?)?$")
+
+
+FILE_RE = re.compile(
+    r"([a-zA-Z0-9_" + re.escape(os.path.sep) + r"\-]+\.(?:[a-zA-Z0-9]{1,4}))\b"
+)
+
+
+def _corrected(text, correction):
+    if not correction:
+        return text
+    return f"{text}\n\n{correction}" if text else correction
+
+
+def find_files(content) -> list[str]:
+    """The paths of the existing files that are named in the content."""
+    detected_files = FILE_RE.findall(content)
+
+    absolute_files = [os.path.abspath(f) for f in detected_files]
+    unique_files = list(set(absolute_files))
+    existing_files = [f for f in unique_files if os.path.exists(f)]
+    return [os.path.relpath(f) for f in existing_files]
+
+
+def _parse_location(location):
+    match = LOCATION_RE.match(location or "")
+    path, start, end = match.groups() if match else (location, None, None)
+    if start is None:
+        return path, None, None
+    return path, int(start), int(end or start)
+
+
+def _contains(outer, inner) -> bool:
+    # (start, end) line ranges; a start of None means the whole file
+    if outer[0] is None:
+        return True
+    return inner[0] is not None and outer[0] <= inner[0] and inner[1] <= outer[1]
+
+
+def merge_context(results):
+    """
+    Merge lists of context items, de-duplicating items of the same file whose line
+    ranges are equal or contain one another (the larger range is kept). Returns the
+    merged items, and how many lists included each of them.
+    """
+    # Per path, a list of [item, line range, hits]
+    entries_by_path = {}
+    order = []
+    for items in results:
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            path, start, end = _parse_location(item.get("location"))
+            line_range = (start, end)
+            entries = entries_by_path.setdefault(path, [])
+            for entry in entries:
+                if _contains(entry[1], line_range):
+                    entry[2] += 1
+                    break
+                if _contains(line_range, entry[1]):
+                    entry[0], entry[1] = item, line_range
+                    entry[2] += 1
+                    break
+            else:
+                entry = [item, line_range, 1]
+                entries.append(entry)
+                order.append(entry)
+    return [item for item, _, _ in order], [hits for _, _, hits in order]
+
+
+def rank_context(items, query, hits=None):
+    """
+    Order context items by relevance to the query: the number of queries that returned
+    each item (hits, as returned by merge_context), plus the identifiers that it shares
+    with the query, discounted by its size. Ties keep their original order.
+    """
+    query_words = {word.lower() for word in IDENTIFIER_RE.findall(query)}
+    hits = hits or [1] * len(items)
+
+    def relevance(index):
+        item = items[index]
+        words = {
+            word.lower()
+            for word in IDENTIFIER_RE.findall(
+                f"{item.get('location', '')} {item.get('content', '')}"
+            )
+        }
+        shared = len(words & query_words)
+        return hits[index] + shared / math.sqrt(len(words) + 1)
+
+    return [
+        items[index]
+        for index in sorted(range(len(items)), key=relevance, reverse=True)
+    ]
@@ -0,0 +1,209 @@
+"""
+Hedged `appmap navie` calls, to cut the tail of their latency.
+
+When hedging is on (APPMAP_NAVIE_HEDGE), the latencies of recent calls are tracked per
+operation (the Client method: plan, generate, terms, ...). A call that hasn't finished
+by a percentile of them (APPMAP_NAVIE_HEDGE_PERCENTILE) is duplicated: the same command
+runs again, on copies of its inputs, with its output and trajectory in a directory of
+its own. The first of the two to succeed wins, and its output is moved into place; the
+other is killed.
+
+Hedges cost a second call, so at most a fraction of calls (APPMAP_NAVIE_HEDGE_MAX_RATE)
+are hedged, and none are until an operation has MIN_SAMPLES latencies.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from navie import trace
+from navie.config import Config
+from navie.replay import NAVIE_INPUT_OPTIONS
+from navie.scratch import scratch_root
+
+# Latencies kept per operation
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 20
+# How often the racing calls are checked once a hedge has started
+RACE_POLL_SECONDS = 0.02
+
+OUTPUT_OPTIONS = {"-o": "output", "--trajectory-file": "trajectory"}
+
+
+class Hedger:
+    def __init__(
+        self, percentile: Optional[float] = None, max_rate: Optional[float] = None
+    ):
+        # By default, read from Config on each call
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self._latencies: dict[str, deque] = {}
+        self._calls = 0
+        self._hedged = 0
+        self._won = 0
+        self._lock = threading.Lock()
+
+    def delay(self, operation: str) -> Optional[float]:
+        """How long a call may run before it's hedged, or None if it isn't known yet."""
+        percentile = (
+            Config.get_hedge_percentile() if self.percentile is None else self.percentile
+        )
+        with self._lock:
+            latencies = self._latencies.get(operation)
+            if not latencies or len(latencies) < MIN_SAMPLES:
+                return None
+            ordered = sorted(latencies)
+        index = min(len(ordered) - 1, int(percentile / 100 * len(ordered)))
+        return ordered[index]
+
+    def record(self, operation: str, elapsed: float):
+        with self._lock:
+            self._latencies.setdefault(
+                operation, deque(maxlen=LATENCY_WINDOW)
+            ).append(elapsed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": self._calls, "hedged": self._hedged, "won": self._won}
+
+    def run(
+        self,
+        command: list[str],
+        operation: str,
+        read: Callable[[str], str],
+        on_spawn: Optional[Callable[[subprocess.Popen], None]] = None,
+        **popen_args,
+    ) -> subprocess.CompletedProcess:
+        """
+        Run a navie command to completion, hedging it if it's slow. read returns the
+        content of an input of the command, and on_spawn is called with each process
+        that's started. Raises CalledProcessError if every run of the command fails.
+        """
+        delay = self.delay(operation)
+        with self._lock:
+            self._calls += 1
+
+        start = time.perf_counter()
+        primary = subprocess.Popen(command, **popen_args)
+        # However this ends, including Ctrl-C or a failure to start the hedge, the
+        # primary isn't left running
+        try:
+            if on_spawn:
+                on_spawn(primary)
+            try:
+                primary.wait(timeout=delay)
+            except subprocess.TimeoutExpired:
+                if self._may_hedge():
+                    return self._race(
+                        command, operation, primary, start, read, on_spawn, popen_args
+                    )
+                primary.wait()
+            return self._finish(command, operation, primary, start)
+        finally:
+            _kill(primary)
+
+    def _may_hedge(self) -> bool:
+        max_rate = (
+            Config.get_hedge_max_rate() if self.max_rate is None else self.max_rate
+        )
+        with self._lock:
+            if self._hedged + 1 > max_rate * self._calls:
+                return False
+            self._hedged += 1
+            return True
+
+    def _race(self, command, operation, primary, start, read, on_spawn, popen_args):
+        hedge_dir = tempfile.mkdtemp(prefix="navie-hedge-", dir=scratch_root())
+        try:
+            hedge_command, outputs = isolate(command, hedge_dir, read)
+            hedge = subprocess.Popen(hedge_command, **popen_args)
+            if on_spawn:
+                on_spawn(hedge)
+            try:
+                winner = _first_success([primary, hedge])
+                if winner:
+                    # The primary's latency, or as much of it as there was before it
+                    # lost, so that the tail the hedge cut off stays in the window
+                    self.record(operation, time.perf_counter() - start)
+            finally:
+                _kill(primary)
+                _kill(hedge)
+            trace.current().set(hedged=True, hedge_won=winner is hedge)
+            if winner is None:
+                raise subprocess.CalledProcessError(primary.returncode, command)
+            if winner is hedge:
+                with self._lock:
+                    self._won += 1
+                for copy, original in outputs.items():
+                    if os.path.exists(copy):
+                        shutil.move(copy, original)
+            return subprocess.CompletedProcess(command, 0)
+        finally:
+            shutil.rmtree(hedge_dir, ignore_errors=True)
+
+    def _finish(self, command, operation, process, start):
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command)
+        self.record(operation, time.perf_counter() - start)
+        return subprocess.CompletedProcess(command, 0)
+
+
+def _first_success(processes: list[subprocess.Popen]) -> Optional[subprocess.Popen]:
+    """Wait for the first of the processes to succeed, or for all of them to fail."""
+    running = list(processes)
+    while running:
+        for process in list(running):
+            if process.poll() is None:
+                continue
+            if process.returncode == 0:
+                return process
+            running.remove(process)
+        time.sleep(RACE_POLL_SECONDS)
+    return None
+
+
+def isolate(
+    command: list[str], hedge_dir: str, read: Callable[[str], str]
+) -> tuple[list[str], dict[str, str]]:
+    """
+    A copy of a navie command that reads copies of its inputs and writes its outputs in
+    hedge_dir, and the outputs of the copy, as {copy path: original path}.
+    """
+    isolated = list(command)
+    outputs = {}
+    for i in range(len(command) - 1):
+        option, path = command[i], command[i + 1]
+        if option in NAVIE_INPUT_OPTIONS:
+            copy = os.path.join(hedge_dir, f"{NAVIE_INPUT_OPTIONS[option]}.txt")
+            with open(copy, "w") as f:
+                f.write(read(path))
+            isolated[i + 1] = copy
+        elif option in OUTPUT_OPTIONS:
+            copy = os.path.join(hedge_dir, f"{OUTPUT_OPTIONS[option]}.txt")
+            isolated[i + 1] = copy
+            outputs[copy] = path
+    return isolated, outputs
+
+
+def _kill(process: subprocess.Popen):
+    if process.poll() is None:
+        process.kill()
+        process.wait()
+
+
+_hedger: Optional[Hedger] = None
+_hedger_lock = threading.Lock()
+
+
+def hedger() -> Hedger:
+    """The hedger shared by the calls of this process."""
+    global _hedger
+    with _hedger_lock:
+        if _hedger is None:
+            _hedger = Hedger()
+        return _hedger
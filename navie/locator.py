@@ -0,0 +1,174 @@
+"""
+Locates a block of lines (such as the <original> code of a change) in a file.
+
+The file is indexed by line hashes, both as-is and whitespace-normalized, and the block
+is searched for with a rolling hash over the line hash sequence, so exact and
+whitespace-insensitive matches take O(n). When neither matches, candidate positions are
+seeded from anchor lines (block lines that are rare in the file), and scored with a
+bounded line-level edit distance.
+"""
+
+from typing import Optional
+
+HASH_BASE = 1_000_003
+HASH_MODULUS = (1 << 61) - 1
+
+SCORE_EXACT = 1.0
+SCORE_NORMALIZED = 0.95
+# Fuzzy scores are scaled into [0, SCORE_FUZZY_MAX]
+SCORE_FUZZY_MAX = 0.9
+# By default, only exact and normalized matches are applied; fuzzy matches need a lower
+# threshold
+DEFAULT_MIN_CONFIDENCE = SCORE_NORMALIZED
+
+# Anchor lines occur at most this many times in the file.
+MAX_ANCHOR_OCCURRENCES = 4
+MAX_ANCHORS = 8
+MAX_CANDIDATES = 64
+# Fuzzy matches may differ in at most this fraction of lines.
+MAX_FUZZY_DISTANCE = 0.5
+
+
+class Match:
+    def __init__(self, start: int, end: int, score: float, kind: str):
+        # 0-based line indices, end exclusive
+        self.start = start
+        self.end = end
+        self.score = score
+        self.kind = kind
+
+    def __repr__(self):
+        return f"Match({self.kind} {self.start}-{self.end} score={self.score:.2f})"
+
+
+def normalize(line: str) -> str:
+    return " ".join(line.split())
+
+
+def _line_hash(line: str) -> int:
+    return hash(line) & HASH_MODULUS
+
+
+def _find_sequence(haystack: list[int], needle: list[int]) -> Optional[int]:
+    """Rabin-Karp search for a sequence of ints. Returns the first start index."""
+    k = len(needle)
+    if k == 0 or k > len(haystack):
+        return None
+
+    high = pow(HASH_BASE, k - 1, HASH_MODULUS)
+    target = 0
+    window = 0
+    for i in range(k):
+        target = (target * HASH_BASE + needle[i]) % HASH_MODULUS
+        window = (window * HASH_BASE + haystack[i]) % HASH_MODULUS
+
+    for start in range(len(haystack) - k + 1):
+        if window == target and haystack[start : start + k] == needle:
+            return start
+        if start + k < len(haystack):
+            window = (
+                (window - haystack[start] * high) * HASH_BASE + haystack[start + k]
+            ) % HASH_MODULUS
+    return None
+
+
+def _bounded_distance(a: list[int], b: list[int], bound: int) -> Optional[int]:
+    """Line-level Levenshtein distance, or None if it exceeds bound."""
+    if abs(len(a) - len(b)) > bound:
+        return None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j in range(1, len(b) + 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (a[i - 1] != b[j - 1]),
+            )
+            row_min = min(row_min, current[j])
+        if row_min > bound:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= bound else None
+
+
+class BlockLocator:
+    def __init__(self, lines: list[str]):
+        self.lines = lines
+        self.exact = [_line_hash(line.rstrip("\r\n")) for line in lines]
+        # Whitespace-normalized hashes of the non-blank lines, and where they are
+        self.content_index = [i for i, line in enumerate(lines) if line.strip()]
+        self.normalized = [
+            _line_hash(normalize(lines[i])) for i in self.content_index
+        ]
+        self.positions: dict[int, list[int]] = {}
+        for position, line_hash in enumerate(self.normalized):
+            self.positions.setdefault(line_hash, []).append(position)
+
+    def locate(self, block: str) -> Optional[Match]:
+        block_lines = block.split("\n")
+        while block_lines and not block_lines[0].strip():
+            block_lines.pop(0)
+        while block_lines and not block_lines[-1].strip():
+            block_lines.pop()
+        if not block_lines:
+            return None
+
+        start = _find_sequence(
+            self.exact, [_line_hash(line.rstrip("\r")) for line in block_lines]
+        )
+        if start is not None:
+            return Match(start, start + len(block_lines), SCORE_EXACT, "exact")
+
+        needle = [_line_hash(normalize(line)) for line in block_lines if line.strip()]
+        start = _find_sequence(self.normalized, needle)
+        if start is not None:
+            return self._content_match(
+                start, start + len(needle), SCORE_NORMALIZED, "normalized"
+            )
+
+        return self._fuzzy(needle)
+
+    def _content_match(self, start: int, end: int, score: float, kind: str) -> Match:
+        return Match(
+            self.content_index[start], self.content_index[end - 1] + 1, score, kind
+        )
+
+    def _fuzzy(self, needle: list[int]) -> Optional[Match]:
+        anchors = sorted(
+            (
+                (len(self.positions[line_hash]), offset)
+                for offset, line_hash in enumerate(needle)
+                if len(self.positions.get(line_hash, [])) <= MAX_ANCHOR_OCCURRENCES
+                and line_hash in self.positions
+            )
+        )[:MAX_ANCHORS]
+
+        candidates = []
+        for _, offset in anchors:
+            for position in self.positions[needle[offset]]:
+                start = position - offset
+                if start not in candidates:
+                    candidates.append(start)
+        candidates = candidates[:MAX_CANDIDATES]
+
+        bound = int(len(needle) * MAX_FUZZY_DISTANCE)
+        slack = max(1, len(needle) // 5)
+        best: Optional[tuple[float, int, int]] = None
+        for candidate in candidates:
+            for length in range(len(needle) - slack, len(needle) + slack + 1):
+                start, end = max(0, candidate), min(len(self.normalized), candidate + length)
+                if end <= start:
+                    continue
+                distance = _bounded_distance(needle, self.normalized[start:end], bound)
+                if distance is None:
+                    continue
+                similarity = 1 - distance / max(len(needle), end - start)
+                if best is None or similarity > best[0]:
+                    best = (similarity, start, end)
+
+        if best is None:
+            return None
+        similarity, start, end = best
+        return self._content_match(start, end, similarity * SCORE_FUZZY_MAX, "fuzzy")
@@ -11,21 +11,41 @@ Usage example:
 """
 
 import argparse
-import difflib
 import hashlib
 import os
 import readline
 import sys
-
-from navie.editor import Editor
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from navie.config import Config
+from navie.buffer import DocumentBuffer
+from navie.candidates import BestOfN
+from navie.daemon import EDIT_OPTIONS, DaemonClient
+from navie.editor import Editor, find_files
 from navie.extract_changes import extract_changes
 from navie.format_instructions import xml_format_instructions
 from navie.mode.quit_exception import QuitException
+from navie.locator import DEFAULT_MIN_CONFIDENCE, BlockLocator, Match
+from navie.slicer import parse_terms, touched_ranges
 
 from .interactions import Interactions
-from .prompt import context_file_prompt, edit_prompt, problem_statement_prompt
+from .prompt import (
+    context_file_prompt,
+    PrefixStats,
+    edit_plan_prompt,
+    edit_region_prompt,
+    edit_target_prompt,
+    edit_targets_prompt,
+    problem_statement_prompt,
+    render_file,
+    sliced_context_file_prompt,
+)
 from .user_interface import UserInterface
 
+# With chunk_large_files, files of at least this many lines are edited region by region.
+CHUNK_MIN_LINES = 2000
+
 
 class Edit:
     """
@@ -37,8 +57,30 @@ class Edit:
     Attributes:
     - work_dir (str): The working directory where working files are stored.
     - problem_statement (str): The problem to be addressed.
+    - slice_files (bool): Send only the parts of the context files that are relevant to the
+      problem statement (when planning) or the plan (when editing).
+    - debug_snapshots (bool): Write the base and edited content of each file into the work
+      directory.
+    - min_confidence (float): Changes whose original code can only be located in the file
+      with a lower confidence score than this are rejected. The default only accepts
+      exact and whitespace-normalized matches; fuzzy matches score at most 0.9.
+    - batch (bool): Generate the changes to all files in a single request, and route each
+      change to its file. Files that receive no changes are generated one by one.
+    - chunk_large_files (bool): Edit files of at least CHUNK_MIN_LINES lines by generating
+      changes to the classes and functions that the plan mentions, each in parallel, and
+      merging them.
+    - prefetch_files (bool): While the plan is being written, read and render each file
+      it names in the background, so the files are ready when generation starts.
+    - early_generation (bool): Start generating the changes to each planned file as soon
+      as the plan is complete, rather than one file at a time in apply().
+    - temperature (float): The temperature of code generation.
+    - output_dir (str): Write the edited files into this directory, at their paths relative
+      to the current directory, rather than in place.
 
     Methods:
+    - speculate: Start generating the changes to the planned files in the background, while
+      the plan is reviewed. apply() uses the results if the plan is still the same.
+    - cancel_speculation: Discard background generation that's no longer wanted.
     - solve: Executes the plan to implement the problem statement.
     """
 
@@ -49,91 +91,443 @@ class Edit:
         self.interactive = True
         self._plan = None
         self.files_to_edit = []
+        self.slice_files = False
+        self.debug_snapshots = False
+        self.min_confidence = DEFAULT_MIN_CONFIDENCE
+        self.batch = False
+        self.chunk_large_files = False
+        self.prefetch_files = False
+        self.early_generation = False
+        self.prefetched = []
+        self.temperature = None
+        self.output_dir = None
+        self.max_workers = 4
+        self.prefix_stats = PrefixStats()
+        self._speculation_executor = None
+        self._speculative = {}
+        self._prefetch_executor = None
+        self._terms = []
 
     def plan(self):
         plan_dir = os.path.join(self.work_dir, "plan")
-        editor = Editor(plan_dir)
+        editor = self._editor(plan_dir)
         messages = []
 
         messages.append(problem_statement_prompt(self.problem_statement))
 
-        Edit.add_file_contents_to_messages(self.files, messages)
+        if self.slice_files and self.files:
+            self._terms = parse_terms(editor.suggest_terms(self.problem_statement))
+            Edit.add_file_contents_to_messages(
+                self.files, messages, focus=self.problem_statement, terms=self._terms
+            )
+        else:
+            Edit.add_file_contents_to_messages(self.files, messages)
 
         messages.append(
             "Do not emit code or code snippets. Just describe the changes to each file."
         )
 
-        self._plan = editor.plan("\n\n".join(messages))
+        scanner = PlanScanner(self._prefetch) if self.prefetch_files else None
+        self._plan = editor.plan(
+            "\n\n".join(messages), on_output=scanner.feed if scanner else None
+        )
+        if scanner:
+            # Including when the plan came from the cache, and wasn't streamed
+            scanner.feed(self._plan, final=True)
         self.files_to_edit = editor.list_files(self._plan)
 
+        if self.early_generation:
+            # Generation needs the whole plan, so this is as early as it can start
+            self.speculate()
+
         return self._plan
 
+    def _prefetch(self, file):
+        if not os.path.isfile(file):
+            return
+        if self._prefetch_executor is None:
+            self._prefetch_executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.prefetched.append(file)
+        # render_file caches the rendering for context_file_prompt
+        self._prefetch_executor.submit(render_file, file)
+
+    def speculate(self):
+        """
+        Start generating the changes to each file to edit in the background. Files that
+        are already being generated for the current plan are left alone. With batch,
+        apply() generates every file in one request, so nothing is started.
+        """
+        if self.batch:
+            return
+        if self._speculation_executor is None:
+            self._speculation_executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        for file in self.files_to_edit:
+            if not os.path.isfile(file):
+                continue
+            with open(file, "rb") as f:
+                data = f.read()
+            if self._chunked(data):
+                continue
+            key = self._speculation_key(data)
+            if file in self._speculative and self._speculative[file][0] == key:
+                continue
+            self._speculative[file] = (
+                key,
+                self._speculation_executor.submit(self._generate_file_changes, file),
+            )
+
+    def cancel_speculation(self, keep=()):
+        """
+        Cancel the background generation of all files except those in keep. Generation
+        that has already started can't be interrupted, so its result is discarded.
+        """
+        for file in list(self._speculative):
+            if file not in keep:
+                _, future = self._speculative.pop(file)
+                future.cancel()
+
+    def _shutdown_speculation(self):
+        self.cancel_speculation()
+        if self._speculation_executor:
+            self._speculation_executor.shutdown(wait=False, cancel_futures=True)
+            self._speculation_executor = None
+        if self._prefetch_executor:
+            self._prefetch_executor.shutdown(wait=False, cancel_futures=True)
+            self._prefetch_executor = None
+
+    def _speculation_key(self, data):
+        digest = hashlib.sha1(data).hexdigest()
+        return (self._plan, self.problem_statement, tuple(sorted(self.files)), digest)
+
+    def _speculative_changes(self, file, data):
+        key, future = self._speculative.pop(file, (None, None))
+        if future is None or future.cancelled() or key != self._speculation_key(data):
+            return None
+        try:
+            return future.result()
+        except Exception as e:
+            print(f"Background generation for {file} failed: {e}")
+            return None
+
+    def _editor(self, work_dir):
+        return Editor(work_dir, temperature=self.temperature)
+
+    def _editor_for(self, data):
+        edit_dir = os.path.join(self.work_dir, "edit", hashlib.sha1(data).hexdigest())
+        return self._editor(edit_dir), edit_dir
+
+    def _generate_file_changes(self, file):
+        with open(file, "rb") as f:
+            data = f.read()
+        editor, _ = self._editor_for(data)
+        return self._generate_changes(file, editor)
+
     def apply(self, confirm_diff):
+        try:
+            self._apply(confirm_diff)
+        finally:
+            self._shutdown_speculation()
+
+    def _apply(self, confirm_diff):
+        batched_changes = {}
+        if self.batch and len(self.files_to_edit) > 1 and not self._speculative:
+            batched_changes = self._generate_batch_changes()
+
+        def edit_file(file):
+            with open(file, "rb") as f:
+                data = f.read()
+            editor, edit_dir = self._editor_for(data)
+
+            buffer = DocumentBuffer.from_bytes(file, data)
+
+            changes = batched_changes.get(file)
+            if not changes:
+                changes = self._speculative_changes(file, data)
+            if changes is None and self._chunked(data):
+                region_changes = self._generate_region_changes(file, buffer, edit_dir)
+                if region_changes is not None:
+                    self._merge_region_changes(buffer, region_changes)
+                    return buffer
+            if changes is None:
+                changes = self._generate_changes(file, editor)
+
+            self._apply_changes(buffer, changes, editor, edit_dir)
+            return buffer
+
+        if batched_changes:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                buffers = list(executor.map(edit_file, self.files_to_edit))
+        else:
+            buffers = map(edit_file, self.files_to_edit)
+
+        # Diffs are confirmed one at a time, in order
+        for file, buffer in zip(self.files_to_edit, buffers):
+            diff_output = buffer.diff(file, file)
+            if not diff_output:
+                print(f"No changes for file {file}")
+                continue
+
+            if confirm_diff(file, diff_output):
+                if self.output_dir:
+                    buffer.write(os.path.join(self.output_dir, os.path.relpath(file)))
+                else:
+                    buffer.write()
+
+        if len(self.prefix_stats.prompts) > 1:
+            print(f"Prompt prefix sharing: {self.prefix_stats.summary()}")
+
+    def _generate_batch_changes(self):
+        digest = hashlib.sha1()
         for file in self.files_to_edit:
-            # Compute sha1 of the file
             with open(file, "rb") as f:
-                file_sha1 = hashlib.sha1(f.read()).hexdigest()
-            edit_dir = os.path.join(self.work_dir, "edit", file_sha1)
+                digest.update(file.encode() + b"\0" + f.read())
+        editor = self._editor(
+            os.path.join(self.work_dir, "edit", "batch-" + digest.hexdigest())
+        )
 
-            messages = []
-            messages.append(edit_prompt(file, self._plan, self.problem_statement))
+        code = self._generate_code(editor, edit_targets_prompt(self.files_to_edit))
+        changes_by_file = route_changes(extract_changes(code), self.files_to_edit)
+        for file in self.files_to_edit:
+            if not changes_by_file.get(file):
+                print(f"No changes generated for {file}; generating them separately")
+        return changes_by_file
 
-            Edit.add_file_contents_to_messages(self.files, messages)
+    def _generate_changes(self, file, editor):
+        return extract_changes(self._generate_code(editor, edit_target_prompt(file)))
 
-            editor = Editor(edit_dir)
-            code = editor.generate(
-                "\n".join(messages), prompt=xml_format_instructions()
-            )
-            changes = extract_changes(code)
+    def _shared_edit_messages(self, exclude=None) -> str:
+        # The part of the edit request that's the same for every file
+        messages = []
+        messages.append(edit_plan_prompt(self._plan, self.problem_statement))
 
-            file_sha1 = hashlib.sha1(file.encode()).hexdigest()
-            temp_file_base = os.path.join(
-                edit_dir,
-                "_".join([file_sha1, ".".join([os.path.basename(file), "base"])]),
+        files = sorted(set(self.files) - {exclude})
+        if self.slice_files:
+            Edit.add_file_contents_to_messages(
+                files, messages, focus=self._plan, terms=self._terms
             )
-            temp_file = os.path.join(
-                edit_dir, "_".join([file_sha1, os.path.basename(file)])
+        else:
+            Edit.add_file_contents_to_messages(files, messages)
+        return "\n".join(messages)
+
+    def _generate_code(self, editor, target_prompt, exclude=None):
+        message = "\n".join([self._shared_edit_messages(exclude), target_prompt])
+        self.prefix_stats.record(message)
+        return editor.generate(message, prompt=xml_format_instructions())
+
+    def _chunked(self, data: bytes) -> bool:
+        if not self.chunk_large_files:
+            return False
+        return len(data.splitlines()) >= CHUNK_MIN_LINES
+
+    def _generate_region_changes(self, file, buffer, edit_dir):
+        """
+        Generate the changes to each region of a large file that the plan mentions, in
+        parallel. The file itself is only sent region by region, rendered from the
+        buffer rather than read again. Returns None if the plan doesn't mention anything
+        in the file.
+        """
+        ranges = touched_ranges(file, buffer.text, self._plan, self._terms)
+        if not ranges:
+            return None
+
+        def generate_region(line_range):
+            start, end = line_range
+            editor = self._editor(os.path.join(edit_dir, f"region-{start}-{end}"))
+            target_prompt = "\n".join(
+                [
+                    context_file_prompt(file, start, end, lines=buffer.lines),
+                    edit_region_prompt(file, start, end),
+                ]
             )
-            with open(file, "r", encoding="utf-8") as f:
-                base_lines = f.readlines()
-                contents = "".join(base_lines)
-                with open(temp_file_base, "w", encoding="utf-8") as f_temp:
-                    f_temp.write(contents)
-                with open(temp_file, "w", encoding="utf-8") as f_temp:
-                    f_temp.write(contents)
+            code = self._generate_code(editor, target_prompt, exclude=file)
+            return line_range, extract_changes(code)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(generate_region, ranges))
 
+    def _merge_region_changes(self, buffer, region_changes):
+        # Locate every change in the unmodified buffer, preferring its own region
+        located = []
+        for (start, end), changes in region_changes:
+            region_locator = BlockLocator(buffer.lines[start - 1 : end])
             for change in changes:
-                editor.apply(temp_file, change.modified, search=change.original)
+                match = region_locator.locate(change.original)
+                if match:
+                    match = Match(
+                        match.start + start - 1, match.end + start - 1, match.score, match.kind
+                    )
+                else:
+                    match = buffer.locate(change.original)
+                if not match or match.score < self.min_confidence:
+                    print(
+                        f"Rejected change to {buffer.path}: its original code wasn't found "
+                        f"in lines {start}-{end}"
+                    )
+                    if match:
+                        print(buffer.match_diff(match, change.original))
+                    continue
+                if match.kind == "fuzzy":
+                    _report_fuzzy_match(buffer, match, change)
+                located.append((match, change))
+
+        located.sort(key=lambda item: (item[0].start, item[0].end))
+        accepted = []
+        for match, change in located:
+            if accepted and match.start < accepted[-1][0].end:
+                previous = accepted[-1][0]
+                print(
+                    f"Conflicting changes to {buffer.path}: lines {match.start + 1}-{match.end} "
+                    f"overlap lines {previous.start + 1}-{previous.end}, which are already "
+                    "changed"
+                )
+                continue
+            accepted.append((match, change))
 
-            # Diff temp_file_base and temp_file using Python diff library
-            with open(temp_file, "r", encoding="utf-8") as f_temp:
-                changed_lines = f_temp.readlines()
+        # Apply from the bottom up, so that the line numbers of the other matches hold
+        for match, change in reversed(accepted):
+            buffer.apply_match(match, change.original, change.modified)
 
-            diff = difflib.unified_diff(
-                base_lines, changed_lines, fromfile=file, tofile=file
-            )
-            if not diff:
-                print(f"No changes for file {file}")
+    def _apply_changes(self, buffer, changes, editor, edit_dir):
+        scratch_name = "_".join(
+            [hashlib.sha1(buffer.path.encode()).hexdigest(), os.path.basename(buffer.path)]
+        )
+        for change in changes:
+            if buffer.apply(change):
                 continue
 
-            diff_output = "".join(diff)
+            match = buffer.locate(change.original)
+            if match and match.score >= self.min_confidence:
+                if match.kind == "fuzzy":
+                    _report_fuzzy_match(buffer, match, change)
+                buffer.apply_match(match, change.original, change.modified)
+                continue
+            if match:
+                print(
+                    f"Rejected change to {buffer.path}: the original code matches lines "
+                    f"{match.start + 1}-{match.end} with confidence {match.score:.2f}, "
+                    f"below {self.min_confidence:.2f}"
+                )
+                print(buffer.match_diff(match, change.original))
+                continue
 
-            if confirm_diff(file, diff_output):
-                with open(file, "w", encoding="utf-8") as f:
-                    f.write("".join(changed_lines))
+            # The original code wasn't found. Fall back to `appmap apply` on a scratch
+            # copy of the buffer.
+            scratch_file = os.path.join(edit_dir, scratch_name)
+            with open(scratch_file, "w", encoding="utf-8") as f:
+                f.write(buffer.text)
+            editor.apply(scratch_file, change.modified, search=change.original)
+            with open(scratch_file, "r", encoding="utf-8") as f:
+                buffer.set_text(f.read())
+
+        if self.debug_snapshots:
+            buffer.snapshot(edit_dir, scratch_name)
 
     @staticmethod
-    def add_file_contents_to_messages(files, messages):
+    def add_file_contents_to_messages(files, messages, focus=None, terms=()):
         if not files:
             return
 
         for file in files:
-            messages.append(context_file_prompt(file))
+            if focus is None:
+                messages.append(context_file_prompt(file))
+            else:
+                messages.append(sliced_context_file_prompt(file, focus, terms))
 
     def __repr__(self):
         return f"Edit(problem_statement={self.problem_statement})"
 
 
+class PlanScanner:
+    """
+    Finds the existing files that a plan names while the plan is being written, calling
+    on_file once for each. feed() takes the whole plan so far. Paths are matched like
+    Editor.list_files matches them, one complete line at a time, since the last line may
+    end in a partial path.
+    """
+
+    def __init__(self, on_file):
+        self.on_file = on_file
+        self.files = []
+        self._scanned = 0
+        self._lock = threading.Lock()
+
+    def feed(self, text: str, final: bool = False):
+        with self._lock:
+            end = len(text) if final else text.rfind("\n", self._scanned) + 1
+            if end <= self._scanned:
+                return
+            found = find_files(text[self._scanned : end])
+            self._scanned = end
+            new_files = [file for file in sorted(found) if file not in self.files]
+            self.files.extend(new_files)
+
+        for file in new_files:
+            self.on_file(file)
+
+
+def _report_fuzzy_match(buffer, match, change):
+    print(
+        f"Applying a change to {buffer.path} at lines {match.start + 1}-{match.end}, "
+        f"which only match its original code with confidence {match.score:.2f}:"
+    )
+    print(buffer.match_diff(match, change.original))
+
+
+def _path_parts(path: str) -> list[str]:
+    return [part for part in os.path.normpath(path).split(os.sep) if part not in ("", ".")]
+
+
+def _common_suffix(a: list[str], b: list[str]) -> int:
+    size = 0
+    while size < min(len(a), len(b)) and a[-1 - size] == b[-1 - size]:
+        size += 1
+    return size
+
+
+def route_changes(changes, files) -> dict:
+    """
+    Group changes by the file they apply to. A change's file may be named differently
+    from the file to edit (absolute, or relative to another directory), so it matches
+    the file to edit whose path ends with the longest run of the same path components.
+    Changes that match no file, or match several equally well, are dropped.
+    """
+    routed = {file: [] for file in files}
+    file_parts = {file: _path_parts(os.path.relpath(file)) for file in files}
+    for change in changes:
+        change_parts = _path_parts(
+            os.path.relpath(change.file) if os.path.isabs(change.file) else change.file
+        )
+        scores = {
+            file: _common_suffix(parts, change_parts) for file, parts in file_parts.items()
+        }
+        best = max(scores.values(), default=0)
+        matches = [file for file, score in scores.items() if score == best]
+        if best == 0 or len(matches) > 1:
+            print(f"Dropped change to {change.file}, which is not a file to edit")
+            continue
+        routed[matches[0]].append(change)
+    return routed
+
+
+def _solve_with_daemon(daemon, edit, user_interface):
+    user_interface.display_message(f"Solving with the navie daemon at {daemon.url}")
+    params = {option: getattr(edit, option) for option in EDIT_OPTIONS}
+    result = daemon.run(
+        "edit",
+        {"problem_statement": edit.problem_statement, **params},
+        work_dir=edit.work_dir,
+    )
+
+    user_interface.display_message("")
+    user_interface.display_message(result["plan"])
+    user_interface.display_message("")
+    user_interface.display_message(f"Files to edit:")
+    for file in result["files_to_edit"]:
+        user_interface.display_message(f"  {file}", color="white")
+    for file in result["diffs"]:
+        user_interface.display_message(f"Changed {file}")
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-d", "--directory", help="Program working directory")
@@ -149,10 +543,81 @@ def main():
         action="append",
         dest="files",
     )
+    parser.add_argument(
+        "--slice",
+        action="store_true",
+        help="Send only the relevant classes and functions of large context files",
+    )
+    parser.add_argument(
+        "--debug-snapshots",
+        action="store_true",
+        help="Write the base and edited content of each file to the work directory",
+    )
+    parser.add_argument(
+        "--min-confidence",
+        type=float,
+        default=DEFAULT_MIN_CONFIDENCE,
+        help="Reject changes whose original code can't be located with this confidence "
+        "(0-1). Fuzzy matches score at most 0.9, so they're only applied below that.",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Generate the changes to all files in a single request",
+    )
+    parser.add_argument(
+        "--chunk",
+        action="store_true",
+        help=f"Edit files of {CHUNK_MIN_LINES} lines or more region by region, in parallel",
+    )
+    parser.add_argument(
+        "--similar",
+        action="store_true",
+        help="Reuse the context of near-duplicate queries, and start from the plans of near-duplicate issues",
+    )
+    parser.add_argument(
+        "--prefetch",
+        action="store_true",
+        help="Read and render the files named by the plan while it's being written",
+    )
+    parser.add_argument(
+        "--early-generation",
+        action="store_true",
+        help="Generate all the planned files in parallel as soon as the plan is complete",
+    )
+    parser.add_argument(
+        "--candidates",
+        type=int,
+        default=1,
+        help="Generate this many candidates at different temperatures, and keep the first to pass --test-command",
+    )
+    parser.add_argument(
+        "--test-command",
+        help="Shell command that tests a candidate, run in the candidate's workspace",
+    )
+    parser.add_argument(
+        "--workspace",
+        choices=["hardlink", "worktree"],
+        default="hardlink",
+        help="How candidate workspaces are created",
+    )
+    parser.add_argument(
+        "--symbol-index",
+        action="store_true",
+        help="Answer term, file and context lookups from a local symbol index when it's confident",
+    )
     args = parser.parse_args()
 
+    if args.candidates > 1 and not args.test_command:
+        print("Error: --candidates requires --test-command")
+        sys.exit(1)
+
     if args.directory:
         os.chdir(args.directory)
+    if args.symbol_index and not Config.get_symbol_index_dir():
+        Config.set_symbol_index_dir(os.path.join(".navie", "index"))
+    if args.similar and not Config.get_similarity_dir():
+        Config.set_similarity_dir(os.path.join(".navie", "similar"))
 
     interactive = True if not args.no_interactive else False
 
@@ -175,6 +640,8 @@ def main():
         sys.exit(1)
 
     issue_sha1 = hashlib.sha1(problem_statement.encode()).hexdigest()
+    if not Config.get_issue_id():
+        Config.set_issue_id(issue_sha1)
 
     work_dir = os.path.join(".navie", "edit", issue_sha1)
     os.makedirs(work_dir, exist_ok=True)
@@ -186,6 +653,25 @@ def main():
         edit.interactive = False
     if args.files:
         edit.files = args.files
+    if args.slice:
+        edit.slice_files = True
+    if args.debug_snapshots:
+        edit.debug_snapshots = True
+    edit.min_confidence = args.min_confidence
+    if args.batch:
+        edit.batch = True
+    if args.chunk:
+        edit.chunk_large_files = True
+    if args.prefetch:
+        edit.prefetch_files = True
+    if args.early_generation:
+        edit.early_generation = True
+
+    if not interactive and args.candidates == 1:
+        daemon = DaemonClient.discover()
+        if daemon:
+            _solve_with_daemon(daemon, edit, user_interface)
+            return
 
     # Configure readline to use history file
     histfile = os.path.join(work_dir, ".edit_history")
@@ -209,12 +695,15 @@ def main():
                 user_interface.display_message(f"  {file}", color="white")
 
             if interactive:
+                # Generate the code while the plan is reviewed
+                edit.speculate()
                 if interactions.prompt_for_edit():
                     updated_problem_statement = (
                         interactions.prompt_user_for_adjustments(edit.problem_statement)
                     )
                     if updated_problem_statement != edit.problem_statement:
                         edit.problem_statement = updated_problem_statement
+                        edit.cancel_speculation()
                         replan_required = True
 
                     updated_files = interactions.prompt_user_for_adjustments(
@@ -226,6 +715,9 @@ def main():
                             for file in updated_files.split("\n")
                             if file.strip()
                         ]
+                        edit.cancel_speculation(keep=edit.files_to_edit)
+                        if not replan_required:
+                            edit.speculate()
 
         user_interface.display_message("Generating code...")
 
@@ -236,10 +728,36 @@ def main():
                 file, diff_output
             )
 
-        edit.apply(confirm_diff)
+        if args.candidates > 1:
+            best_of_n = BestOfN(
+                edit, args.test_command, candidates=args.candidates, method=args.workspace
+            )
+            try:
+                winner = best_of_n.run()
+                if not winner:
+                    user_interface.display_message(
+                        "No candidate passed the test command", color="red"
+                    )
+                else:
+                    user_interface.display_message(
+                        f"Candidate {winner.index} (temperature {winner.temperature}) "
+                        f"passed in {winner.elapsed:.1f}s"
+                    )
+                    winner.apply(
+                        [
+                            file
+                            for file, diff_output in winner.diffs.items()
+                            if confirm_diff(file, diff_output)
+                        ]
+                    )
+            finally:
+                best_of_n.cleanup()
+        else:
+            edit.apply(confirm_diff)
     except QuitException:
         user_interface.display_message("Canceled")
     finally:
+        edit._shutdown_speculation()
         readline.write_history_file(histfile)
 
 
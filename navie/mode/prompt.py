@@ -1,3 +1,13 @@
+import mmap
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Optional
+
+from navie.slicer import MIN_SLICE_LINES, slice_ranges
+
+
 def problem_statement_prompt(problem_statement: str) -> str:
     return f"""<problem-statement>
 {problem_statement}
@@ -5,8 +15,15 @@ def problem_statement_prompt(problem_statement: str) -> str:
 """
 
 
-def edit_prompt(file: str, plan: str, problem_statement: str) -> str:
-    return f"""Edit file {file} according to the following plan, that addresses the problem statement.
+# Edit prompts are laid out so that everything shared by the requests for the files of a
+# plan comes first, byte for byte the same in each request: the plan, the problem
+# statement and the context files. The file to edit comes last. This lets the LLM
+# provider reuse its cache of the shared prefix.
+
+
+def edit_plan_prompt(plan: str, problem_statement: str) -> str:
+    return f"""Edit code according to the following plan, that addresses the problem statement.
+The files to edit are named at the end.
 
 <plan>
 {plan}
@@ -18,18 +35,318 @@ def edit_prompt(file: str, plan: str, problem_statement: str) -> str:
 """
 
 
-def context_file_prompt(file: str) -> str:
-    with open(file, "r", encoding="utf-8") as f:
-        content_lines = f.readlines()
-        # Print each line with the line number, 6 characters wide
-        content = "".join(
-            [f"{i+1:6}: {line}" for i, line in enumerate(content_lines)]
+def edit_target_prompt(file: str) -> str:
+    return f"""Edit file {file} according to the plan.
+"""
+
+
+def edit_targets_prompt(files: list[str]) -> str:
+    file_list = "\n".join(f"- {file}" for file in files)
+    return f"""Edit the following files according to the plan. Emit the changes to all of the
+files. Each change must name the file it applies to.
+
+<files>
+{file_list}
+</files>
+"""
+
+
+def edit_region_prompt(file: str, start_line: int, end_line: int) -> str:
+    return f"""Edit lines {start_line}-{end_line} of file {file} according to the plan, if the plan
+affects them. Only change code within these lines; other parts of the file are edited
+separately.
+"""
+
+
+class PrefixStats:
+    """
+    Measures how much of each prompt repeats the start of an earlier prompt, as a check
+    on how much of it an LLM provider's prompt cache could reuse.
+    """
+
+    def __init__(self):
+        self.prompts: list[bytes] = []
+        self.total_bytes = 0
+        self.shared_bytes = 0
+        self._lock = threading.Lock()
+
+    def record(self, prompt: str) -> int:
+        """Record a prompt, returning the length of its longest prefix seen before."""
+        data = prompt.encode("utf-8")
+        with self._lock:
+            shared = max(
+                (_common_prefix_length(data, p) for p in self.prompts), default=0
+            )
+            self.prompts.append(data)
+            self.total_bytes += len(data)
+            self.shared_bytes += shared
+        return shared
+
+    @property
+    def shared_ratio(self) -> float:
+        return self.shared_bytes / self.total_bytes if self.total_bytes else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{len(self.prompts)} prompts, {self.shared_bytes} of {self.total_bytes} bytes "
+            f"({self.shared_ratio:.0%}) in a prefix shared with an earlier prompt"
         )
 
+
+def _common_prefix_length(a: bytes, b: bytes) -> int:
+    # Binary search on slice equality, so the comparison runs at C speed
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+# Files at least this large are read through a memory map.
+MMAP_THRESHOLD_BYTES = 1024 * 1024
+# Files larger than this are only rendered by line window.
+MAX_RENDER_BYTES = 4 * 1024 * 1024
+# A NUL byte in this many leading bytes marks a file as binary.
+BINARY_SNIFF_BYTES = 8192
+RENDER_CACHE_SIZE = 256
+
+
+class RenderedFile:
+    """
+    The line-numbered rendering of a file, as of a given size and mtime. Oversized
+    files keep only the byte offset of each line, and are decoded window by window.
+    """
+
+    def __init__(self, path: str, kind: str, size: int):
+        self.path = path
+        self.kind = kind
+        self.size = size
+        self.lines: list[str] = []
+        self.offsets = array("q")
+
+    @property
+    def line_count(self) -> int:
+        if self.kind == "oversized":
+            return len(self.offsets) - 1
+        return len(self.lines)
+
+    def text(self) -> str:
+        """The text of a rendered text file, without the line numbers."""
+        return "".join(line[line.index(": ") + 2 :] for line in self.lines)
+
+    def window(self, start_line: int, end_line: int) -> str:
+        """Render lines start_line..end_line, 1-based and inclusive."""
+        start_line = max(1, start_line)
+        end_line = min(self.line_count, end_line)
+        if end_line < start_line:
+            return ""
+        if self.kind != "oversized":
+            return "".join(self.lines[start_line - 1 : end_line])
+
+        with open(self.path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                chunk = data[self.offsets[start_line - 1] : self.offsets[end_line]]
+        return "".join(
+            _number_lines(_split_lines(chunk.decode("utf-8", "replace")), start_line)
+        )
+
+
+_render_cache: "OrderedDict[tuple, RenderedFile]" = OrderedDict()
+_render_cache_lock = threading.Lock()
+
+
+def clear_render_cache():
+    with _render_cache_lock:
+        _render_cache.clear()
+
+
+def _split_lines(text: str) -> list[str]:
+    # Same line splitting (and newline translation) as reading in text mode
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+        return [line + "\n" for line in lines]
+    return [line + "\n" for line in lines[:-1]] + [lines[-1]]
+
+
+def _number_lines(lines: list[str], first_line: int = 1) -> list[str]:
+    # Each line with the line number, 6 characters wide
+    return [f"{i + first_line:6}: {line}" for i, line in enumerate(lines)]
+
+
+def _line_offsets(data) -> array:
+    offsets = array("q", [0])
+    position = data.find(b"\n")
+    while position != -1:
+        offsets.append(position + 1)
+        position = data.find(b"\n", position + 1)
+    if offsets[-1] != len(data):
+        offsets.append(len(data))
+    return offsets
+
+
+def _load(path: str, size: int) -> RenderedFile:
+    if size == 0:
+        return RenderedFile(path, "text", 0)
+
+    with open(path, "rb") as f:
+        if size >= MMAP_THRESHOLD_BYTES:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data.find(b"\0", 0, BINARY_SNIFF_BYTES) != -1:
+                    return RenderedFile(path, "binary", size)
+                if size > MAX_RENDER_BYTES:
+                    rendered = RenderedFile(path, "oversized", size)
+                    rendered.offsets = _line_offsets(data)
+                    return rendered
+                raw = data[:]
+        else:
+            raw = f.read()
+            if b"\0" in raw[:BINARY_SNIFF_BYTES]:
+                return RenderedFile(path, "binary", size)
+
+    try:
+        text = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return RenderedFile(path, "binary", size)
+
+    rendered = RenderedFile(path, "text", size)
+    rendered.lines = _number_lines(_split_lines(text))
+    return rendered
+
+
+def render_file(file: str) -> RenderedFile:
+    """
+    Render a file with line numbers. Renderings are cached by (path, size, mtime_ns),
+    so a file is only re-read when it changes.
+    """
+    stat = os.stat(file)
+    key = (os.path.abspath(file), stat.st_size, stat.st_mtime_ns)
+    with _render_cache_lock:
+        rendered = _render_cache.get(key)
+        if rendered:
+            _render_cache.move_to_end(key)
+            return rendered
+
+    rendered = _load(file, stat.st_size)
+
+    with _render_cache_lock:
+        _render_cache[key] = rendered
+        while len(_render_cache) > RENDER_CACHE_SIZE:
+            _render_cache.popitem(last=False)
+    return rendered
+
+
+def context_file_prompt(
+    file: str,
+    start_line: Optional[int] = None,
+    end_line: Optional[int] = None,
+    lines: Optional[list[str]] = None,
+) -> str:
+    """
+    The file as context. A window of it can be rendered from lines that the caller has
+    already read, rather than from the file.
+    """
+    windowed = start_line is not None or end_line is not None
+    if windowed and lines is not None:
+        start_line = max(1, start_line or 1)
+        end_line = min(len(lines), end_line or len(lines))
+        content = "".join(_number_lines(lines[start_line - 1 : end_line], start_line))
+        return _window_prompt(file, start_line, end_line, len(lines), content)
+
+    rendered = render_file(file)
+
+    if rendered.kind == "binary":
+        return f"""<file>
+<path>{file}</path>
+<contents>(binary file of {rendered.size} bytes omitted)</contents>
+</file>
+"""
+
+    if rendered.kind == "oversized" and not windowed:
+        return f"""<file>
+<path>{file}</path>
+<contents>(file of {rendered.size} bytes and {rendered.line_count} lines is too large to include in full)</contents>
+</file>
+"""
+
+    if not windowed:
+        content = "".join(rendered.lines)
+        return f"""<file>
+<path>{file}</path>
+<contents><!CDATA[
+{content}
+]]></contents>
+</file>
+"""
+
+    start_line = start_line or 1
+    end_line = min(end_line or rendered.line_count, rendered.line_count)
+    content = rendered.window(start_line, end_line)
+    return _window_prompt(file, start_line, end_line, rendered.line_count, content)
+
+
+def _window_prompt(
+    file: str, start_line: int, end_line: int, line_count: int, content: str
+) -> str:
     return f"""<file>
 <path>{file}</path>
+<lines>{start_line}-{end_line} of {line_count}</lines>
 <contents><!CDATA[
 {content}
 ]]></contents>
 </file>
 """
+
+
+def context_file_slices_prompt(file: str, ranges: list[tuple[int, int]]) -> str:
+    """
+    Render only the given line ranges of a file (1-based, inclusive), with their
+    original line numbers. Omitted lines are marked with an ellipsis.
+    """
+    rendered = render_file(file)
+    if rendered.kind == "binary":
+        return context_file_prompt(file)
+
+    parts = []
+    next_line = 1
+    for start, end in ranges:
+        if start > next_line:
+            parts.append("      ...\n")
+        parts.append(rendered.window(start, end))
+        next_line = end + 1
+    if next_line <= rendered.line_count:
+        parts.append("      ...\n")
+    content = "".join(parts)
+
+    line_ranges = ", ".join(f"{start}-{end}" for start, end in ranges)
+    return f"""<file>
+<path>{file}</path>
+<lines>{line_ranges} of {rendered.line_count}</lines>
+<contents><!CDATA[
+{content}
+]]></contents>
+</file>
+"""
+
+
+def sliced_context_file_prompt(file: str, focus: str, terms=()) -> str:
+    """
+    Render the parts of a file that are relevant to the focus text and terms, or the
+    whole file if it's short or nothing in it matches.
+    """
+    rendered = render_file(file)
+    if rendered.kind == "binary":
+        return context_file_prompt(file)
+    if rendered.kind == "oversized":
+        # Too large to read in full, to slice or to send, so send its beginning
+        return context_file_prompt(file, start_line=1, end_line=MIN_SLICE_LINES)
+
+    ranges = slice_ranges(file, rendered.text(), focus, terms)
+    if ranges is None:
+        return context_file_prompt(file)
+
+    return context_file_slices_prompt(file, ranges)
@@ -0,0 +1,202 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from subprocess import CompletedProcess
+from typing import Callable, Optional
+
+from navie.config import Config
+
+# Environment variables that influence the output of an invocation, and therefore
+# participate in its fingerprint.
+FINGERPRINT_ENV = [
+    "APPMAP_NAVIE_TEMPERATURE",
+    "APPMAP_NAVIE_TOKEN_LIMIT",
+    "APPMAP_NAVIE_MODEL",
+]
+
+NAVIE_INPUT_OPTIONS = {"-i": "input", "-c": "context", "-p": "prompt"}
+APPLY_INPUT_OPTIONS = {"-s": "search", "-r": "replace"}
+
+
+class ReplayMissError(KeyError):
+    pass
+
+
+class Invocation:
+    """
+    A parsed `appmap navie` or `appmap apply` command line.
+
+    Paths are not part of the identity of an invocation; only the contents of the
+    files passed to the command are.
+    """
+
+    def __init__(self, command: list[str]):
+        args = command[len(Config.get_appmap_command()) :]
+        self.command = command
+        self.subcommand = args[0] if args else None
+        self.input_paths: dict[str, str] = {}
+        self.output_path: Optional[str] = None
+        self.trajectory_path: Optional[str] = None
+
+        options = (
+            APPLY_INPUT_OPTIONS if self.subcommand == "apply" else NAVIE_INPUT_OPTIONS
+        )
+        positional = []
+        i = 1
+        while i < len(args):
+            arg = args[i]
+            if arg in options:
+                self.input_paths[options[arg]] = args[i + 1]
+                i += 2
+            elif arg == "-o":
+                self.output_path = args[i + 1]
+                i += 2
+            elif arg == "--trajectory-file":
+                self.trajectory_path = args[i + 1]
+                i += 2
+            elif arg.startswith("-"):
+                i += 1
+            else:
+                positional.append(arg)
+                i += 1
+
+        if self.subcommand == "apply" and positional:
+            # apply edits its target in place
+            self.input_paths["target"] = positional[-1]
+            self.output_path = positional[-1]
+
+    def read_inputs(self) -> dict[str, str]:
+        inputs = {}
+        for name, path in self.input_paths.items():
+            with open(path, "r") as f:
+                inputs[name] = f.read()
+        return inputs
+
+    def fingerprint(self, inputs: dict[str, str], env: dict[str, str]) -> str:
+        hasher = hashlib.sha256()
+        hasher.update(
+            json.dumps(
+                {
+                    "subcommand": self.subcommand,
+                    "inputs": inputs,
+                    "env": {k: env[k] for k in FINGERPRINT_ENV if k in env},
+                },
+                sort_keys=True,
+            ).encode("utf-8")
+        )
+        return hasher.hexdigest()
+
+
+class Archive:
+    """
+    A gzip-compressed JSON lines file of recorded invocations. Each record is written
+    as its own gzip member, so recording is append-only and safe to interrupt.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._records: Optional[dict[str, dict]] = None
+        self._mtime = None
+
+    def append(self, record: dict):
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with gzip.open(self.path, "ab") as f:
+                f.write(line)
+
+    def lookup(self, fingerprint: str) -> Optional[dict]:
+        with self._lock:
+            mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+            if self._records is None or mtime != self._mtime:
+                self._records = {}
+                if mtime is not None:
+                    with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                        for line in f:
+                            if line.strip():
+                                record = json.loads(line)
+                                self._records[record["fingerprint"]] = record
+                self._mtime = mtime
+            return self._records.get(fingerprint)
+
+
+_archives: dict[str, Archive] = {}
+_archives_lock = threading.Lock()
+
+
+def archive(path: str) -> Archive:
+    path = os.path.abspath(path)
+    with _archives_lock:
+        if path not in _archives:
+            _archives[path] = Archive(path)
+        return _archives[path]
+
+
+def record(
+    archive_file: str,
+    command: list[str],
+    env: dict[str, str],
+    execute: Callable[[], CompletedProcess],
+):
+    invocation = Invocation(command)
+    inputs = invocation.read_inputs()
+
+    start = time.perf_counter()
+    result = execute()
+    elapsed = time.perf_counter() - start
+
+    output = None
+    if invocation.output_path and os.path.exists(invocation.output_path):
+        with open(invocation.output_path, "r") as f:
+            output = f.read()
+
+    archive(archive_file).append(
+        {
+            "fingerprint": invocation.fingerprint(inputs, env),
+            "subcommand": invocation.subcommand,
+            "inputs": inputs,
+            "env": {k: env[k] for k in FINGERPRINT_ENV if k in env},
+            "output": output,
+            "elapsed": elapsed,
+        }
+    )
+    return result
+
+
+def replay(archive_file: str, command: list[str], env: dict[str, str], log_file: str):
+    """
+    Serve an invocation from the archive. Its recorded elapsed time is logged, and with
+    the replay timing config it's also waited out, so that a replayed session takes as
+    long as the recorded one did.
+    """
+    invocation = Invocation(command)
+    fingerprint = invocation.fingerprint(invocation.read_inputs(), env)
+    recorded = archive(archive_file).lookup(fingerprint)
+
+    with open(log_file, "w") as log:
+        if recorded is None:
+            log.write(f"No recorded output for {invocation.subcommand} {fingerprint}\n")
+        else:
+            log.write(
+                f"Replayed {invocation.subcommand} {fingerprint}"
+                f" (recorded in {recorded.get('elapsed', 0):.3f}s)\n"
+            )
+
+    if recorded is None:
+        raise ReplayMissError(
+            f"No recorded output for {invocation.subcommand} ({fingerprint}) in {archive_file}"
+        )
+
+    if Config.get_replay_timing():
+        time.sleep(recorded.get("elapsed", 0))
+
+    if invocation.output_path and recorded["output"] is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(invocation.output_path)), exist_ok=True)
+        with open(invocation.output_path, "w") as f:
+            f.write(recorded["output"])
+
+    return CompletedProcess(command, 0)
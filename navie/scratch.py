@@ -0,0 +1,171 @@
+"""
+Scratch space for the payloads of one appmap call: the input, context and prompt passed
+to `appmap navie`, the intermediate files they're built from, and the output.
+
+The transport (APPMAP_NAVIE_TRANSPORT) decides where payloads live:
+
+- files: in the call's work dir. This is the default.
+- tmpfs: in a directory of its own under a memory-backed scratch root
+  (APPMAP_NAVIE_SCRATCH_DIR, or /dev/shm), which is removed when the call is done.
+- fifo: payloads are kept in memory, and the ones passed to the child are named pipes
+  that are fed while it runs. Each pipe can be read once per run. The output is written
+  under the scratch root, as with tmpfs, since the child's stdout carries its log.
+
+With tmpfs and fifo, payloads and output are also written to the work dir when
+APPMAP_NAVIE_DEBUG is true. Recording and replaying read payloads by path, so they
+always use files.
+"""
+
+import errno
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+from navie.config import Config
+
+TRANSPORTS = ("files", "tmpfs", "fifo")
+MEMORY_SCRATCH_ROOT = "/dev/shm"
+# How often a pipe is checked for a reader
+PIPE_POLL_SECONDS = 0.01
+
+
+def resolve_transport(transport: Optional[str] = None) -> str:
+    transport = transport or Config.get_transport()
+    if transport not in TRANSPORTS:
+        raise ValueError(f"Unknown transport {transport}; expected one of {TRANSPORTS}")
+    if Config.get_record_file() or Config.get_replay_file():
+        return "files"
+    if transport == "fifo" and not hasattr(os, "mkfifo"):
+        return "tmpfs"
+    return transport
+
+
+def scratch_root() -> str:
+    root = Config.get_scratch_dir()
+    if root:
+        os.makedirs(root, exist_ok=True)
+        return root
+    if os.path.isdir(MEMORY_SCRATCH_ROOT) and os.access(MEMORY_SCRATCH_ROOT, os.W_OK):
+        return MEMORY_SCRATCH_ROOT
+    return tempfile.gettempdir()
+
+
+class Scratch:
+    def __init__(self, work_dir: str, transport: Optional[str] = None):
+        self.work_dir = work_dir
+        self.transport = resolve_transport(transport)
+        self.debug = self.transport != "files" and Config.get_debug()
+        if self.transport == "files":
+            self.root = work_dir
+        else:
+            self.root = tempfile.mkdtemp(prefix="navie-", dir=scratch_root())
+        # With fifo, the payloads by path
+        self._contents: dict[str, str] = {}
+        self._pipes: list[str] = []
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def put(self, name: str, content: str) -> str:
+        """Store a payload, returning its path."""
+        path = self.path(name)
+        if self.transport == "fifo":
+            self._contents[path] = content
+        else:
+            with open(path, "w") as f:
+                f.write(content)
+        self._materialize(path, content)
+        return path
+
+    def append(self, path: str, content: str):
+        if path in self._contents:
+            self._contents[path] += content
+            self._materialize(path, self._contents[path])
+            return
+        with open(path, "a") as f:
+            f.write(content)
+        if self.debug:
+            self._materialize(path, self.read(path))
+
+    def read(self, path: str) -> str:
+        if path in self._contents:
+            return self._contents[path]
+        with open(path, "r") as f:
+            return f.read()
+
+    def size(self, path: str) -> int:
+        if path in self._contents:
+            return len(self._contents[path].encode("utf-8"))
+        return os.path.getsize(path) if os.path.isfile(path) else 0
+
+    def expose(self, path: Optional[str]) -> Optional[str]:
+        """Make a payload readable by the child, returning the path to pass it."""
+        if path is None or path not in self._contents:
+            return path
+        if path not in self._pipes:
+            os.mkfifo(path)
+            self._pipes.append(path)
+        return path
+
+    @contextmanager
+    def serving(self):
+        """Feed each exposed pipe to its reader while the child runs."""
+        stopped = threading.Event()
+        threads = [
+            threading.Thread(
+                target=_feed_pipe,
+                args=(path, self._contents[path].encode("utf-8"), stopped),
+                daemon=True,
+            )
+            for path in self._pipes
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            for thread in threads:
+                thread.join()
+
+    def read_output(self, path: str) -> str:
+        with open(path, "r") as f:
+            output = f.read()
+        self._materialize(path, output)
+        return output
+
+    def close(self):
+        if self.transport != "files":
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    def _materialize(self, path: str, content: str):
+        if not self.debug:
+            return
+        os.makedirs(self.work_dir, exist_ok=True)
+        with open(os.path.join(self.work_dir, os.path.basename(path)), "w") as f:
+            f.write(content)
+
+
+def _feed_pipe(path: str, data: bytes, stopped: threading.Event):
+    # Opening a pipe for writing without blocking fails until a reader opens it, so
+    # poll until the child does or the run is over.
+    while True:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            if stopped.wait(PIPE_POLL_SECONDS):
+                return
+
+    os.set_blocking(fd, True)
+    try:
+        with os.fdopen(fd, "wb") as pipe:
+            pipe.write(data)
+    except BrokenPipeError:
+        # The child stopped reading
+        pass
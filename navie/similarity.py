@@ -0,0 +1,278 @@
+"""
+An index of past requests by the similarity of their text, so that the result of a
+near-duplicate (an issue that was re-filed, or edited to fix a typo) can be reused when
+the exact cache misses.
+
+Texts are compared by MinHash signatures of their normalized token pairs, which estimate
+the Jaccard similarity of the texts. Signatures are banded (locality-sensitive hashing),
+so a lookup only compares the entries that share a band with the query rather than every
+entry.
+
+The index is a JSON-lines file, similarity.jsonl, in the index directory. Each entry
+holds a signature and the digest of its result, which is stored by its content in the
+results directory beside the index; the texts themselves aren't stored. Entries are
+appended, and the index is only rewritten to compact it. Entries only match requests of
+the same kind and with the same parameters.
+"""
+
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import time
+from typing import NamedTuple, Optional, cast
+
+INDEX_FILE = "similarity.jsonl"
+RESULTS_DIR = "results"
+
+SIGNATURE_SIZE = 64
+# Signatures are split into BANDS bands of SIGNATURE_SIZE / BANDS values. Entries that
+# share a band are compared.
+BANDS = 16
+SHINGLE_SIZE = 2
+DEFAULT_THRESHOLD = 0.8
+# Entries kept when the index is compacted, which is once it has twice as many
+MAX_ENTRIES = 2000
+
+TOKEN_RE = re.compile(r"[a-z0-9_]+")
+# The bits of a 64-bit hash left once the bin is taken out
+_VALUE_BITS = 64 - (SIGNATURE_SIZE - 1).bit_length()
+# A result that's no longer stored
+_MISSING = object()
+
+
+class Similar(NamedTuple):
+    score: float
+    result: object
+
+
+def shingles(text: str) -> set[str]:
+    tokens = TOKEN_RE.findall(text.lower())
+    if len(tokens) < SHINGLE_SIZE:
+        return set(tokens)
+    return {
+        " ".join(tokens[i : i + SHINGLE_SIZE])
+        for i in range(len(tokens) - SHINGLE_SIZE + 1)
+    }
+
+
+def signature(text: str) -> Optional[list[int]]:
+    """
+    The MinHash signature of a text, or None if it has no tokens. This is one-permutation
+    MinHash: each shingle is hashed once, into one of SIGNATURE_SIZE bins, and each bin
+    keeps its minimum. Empty bins borrow the minimum of the next non-empty bin, tagged
+    with the distance to it.
+    """
+    bins: list[Optional[int]] = [None] * SIGNATURE_SIZE
+    for shingle in shingles(text):
+        h = int.from_bytes(
+            hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big"
+        )
+        index, value = h % SIGNATURE_SIZE, h // SIGNATURE_SIZE
+        current = bins[index]
+        if current is None or value < current:
+            bins[index] = value
+    if all(value is None for value in bins):
+        return None
+
+    sig = []
+    for index in range(SIGNATURE_SIZE):
+        distance = 0
+        while bins[(index + distance) % SIGNATURE_SIZE] is None:
+            distance += 1
+        value = cast(int, bins[(index + distance) % SIGNATURE_SIZE])
+        sig.append(value + (distance << _VALUE_BITS))
+    return sig
+
+
+def similarity(a: list[int], b: list[int]) -> float:
+    """The estimated Jaccard similarity of the texts with these signatures."""
+    return sum(1 for x, y in zip(a, b) if x == y) / SIGNATURE_SIZE
+
+
+def params_key(params) -> str:
+    return hashlib.sha256(
+        json.dumps(params, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def _bands(sig: list[int]):
+    rows = SIGNATURE_SIZE // BANDS
+    for band in range(BANDS):
+        yield (band, tuple(sig[band * rows : (band + 1) * rows]))
+
+
+class SimilarityIndex:
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        self.index_file = os.path.join(index_dir, INDEX_FILE)
+        self.results_dir = os.path.join(index_dir, RESULTS_DIR)
+        self._entries: list[dict] = []
+        # (kind, params key, band) -> indexes into _entries
+        self._buckets: dict[tuple, list[int]] = {}
+        # The index file that was loaded, and how much of it
+        self._inode = None
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def lookup(
+        self, kind: str, text: str, params=None, threshold: float = DEFAULT_THRESHOLD
+    ) -> Optional[Similar]:
+        """The result of the most similar entry at or above the threshold."""
+        sig = signature(text)
+        if sig is None:
+            return None
+        key = params_key(params)
+        with self._lock:
+            self._refresh()
+            candidates = set()
+            for band in _bands(sig):
+                candidates.update(self._buckets.get((kind, key, band), ()))
+            best = None
+            # Later entries win ties, so that a result that's added again replaces the
+            # earlier one
+            for index in sorted(candidates):
+                entry = self._entries[index]
+                score = similarity(sig, entry["signature"])
+                if score >= threshold and (best is None or score >= best[0]):
+                    best = (score, entry["result"])
+        if best is None:
+            return None
+        result = self._read_result(best[1])
+        return None if result is _MISSING else Similar(best[0], result)
+
+    def add(self, kind: str, text: str, result, params=None):
+        sig = signature(text)
+        if sig is None:
+            return
+        os.makedirs(self.results_dir, exist_ok=True)
+        entry = {
+            "kind": kind,
+            "params": params_key(params),
+            "signature": _encode(sig),
+            "result": self._write_result(result),
+            "created_at": time.time(),
+        }
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+        with self._lock:
+            # One write, in append mode, so that lines of concurrent writers don't
+            # interleave
+            fd = os.open(self.index_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+            self._refresh()
+            if len(self._entries) > 2 * MAX_ENTRIES:
+                self._compact()
+
+    def _refresh(self):
+        # Read whatever was appended since the last refresh, by this index or another
+        # one (or process). The index is reloaded if it was compacted.
+        try:
+            f = open(self.index_file, "rb")
+        except FileNotFoundError:
+            self._reset()
+            return
+        with f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != self._inode or stat.st_size < self._offset:
+                self._reset()
+                self._inode = stat.st_ino
+            f.seek(self._offset)
+            data = f.read()
+        # A line that's being written is left for the next refresh
+        complete = data[: data.rfind(b"\n") + 1]
+        self._offset += len(complete)
+        for line in complete.splitlines():
+            try:
+                entry = json.loads(line)
+                entry["signature"] = _decode(entry["signature"])
+            except (ValueError, KeyError, struct.error):
+                continue
+            self._append(entry)
+
+    def _reset(self):
+        self._entries = []
+        self._buckets = {}
+        self._inode = None
+        self._offset = 0
+
+    def _append(self, entry: dict):
+        index = len(self._entries)
+        self._entries.append(entry)
+        for band in _bands(entry["signature"]):
+            self._buckets.setdefault((entry["kind"], entry["params"], band), []).append(
+                index
+            )
+
+    def _compact(self):
+        # Keep the latest MAX_ENTRIES entries, one per signature, and the results they
+        # refer to. Called with the lock held. An entry that another process appends
+        # to the old index meanwhile is lost, which costs a cache miss.
+        kept: dict[tuple, dict] = {}
+        for entry in reversed(self._entries):
+            key = (entry["kind"], entry["params"], tuple(entry["signature"]))
+            if key not in kept and len(kept) < MAX_ENTRIES:
+                kept[key] = entry
+        entries = list(reversed(kept.values()))
+        tmp_file = f"{self.index_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_file, "w") as f:
+            for entry in entries:
+                f.write(json.dumps({**entry, "signature": _encode(entry["signature"])}))
+                f.write("\n")
+        os.replace(tmp_file, self.index_file)
+        self._reset()
+        self._refresh()
+
+        referenced = {f"{entry['result']}.json" for entry in entries}
+        for name in os.listdir(self.results_dir):
+            if name.endswith(".json") and name not in referenced:
+                try:
+                    os.remove(os.path.join(self.results_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    def _write_result(self, result) -> str:
+        # Results are stored by their content, so that one that's added again (or
+        # found for another text) is stored once
+        content = json.dumps(result, sort_keys=True).encode("utf-8")
+        digest = hashlib.sha256(content).hexdigest()
+        result_file = os.path.join(self.results_dir, f"{digest}.json")
+        if not os.path.exists(result_file):
+            tmp_file = f"{result_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_file, "wb") as f:
+                f.write(content)
+            os.replace(tmp_file, result_file)
+        return digest
+
+    def _read_result(self, digest: str):
+        try:
+            with open(os.path.join(self.results_dir, f"{digest}.json"), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            # Removed by a compaction since the index was read
+            return _MISSING
+
+
+def _encode(sig: list[int]) -> str:
+    return struct.pack(f">{SIGNATURE_SIZE}Q", *sig).hex()
+
+
+def _decode(encoded: str) -> list[int]:
+    return list(struct.unpack(f">{SIGNATURE_SIZE}Q", bytes.fromhex(encoded)))
+
+
+_indexes: dict[str, SimilarityIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def open_similarity_index(index_dir: str) -> SimilarityIndex:
+    """A shared index for the directory."""
+    key = os.path.abspath(index_dir)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = SimilarityIndex(index_dir)
+        return _indexes[key]
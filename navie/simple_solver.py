@@ -1,6 +1,7 @@
 import os
 import sys
 from navie.log_print import log_print
+from navie.daemon import DaemonClient
 from navie.editor import Editor
 
 
@@ -12,13 +13,22 @@ class SimpleSolver:
         self.log = log_print
 
     def solve(self, issue_file, work_dir):
-        editor = Editor(work_dir, self.temperature, self.token_limit, self.log)
-
         with open(issue_file, "r") as f:
             issue_content = f.read()
 
-        editor.plan(issue_content)
-        generated_code = editor.generate()
+        daemon = DaemonClient.discover()
+        if daemon:
+            options = {"temperature": self.temperature, "token_limit": self.token_limit}
+            plan = daemon.run(
+                "plan", {"issue": issue_content, **options}, work_dir=work_dir
+            )
+            generated_code = daemon.run(
+                "generate", {"plan": plan, **options}, work_dir=work_dir
+            )
+        else:
+            editor = Editor(work_dir, self.temperature, self.token_limit, log=self.log)
+            editor.plan(issue_content)
+            generated_code = editor.generate()
 
         print(generated_code)
 
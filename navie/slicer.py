@@ -0,0 +1,234 @@
+"""
+Slices source files down to the classes and functions that are relevant to a piece of
+text (such as a plan), so that prompts don't have to include large files in full.
+
+Python files are sliced along `ast` definitions. Other files are sliced along
+indentation: each top-level block that starts at column 0 is a region.
+"""
+
+import ast
+import json
+import re
+from typing import Iterable, Optional
+
+# Files shorter than this are always included in full.
+MIN_SLICE_LINES = 150
+# Lines of surrounding context added to each selected region.
+CONTEXT_LINES = 2
+
+IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+BACKTICKED_RE = re.compile(r"`([^`\n]+)`")
+DOTTED_NAME_RE = re.compile(r"\b[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)+")
+CALL_RE = re.compile(r"\b([A-Za-z_][A-Za-z0-9_]*)\(")
+CAMEL_CASE_RE = re.compile(r"[a-z0-9][A-Z]|[A-Z]{2}[a-z]")
+HEADER_RE = re.compile(
+    r"^\s*(import|from|package|use|using|require|include|#include|#import|@import)\b"
+)
+BLOCK_NAME_RE = re.compile(
+    r"\b(?:class|def|function|func|fn|interface|struct|enum|trait|module|impl|type)\s+([A-Za-z_][A-Za-z0-9_]*)"
+)
+
+
+class Region:
+    def __init__(self, start: int, end: int, name: Optional[str], kind: str):
+        # 1-based, inclusive line numbers
+        self.start = start
+        self.end = end
+        self.name = name
+        self.kind = kind
+        self.children: list[Region] = []
+        self.header_end = start
+
+    def __repr__(self):
+        return f"Region({self.kind} {self.name} {self.start}-{self.end})"
+
+
+def _node_start(node) -> int:
+    decorators = getattr(node, "decorator_list", [])
+    return min([node.lineno] + [d.lineno for d in decorators])
+
+
+def _python_regions(text: str) -> list[Region]:
+    tree = ast.parse(text)
+    regions = []
+    for node in tree.body:
+        start, end = _node_start(node), node.end_lineno or node.lineno
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            regions.append(Region(start, end, None, "header"))
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            regions.append(Region(start, end, node.name, "function"))
+        elif isinstance(node, ast.ClassDef):
+            region = Region(start, end, node.name, "class")
+            region.header_end = (
+                _node_start(node.body[0]) - 1 if node.body else end
+            )
+            for child in node.body:
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    region.children.append(
+                        Region(
+                            _node_start(child),
+                            child.end_lineno or child.lineno,
+                            child.name,
+                            "function",
+                        )
+                    )
+            regions.append(region)
+        else:
+            names = [
+                n.id
+                for n in ast.walk(node)
+                if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Store)
+            ]
+            regions.append(Region(start, end, names[0] if names else None, "block"))
+    return regions
+
+
+def _indentation_regions(lines: list[str]) -> list[Region]:
+    regions = []
+    current: Optional[Region] = None
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        top_level = not line[0].isspace()
+        closing = line.strip()[0] in ")]}"
+        if top_level and not closing:
+            if current:
+                regions.append(current)
+            if HEADER_RE.match(line):
+                current = Region(number, number, None, "header")
+            else:
+                match = BLOCK_NAME_RE.search(line)
+                current = Region(
+                    number, number, match.group(1) if match else None, "block"
+                )
+        elif current:
+            current.end = number
+    if current:
+        regions.append(current)
+    return regions
+
+
+def symbol_regions(path: str, text: str) -> list[Region]:
+    if path.endswith(".py"):
+        try:
+            return _python_regions(text)
+        except SyntaxError:
+            pass
+    return _indentation_regions(text.splitlines())
+
+
+def parse_terms(raw_terms: Iterable[str]) -> list[str]:
+    """
+    Parse the output of Editor.suggest_terms, which is a list of JSON-encoded lists
+    (or plain text if the model didn't emit JSON), into a flat list of terms.
+    """
+    terms = []
+    for raw in raw_terms:
+        try:
+            parsed = json.loads(raw)
+        except json.JSONDecodeError:
+            parsed = IDENTIFIER_RE.findall(raw)
+        if isinstance(parsed, str):
+            parsed = [parsed]
+        if isinstance(parsed, list):
+            terms.extend(str(term) for term in parsed)
+    return terms
+
+
+def code_names(text: str) -> set[str]:
+    """
+    The names in prose (such as a plan) that look like code, rather than every word:
+    backticked code, dotted names, calls, and snake_case or CamelCase identifiers.
+    """
+    names = set()
+    for code in BACKTICKED_RE.findall(text):
+        names.update(IDENTIFIER_RE.findall(code))
+    for dotted in DOTTED_NAME_RE.findall(text):
+        names.update(dotted.split("."))
+    names.update(CALL_RE.findall(text))
+    names.update(
+        name
+        for name in IDENTIFIER_RE.findall(text)
+        if "_" in name or CAMEL_CASE_RE.search(name)
+    )
+    return names
+
+
+def _wanted_names(focus: str, terms: Iterable[str]) -> set[str]:
+    names = code_names(focus)
+    for term in terms:
+        # Qualified names and paths contribute each of their parts
+        names.update(IDENTIFIER_RE.findall(term))
+    return names
+
+
+def slice_ranges(
+    path: str,
+    text: str,
+    focus: str,
+    terms: Iterable[str] = (),
+    min_lines: int = MIN_SLICE_LINES,
+) -> Optional[list[tuple[int, int]]]:
+    """
+    Return the line ranges of the file that are relevant to the focus text and terms:
+    headers (imports), plus each class or function that the terms or the code names in
+    the focus text name. Returns None when the file should be included in full, because
+    it's short or because nothing matched.
+    """
+    line_count = len(text.splitlines())
+    if line_count < min_lines:
+        return None
+
+    wanted = _wanted_names(focus, terms)
+    ranges = []
+    matched = False
+    for region in symbol_regions(path, text):
+        children = [c for c in region.children if c.name in wanted]
+        if region.kind == "header":
+            ranges.append((region.start, region.end))
+        elif children:
+            # Just the class header and the methods that matched
+            ranges.append((region.start, region.header_end))
+            ranges.extend((c.start, c.end) for c in children)
+            matched = True
+        elif region.name in wanted:
+            ranges.append((region.start, region.end))
+            matched = True
+
+    if not matched:
+        return None
+
+    return merge_ranges(ranges, CONTEXT_LINES, line_count)
+
+
+def touched_ranges(
+    path: str, text: str, focus: str, terms: Iterable[str] = ()
+) -> list[tuple[int, int]]:
+    """
+    Return the line ranges of the classes and functions that the terms or the code names
+    in the focus text mention, for editing region by region. Methods are returned
+    separately from their class, unless the class is mentioned but none of its methods
+    are.
+    """
+    wanted = _wanted_names(focus, terms)
+    ranges = []
+    for region in symbol_regions(path, text):
+        children = [c for c in region.children if c.name in wanted]
+        if children:
+            ranges.extend((c.start, c.end) for c in children)
+        elif region.kind != "header" and region.name in wanted:
+            ranges.append((region.start, region.end))
+    return merge_ranges(ranges, 0, len(text.splitlines()))
+
+
+def merge_ranges(
+    ranges: Iterable[tuple[int, int]], padding: int, line_count: int
+) -> list[tuple[int, int]]:
+    merged: list[tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        start, end = max(1, start - padding), min(line_count, end + padding)
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
@@ -0,0 +1,388 @@
+"""
+A persistent index of the symbols defined in a repository: classes, functions and methods,
+plus module and file names. Python files are indexed with `ast`; other source files with
+a tokenizer for definition keywords and indentation.
+
+The index lives in a directory with two files:
+
+- manifest.json, which records the size, mtime and symbols of each indexed file, so that
+  update() only re-parses the files that changed.
+- symbols.idx, one "name<TAB>kind<TAB>path<TAB>start<TAB>end" line per symbol, sorted,
+  which is memory-mapped and binary-searched by lookup().
+
+It answers exact-identifier lookups, and can stand in for `suggest_terms` and `@context`
+when the answer is unambiguous enough (see answer_terms and answer_context).
+"""
+
+import ast
+import json
+import mmap
+import os
+import re
+import threading
+from typing import NamedTuple, Optional
+
+from navie.slicer import BLOCK_NAME_RE, IDENTIFIER_RE
+
+INDEX_VERSION = 1
+INDEXED_EXTENSIONS = {
+    ".py",
+    ".js",
+    ".jsx",
+    ".ts",
+    ".tsx",
+    ".java",
+    ".kt",
+    ".scala",
+    ".rb",
+    ".go",
+    ".rs",
+    ".c",
+    ".h",
+    ".cc",
+    ".cpp",
+    ".hpp",
+    ".cs",
+    ".php",
+    ".swift",
+}
+IGNORED_DIRECTORIES = {"node_modules", "__pycache__", "venv", "build", "dist", "target"}
+MAX_FILE_BYTES = 1024 * 1024
+
+# Terms shorter than this aren't looked up
+MIN_TERM_LENGTH = 3
+# The local answer is confident when at least this many terms are found...
+MIN_CONFIDENT_TERMS = 2
+# ...each with at most this many definitions.
+MAX_DEFINITIONS = 3
+MAX_SNIPPET_LINES = 200
+
+DEFINITION_KINDS = ("class", "function", "method")
+CLASS_KEYWORDS = ("class", "interface", "struct", "enum", "trait")
+
+
+class Symbol(NamedTuple):
+    name: str
+    kind: str
+    path: str
+    # 1-based, inclusive
+    start: int
+    end: int
+
+
+def module_name(path: str) -> Optional[str]:
+    if not path.endswith(".py"):
+        return None
+    parts = path[: -len(".py")].split("/")
+    if parts[-1] == "__init__":
+        parts.pop()
+    return ".".join(parts) if parts else None
+
+
+def _python_symbols(text: str) -> list[tuple[str, str, int, int]]:
+    symbols = []
+
+    def visit(nodes, in_class):
+        for node in nodes:
+            if isinstance(node, ast.ClassDef):
+                symbols.append((node.name, "class", node.lineno, node.end_lineno))
+                visit(node.body, True)
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                kind = "method" if in_class else "function"
+                symbols.append((node.name, kind, node.lineno, node.end_lineno))
+                visit(node.body, False)
+
+    visit(ast.parse(text).body, False)
+    return symbols
+
+
+def _indentation(line: str) -> int:
+    return len(line) - len(line.lstrip())
+
+
+def _block_end(lines: list[str], index: int) -> int:
+    # The last line (1-based) of the block that starts at lines[index]: the line before
+    # the next non-blank line that's indented no further, or that line if it closes the
+    # block with a bracket.
+    indentation = _indentation(lines[index])
+    for number in range(index + 1, len(lines)):
+        line = lines[number]
+        if not line.strip() or _indentation(line) > indentation:
+            continue
+        if line.strip()[0] in ")]}" or line.strip() == "end":
+            return number + 1
+        return number
+    return len(lines)
+
+
+def _tokenized_symbols(text: str) -> list[tuple[str, str, int, int]]:
+    lines = text.splitlines()
+    symbols = []
+    for index, line in enumerate(lines):
+        match = BLOCK_NAME_RE.search(line)
+        if not match:
+            continue
+        keyword = line[match.start() : match.start(1)].split()[0]
+        kind = "class" if keyword in CLASS_KEYWORDS else "function"
+        symbols.append((match.group(1), kind, index + 1, _block_end(lines, index)))
+    return symbols
+
+
+def extract_symbols(path: str, text: str) -> list[tuple[str, str, int, int]]:
+    """The (name, kind, start, end) symbols of a file, including its module name."""
+    line_count = max(1, len(text.splitlines()))
+    symbols = []
+    if path.endswith(".py"):
+        try:
+            symbols = _python_symbols(text)
+        except SyntaxError:
+            symbols = _tokenized_symbols(text)
+        module = module_name(path)
+        if module:
+            symbols.append((module, "module", 1, line_count))
+    else:
+        symbols = _tokenized_symbols(text)
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    symbols.append((stem, "file", 1, line_count))
+    # Names can't contain the separators of symbols.idx
+    return [s for s in symbols if s[0] and "\t" not in s[0] and "\n" not in s[0]]
+
+
+class SymbolIndex:
+    def __init__(self, root: str = ".", index_dir: Optional[str] = None):
+        self.root = os.path.abspath(root)
+        self.index_dir = os.path.abspath(
+            index_dir or os.path.join(self.root, ".navie", "index")
+        )
+        self.manifest_file = os.path.join(self.index_dir, "manifest.json")
+        self.symbols_file = os.path.join(self.index_dir, "symbols.idx")
+        self._data: Optional[mmap.mmap] = None
+        self._mapped_version = None
+        self._lock = threading.Lock()
+
+    def _walk(self):
+        for directory, subdirectories, files in os.walk(self.root):
+            subdirectories[:] = sorted(
+                d
+                for d in subdirectories
+                if not d.startswith(".") and d not in IGNORED_DIRECTORIES
+            )
+            for name in sorted(files):
+                if os.path.splitext(name)[1] not in INDEXED_EXTENSIONS:
+                    continue
+                path = os.path.join(directory, name)
+                relpath = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if "\t" in relpath or "\n" in relpath:
+                    continue
+                yield relpath, path
+
+    def _load_manifest(self) -> dict:
+        try:
+            with open(self.manifest_file, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get("version") != INDEX_VERSION:
+            return {}
+        return manifest.get("files", {})
+
+    def update(self) -> int:
+        """
+        Bring the index up to date with the files on disk. Returns the number of files
+        that were (re-)parsed.
+        """
+        previous = self._load_manifest()
+        files = {}
+        parsed = 0
+        for relpath, path in self._walk():
+            stat = os.stat(path)
+            if stat.st_size > MAX_FILE_BYTES:
+                continue
+            entry = previous.get(relpath)
+            if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+                files[relpath] = entry
+                continue
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                text = f.read()
+            files[relpath] = [stat.st_size, stat.st_mtime_ns, extract_symbols(relpath, text)]
+            parsed += 1
+
+        if files.keys() != previous.keys() or parsed or not os.path.exists(
+            self.symbols_file
+        ):
+            self._write(files)
+        return parsed
+
+    def _write(self, files: dict):
+        os.makedirs(self.index_dir, exist_ok=True)
+        lines = sorted(
+            f"{name}\t{kind}\t{path}\t{start}\t{end}\n"
+            for path, (_, _, symbols) in files.items()
+            for name, kind, start, end in symbols
+        )
+        with self._lock:
+            # Lookups in other threads may be reading the mapping, so it isn't closed;
+            # it's closed once they no longer reference it
+            self._data = None
+            _write_atomic(self.symbols_file, "".join(lines))
+            _write_atomic(
+                self.manifest_file, json.dumps({"version": INDEX_VERSION, "files": files})
+            )
+
+    def _mapped(self) -> Optional[mmap.mmap]:
+        try:
+            stat = os.stat(self.symbols_file)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            # The index file is replaced, never rewritten, when another index updates it
+            version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if self._data is not None and self._mapped_version != version:
+                # Lookups in progress may still be reading the old mapping, so it's left
+                # to be closed when it's no longer referenced
+                self._data = None
+            if self._data is None:
+                if not stat.st_size:
+                    return None
+                with open(self.symbols_file, "rb") as f:
+                    self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._mapped_version = version
+            return self._data
+
+    def lookup(self, name: str) -> list[Symbol]:
+        """The symbols with exactly this name."""
+        data = self._mapped()
+        if data is None or not name:
+            return []
+        key = name.encode("utf-8") + b"\t"
+        position = _lower_bound(data, key)
+        symbols = []
+        while position < len(data):
+            end = data.find(b"\n", position)
+            end = len(data) if end == -1 else end
+            line = data[position:end]
+            if not line.startswith(key):
+                break
+            name, kind, path, start, stop = line.decode("utf-8").split("\t")
+            symbols.append(Symbol(name, kind, path, int(start), int(stop)))
+            position = end + 1
+        return symbols
+
+    def find_terms(self, text: str) -> list[str]:
+        """The identifiers in the text that the repository defines, in order."""
+        terms = []
+        for candidate in dict.fromkeys(_candidate_terms(text)):
+            if len(candidate) < MIN_TERM_LENGTH:
+                continue
+            if any(s.kind in DEFINITION_KINDS + ("module",) for s in self.lookup(candidate)):
+                terms.append(candidate)
+        return terms
+
+    def answer_terms(self, text: str) -> Optional[list[str]]:
+        """The terms of the text, or None if too few are found to be confident."""
+        terms = self.find_terms(text)
+        return terms if len(terms) >= MIN_CONFIDENT_TERMS else None
+
+    def resolve_files(self, content: str) -> list[str]:
+        """Files named in the content by module name, or by a unique partial path."""
+        files = []
+        for candidate in dict.fromkeys(_candidate_terms(content)):
+            modules = [s for s in self.lookup(candidate) if s.kind == "module"]
+            if len(modules) == 1:
+                files.append(modules[0].path)
+                continue
+            if "/" in candidate or "." in candidate:
+                stem = os.path.splitext(os.path.basename(candidate))[0]
+                matches = [
+                    s.path
+                    for s in self.lookup(stem)
+                    if s.kind == "file" and s.path.endswith(candidate.lstrip("./"))
+                ]
+                if len(matches) == 1:
+                    files.append(matches[0])
+        return list(dict.fromkeys(files))
+
+    def context(self, query: str) -> tuple[list[dict], int]:
+        """
+        Context items for the definitions of the terms in the query, shaped like the
+        items returned by @context, and the number of terms that were found unambiguously.
+        """
+        items = []
+        unambiguous = 0
+        for term in self.find_terms(query):
+            definitions = [s for s in self.lookup(term) if s.kind in DEFINITION_KINDS]
+            if not definitions:
+                continue
+            if len(definitions) <= MAX_DEFINITIONS:
+                unambiguous += 1
+            for symbol in definitions[:MAX_DEFINITIONS]:
+                items.append(self._snippet(symbol))
+        return items, unambiguous
+
+    def answer_context(self, query: str) -> Optional[list[dict]]:
+        """Context for the query, or None if the local answer isn't confident."""
+        items, unambiguous = self.context(query)
+        return items if unambiguous >= MIN_CONFIDENT_TERMS else None
+
+    def _snippet(self, symbol: Symbol) -> dict:
+        end = min(symbol.end, symbol.start + MAX_SNIPPET_LINES - 1)
+        lines = []
+        with open(os.path.join(self.root, symbol.path), "r", errors="replace") as f:
+            for number, line in enumerate(f, 1):
+                if number > end:
+                    break
+                if number >= symbol.start:
+                    lines.append(line)
+        return {
+            "type": "code-snippet",
+            "location": f"{symbol.path}:{symbol.start}-{end}",
+            "content": "".join(lines),
+        }
+
+
+def _candidate_terms(text: str):
+    # Dotted and slashed names such as modules and paths, each followed by its identifiers
+    for name in QUALIFIED_NAME_RE.findall(text):
+        yield name
+        yield from IDENTIFIER_RE.findall(name)
+
+
+QUALIFIED_NAME_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_./]*[A-Za-z0-9_]")
+
+
+def _lower_bound(data, key: bytes) -> int:
+    # The offset of the first line of data (sorted lines) that's >= key
+    low, high = 0, len(data)
+    while low < high:
+        middle = (low + high) // 2
+        start = data.rfind(b"\n", 0, middle) + 1
+        end = data.find(b"\n", start)
+        end = len(data) if end == -1 else end
+        if data[start:end] < key:
+            low = end + 1
+        else:
+            high = start
+    return low
+
+
+def _write_atomic(path: str, content: str):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+_indexes: dict[tuple[str, str], SymbolIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def open_index(root: str = ".", index_dir: Optional[str] = None) -> SymbolIndex:
+    """A shared index of the root directory, updated when it's first opened."""
+    index = SymbolIndex(root, index_dir)
+    key = (index.root, index.index_dir)
+    with _indexes_lock:
+        if key not in _indexes:
+            index.update()
+            _indexes[key] = index
+        return _indexes[key]
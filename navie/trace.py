@@ -0,0 +1,270 @@
+import atexit
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+
+from navie.config import Config
+
+# Tracing is enabled by configuring a trace file (APPMAP_NAVIE_TRACE_FILE). When it's
+# not configured, span() returns a shared no-op span and traced() calls straight through.
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar(
+    "navie_trace_span", default=None
+)
+# The most recent finished spans are kept for export; older ones are dropped, so that a
+# long-running process (such as the daemon) doesn't grow without bound
+MAX_FINISHED_SPANS = 100_000
+_finished_spans: deque = deque(maxlen=MAX_FINISHED_SPANS)
+_lock = threading.Lock()
+_exporter_registered = False
+
+
+def enabled() -> bool:
+    return Config.get_trace_file() is not None
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        return self
+
+    def add(self, **amounts):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.span_id = os.urandom(8).hex()
+        self.parent: Optional[Span] = None
+        self.trace_id: str = ""
+        self.thread_id = threading.get_ident()
+        self.start_ns = 0
+        self.end_ns = 0
+        self.error: Optional[str] = None
+        # Set for a span opened by child(), whose end follows that of its descendants
+        self.open_ended = False
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def add(self, **amounts):
+        for key, amount in amounts.items():
+            self.attributes[key] = self.attributes.get(key, 0) + amount
+        return self
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self.trace_id = self.parent.trace_id if self.parent else os.urandom(16).hex()
+        self._token = _current_span.set(self)
+        self.start_ns = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self._token)
+        ancestor = self.parent
+        while ancestor:
+            if ancestor.open_ended:
+                ancestor.end_ns = max(ancestor.end_ns, self.end_ns)
+            ancestor = ancestor.parent
+        _finish(self)
+        return False
+
+
+def span(name: str, **attributes):
+    if not enabled():
+        return NOOP_SPAN
+    return Span(name, attributes)
+
+
+def current():
+    return _current_span.get() or NOOP_SPAN
+
+
+def child(name: str, **attributes):
+    """
+    A span under the current one, for work that's done later, and possibly on other
+    threads, within() it. It's finished right away, and its end is extended to that of
+    each span opened within it.
+    """
+    if not enabled():
+        return NOOP_SPAN
+    opened = Span(name, attributes)
+    opened.parent = _current_span.get()
+    opened.trace_id = opened.parent.trace_id if opened.parent else os.urandom(16).hex()
+    opened.start_ns = opened.end_ns = time.time_ns()
+    opened.open_ended = True
+    _finish(opened)
+    return opened
+
+
+@contextmanager
+def within(parent):
+    """Open the spans of a block under parent, unless they're already under it."""
+    current_span = _current_span.get()
+    ancestor = current_span
+    while ancestor and ancestor is not parent:
+        ancestor = ancestor.parent
+    if not isinstance(parent, Span) or ancestor is parent:
+        yield
+        return
+    token = _current_span.set(parent)
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+
+
+def traced(name: str):
+    """
+    Decorate a function so that each call runs in a span with the given name. The span
+    of a method of an object with a trace_parent span (such as a sub-editor) is opened
+    within() it.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            parent = getattr(args[0], "trace_parent", None) if args else None
+            with within(parent), Span(name, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _finish(finished: Span):
+    global _exporter_registered
+    with _lock:
+        _finished_spans.append(finished)
+        if not _exporter_registered:
+            atexit.register(export)
+            _exporter_registered = True
+
+
+def finished_spans() -> list[Span]:
+    with _lock:
+        return list(_finished_spans)
+
+
+def reset():
+    with _lock:
+        _finished_spans.clear()
+
+
+def export(trace_file: Optional[str] = None, trace_format: Optional[str] = None):
+    """
+    Write all finished spans to the trace file. The format is "chrome" (Chrome trace
+    event JSON, viewable in chrome://tracing or Perfetto) or "otlp" (OTLP/JSON). It
+    defaults to APPMAP_NAVIE_TRACE_FORMAT, or is inferred from the file name.
+    """
+    trace_file = trace_file or Config.get_trace_file()
+    if not trace_file:
+        return
+    trace_format = trace_format or Config.get_trace_format()
+    if not trace_format:
+        trace_format = "otlp" if ".otlp" in os.path.basename(trace_file) else "chrome"
+
+    spans = finished_spans()
+    if trace_format == "chrome":
+        document = chrome_trace(spans)
+    elif trace_format == "otlp":
+        document = otlp_trace(spans)
+    else:
+        raise ValueError(f"Unknown trace format: {trace_format}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(trace_file)), exist_ok=True)
+    with open(trace_file, "w") as f:
+        json.dump(document, f)
+
+
+def chrome_trace(spans: list[Span]) -> dict:
+    pid = os.getpid()
+    events = []
+    for s in spans:
+        args = dict(s.attributes)
+        if s.error:
+            args["error"] = s.error
+        events.append(
+            {
+                "name": s.name,
+                "cat": "navie",
+                "ph": "X",
+                "ts": s.start_ns / 1000,
+                "dur": (s.end_ns - s.start_ns) / 1000,
+                "pid": pid,
+                "tid": s.thread_id,
+                "args": args,
+            }
+        )
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_trace(spans: list[Span]) -> dict:
+    otlp_spans = []
+    for s in spans:
+        otlp_span = {
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 1,
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in s.attributes.items()
+            ],
+            "status": (
+                {"code": 2, "message": s.error} if s.error else {"code": 1}
+            ),
+        }
+        if s.parent:
+            otlp_span["parentSpanId"] = s.parent.span_id
+        otlp_spans.append(otlp_span)
+
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {"key": "service.name", "value": {"stringValue": "navie"}},
+                        {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+                    ]
+                },
+                "scopeSpans": [{"scope": {"name": "navie"}, "spans": otlp_spans}],
+            }
+        ]
+    }
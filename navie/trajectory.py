@@ -0,0 +1,322 @@
+"""
+Per-call trajectory segments, and an aggregator that reports tokens, latency and
+estimated cost by operation, issue and model.
+
+When a trajectory directory is configured (APPMAP_NAVIE_TRAJECTORY_DIR), every
+`appmap navie` invocation writes its own trajectory segment named after the work dir
+and call id, alongside a `.meta.json` file describing the call.
+
+Usage:
+    python -m navie.trajectory <trajectory-dir> [--by operation] [--price MODEL=IN,OUT]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from typing import Iterable, Optional
+
+INDEX_FILE = "index.json"
+META_SUFFIX = ".meta.json"
+SEGMENT_SUFFIX = ".jsonl"
+
+# Rough characters-per-token ratio, used when a trajectory doesn't report token usage.
+CHARS_PER_TOKEN = 4
+
+# USD per million (input, output) tokens, matched by model name prefix.
+DEFAULT_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "o1-mini": (3.00, 12.00),
+    "o1": (15.00, 60.00),
+    "claude-3-5-sonnet": (3.00, 15.00),
+    "claude-3-5-haiku": (0.80, 4.00),
+    "claude-3-opus": (15.00, 75.00),
+}
+
+_call_counter = itertools.count(1)
+
+
+def next_call_id() -> str:
+    return "-".join(
+        [
+            time.strftime("%Y%m%dT%H%M%S", time.gmtime()),
+            str(os.getpid()),
+            f"{next(_call_counter):04d}",
+        ]
+    )
+
+
+def slugify(path: str) -> str:
+    return "".join([c if c.isalnum() else "_" for c in path]).strip("_")
+
+
+def segment_path(trajectory_dir: str, work_dir: str, call_id: str) -> str:
+    return os.path.join(
+        trajectory_dir, f"{slugify(os.path.relpath(work_dir))}.{call_id}{SEGMENT_SUFFIX}"
+    )
+
+
+def call_id_of(segment_file: str) -> str:
+    return os.path.basename(segment_file)[: -len(SEGMENT_SUFFIX)].rsplit(".", 1)[-1]
+
+
+def write_meta(segment_file: str, meta: dict):
+    os.makedirs(os.path.dirname(os.path.abspath(segment_file)), exist_ok=True)
+    with open(segment_file[: -len(SEGMENT_SUFFIX)] + META_SUFFIX, "w") as f:
+        json.dump(meta, f)
+
+
+def _find_usage(entry) -> Optional[tuple[int, int]]:
+    if not isinstance(entry, dict):
+        return None
+    usage = entry.get("usage")
+    if isinstance(usage, dict):
+        input_tokens = usage.get("prompt_tokens", usage.get("input_tokens"))
+        output_tokens = usage.get("completion_tokens", usage.get("output_tokens"))
+        if input_tokens is not None or output_tokens is not None:
+            return int(input_tokens or 0), int(output_tokens or 0)
+    for value in entry.values():
+        found = _find_usage(value)
+        if found:
+            return found
+    return None
+
+
+def summarize_segment(segment_file: str) -> dict:
+    meta_file = segment_file[: -len(SEGMENT_SUFFIX)] + META_SUFFIX
+    meta = {}
+    if os.path.exists(meta_file):
+        with open(meta_file, "r") as f:
+            meta = json.load(f)
+
+    reported = [0, 0]
+    has_usage = False
+    estimated_chars = [0, 0]
+    model = meta.get("model")
+    if os.path.exists(segment_file):
+        with open(segment_file, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if not isinstance(entry, dict):
+                    continue
+
+                model = model or entry.get("model")
+                usage = _find_usage(entry)
+                if usage:
+                    has_usage = True
+                    reported[0] += usage[0]
+                    reported[1] += usage[1]
+
+                message = entry.get("message")
+                if isinstance(message, dict) and isinstance(message.get("content"), str):
+                    index = 1 if message.get("role") == "assistant" else 0
+                    estimated_chars[index] += len(message["content"])
+
+    if has_usage:
+        input_tokens, output_tokens = reported
+    else:
+        input_tokens = estimated_chars[0] // CHARS_PER_TOKEN
+        output_tokens = estimated_chars[1] // CHARS_PER_TOKEN
+        if not any(estimated_chars):
+            # Fall back to the payload sizes recorded by the client
+            input_tokens = meta.get("input_bytes", 0) // CHARS_PER_TOKEN
+            output_tokens = meta.get("output_bytes", 0) // CHARS_PER_TOKEN
+
+    return {
+        "call_id": meta.get("call_id"),
+        "work_dir": meta.get("work_dir"),
+        "operation": meta.get("operation") or "-",
+        "issue": meta.get("issue") or "-",
+        "model": model or "-",
+        "elapsed": meta.get("elapsed", 0.0),
+        "status": meta.get("status"),
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "estimated": not has_usage,
+    }
+
+
+class TrajectoryIndex:
+    """
+    An index of segment summaries, stored in the trajectory directory. Refreshing only
+    re-reads segments that are new or have changed since the last refresh.
+    """
+
+    def __init__(self, trajectory_dir: str):
+        self.trajectory_dir = trajectory_dir
+        self.index_file = os.path.join(trajectory_dir, INDEX_FILE)
+        self.entries: dict[str, dict] = {}
+        if os.path.exists(self.index_file):
+            with open(self.index_file, "r") as f:
+                self.entries = json.load(f)
+
+    def refresh(self) -> list[dict]:
+        entries = {}
+        for name in sorted(os.listdir(self.trajectory_dir)):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            segment_file = os.path.join(self.trajectory_dir, name)
+            meta_file = segment_file[: -len(SEGMENT_SUFFIX)] + META_SUFFIX
+            stamp = [
+                _stat_key(segment_file),
+                _stat_key(meta_file) if os.path.exists(meta_file) else None,
+            ]
+            previous = self.entries.get(name)
+            if previous and previous["stamp"] == stamp:
+                entries[name] = previous
+            else:
+                entries[name] = {
+                    "stamp": stamp,
+                    "summary": summarize_segment(segment_file),
+                }
+
+        # Calls that were made without a segment (e.g. replayed ones) only have metadata
+        for name in sorted(os.listdir(self.trajectory_dir)):
+            if name.endswith(META_SUFFIX):
+                segment_name = name[: -len(META_SUFFIX)] + SEGMENT_SUFFIX
+                if segment_name not in entries:
+                    segment_file = os.path.join(self.trajectory_dir, segment_name)
+                    entries[segment_name] = {
+                        "stamp": [None, _stat_key(os.path.join(self.trajectory_dir, name))],
+                        "summary": summarize_segment(segment_file),
+                    }
+
+        self.entries = entries
+        tmp_file = self.index_file + f".{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_file, self.index_file)
+
+        return [entry["summary"] for entry in self.entries.values()]
+
+
+def _stat_key(path: str) -> list[int]:
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def price_for(model: str, prices: dict) -> Optional[tuple[float, float]]:
+    # Longest matching prefix wins, so "gpt-4o-mini" is not priced as "gpt-4o"
+    for prefix in sorted(prices, key=len, reverse=True):
+        if model.startswith(prefix):
+            return prices[prefix]
+    return None
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def report(
+    summaries: Iterable[dict], group_by: str = "operation", prices=None
+) -> list[dict]:
+    prices = DEFAULT_PRICES if prices is None else prices
+    groups: dict[str, list[dict]] = {}
+    for summary in summaries:
+        groups.setdefault(str(summary.get(group_by) or "-"), []).append(summary)
+
+    rows = []
+    for key, calls in groups.items():
+        latencies = [c["elapsed"] for c in calls]
+        cost = 0.0
+        priced = True
+        for call in calls:
+            price = price_for(call["model"], prices)
+            if price is None:
+                priced = False
+                continue
+            cost += (
+                call["input_tokens"] * price[0] + call["output_tokens"] * price[1]
+            ) / 1_000_000
+        rows.append(
+            {
+                group_by: key,
+                "calls": len(calls),
+                "input_tokens": sum(c["input_tokens"] for c in calls),
+                "output_tokens": sum(c["output_tokens"] for c in calls),
+                "latency_total": sum(latencies),
+                "latency_p50": _percentile(latencies, 0.5),
+                "latency_p95": _percentile(latencies, 0.95),
+                "cost": cost,
+                "cost_complete": priced,
+                "estimated_tokens": any(c["estimated"] for c in calls),
+            }
+        )
+
+    rows.sort(key=lambda row: (row["cost"], row["input_tokens"]), reverse=True)
+    return rows
+
+
+def format_report(rows: list[dict], group_by: str) -> str:
+    header = f"{group_by:<40} {'calls':>6} {'in tok':>10} {'out tok':>10} {'p50 s':>8} {'p95 s':>8} {'total s':>9} {'cost $':>10}"
+    lines = [header, "-" * len(header)]
+    for row in rows:
+        cost = f"{row['cost']:.4f}" + ("" if row["cost_complete"] else "+")
+        tokens_mark = "~" if row["estimated_tokens"] else ""
+        lines.append(
+            f"{row[group_by][:40]:<40} {row['calls']:>6} "
+            f"{tokens_mark + str(row['input_tokens']):>10} {tokens_mark + str(row['output_tokens']):>10} "
+            f"{row['latency_p50']:>8.2f} {row['latency_p95']:>8.2f} {row['latency_total']:>9.2f} {cost:>10}"
+        )
+    lines.append("")
+    lines.append("~ token counts estimated from message sizes; + cost excludes unpriced models")
+    return "\n".join(lines)
+
+
+def _parse_price(value: str) -> tuple[str, tuple[float, float]]:
+    model, _, amounts = value.partition("=")
+    input_price, _, output_price = amounts.partition(",")
+    return model, (float(input_price), float(output_price or input_price))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m navie.trajectory")
+    parser.add_argument("trajectory_dir", help="Directory of trajectory segments")
+    parser.add_argument(
+        "--by",
+        action="append",
+        choices=["operation", "issue", "model", "work_dir"],
+        help="Group by this field (may be repeated; default: operation, issue and model)",
+    )
+    parser.add_argument(
+        "--price",
+        action="append",
+        default=[],
+        help="Price for a model prefix, in USD per million tokens: MODEL=INPUT,OUTPUT",
+    )
+    parser.add_argument("--json", action="store_true", help="Emit JSON")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.trajectory_dir):
+        print(f"Error: {args.trajectory_dir} is not a directory", file=sys.stderr)
+        return 1
+
+    prices = dict(DEFAULT_PRICES)
+    prices.update(dict(_parse_price(p) for p in args.price))
+
+    summaries = TrajectoryIndex(args.trajectory_dir).refresh()
+    group_bys = args.by or ["operation", "issue", "model"]
+    reports = {g: report(summaries, g, prices) for g in group_bys}
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        print("\n\n".join(format_report(rows, g) for g, rows in reports.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
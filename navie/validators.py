@@ -0,0 +1,175 @@
+"""
+Validators of the output of appmap navie operations, so that a malformed response is
+asked for again right away rather than found after the fact.
+
+A validator looks at the output twice: as it's written (feed), to find output that is
+already unrecoverable, so the child can be stopped early; and once it's complete
+(check). Both return the reason the output is invalid, or None.
+
+- generate: each <change> is well-formed XML with a file, original and modified, and
+  none is left unclosed.
+- terms: a JSON list, possibly fenced.
+- context: a YAML list, possibly fenced.
+- plan: not empty.
+"""
+
+import json
+import re
+import xml.etree.ElementTree as ET
+from typing import Optional
+
+import yaml
+
+from navie.config import Config
+from navie.fences import extract_fenced_content
+
+# How many times an operation is asked again after an invalid response. The last
+# attempt isn't stopped early, and its output is returned even if it's invalid.
+MAX_REASKS = 2
+
+CHANGE_RE = re.compile(r"<change>([\s\S]*?)</change>", re.IGNORECASE)
+# How much prose may precede a JSON or YAML list, or its fence
+MAX_PREAMBLE = 200
+
+
+class InvalidOutput(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Validator:
+    # Instructions added to the prompt when the operation is asked again
+    instructions: Optional[str] = None
+
+    def feed(self, output: str) -> Optional[str]:
+        """Why the output so far can't become valid, if it can't."""
+        return None
+
+    def check(self, output: str) -> Optional[str]:
+        """Why the complete output is invalid, if it is."""
+        return self.feed(output)
+
+    def correction(self, reason: str) -> Optional[str]:
+        if not self.instructions:
+            return None
+        return f"Your previous response was invalid: {reason}. {self.instructions}"
+
+
+class ChangesValidator(Validator):
+    instructions = (
+        "Emit each change as a well-formed <change> element, with <file>, <original> "
+        "and <modified> elements, and the code in CDATA sections."
+    )
+
+    def __init__(self):
+        # Where the changes that haven't been checked yet start
+        self._offset = 0
+
+    def feed(self, output: str) -> Optional[str]:
+        # The same repair as extract_changes
+        output = output.replace("```</", "]]></")
+        for match in CHANGE_RE.finditer(output, self._offset):
+            reason = _check_change(match.group(0))
+            if reason:
+                return reason
+            self._offset = match.end()
+        return None
+
+    def check(self, output: str) -> Optional[str]:
+        reason = self.feed(output)
+        if reason:
+            return reason
+        rest = output.replace("```</", "]]></")[self._offset :]
+        if re.search(r"<change>", rest, re.IGNORECASE):
+            return "a <change> is not closed"
+        return None
+
+
+def _check_change(change: str) -> Optional[str]:
+    try:
+        root = ET.fromstring(change)
+    except ET.ParseError as e:
+        return f"a <change> is not well-formed XML ({e})"
+    for field in ("file", "original", "modified"):
+        element = root.find(field)
+        if element is None or element.text is None:
+            return f"a <change> has no <{field}>"
+    return None
+
+
+class TermsValidator(Validator):
+    instructions = "Emit only a JSON list of strings, with no other text."
+
+    def feed(self, output: str) -> Optional[str]:
+        text = output.lstrip()
+        if len(text) > MAX_PREAMBLE and "```" not in text:
+            if not text.startswith(("[", "`")):
+                return "the terms are not a JSON list"
+        return None
+
+    def check(self, output: str) -> Optional[str]:
+        for content in extract_fenced_content(output):
+            try:
+                terms = json.loads(content)
+            except ValueError:
+                return "the terms are not valid JSON"
+            if not isinstance(terms, list):
+                return "the terms are not a JSON list"
+        return None
+
+
+class ContextValidator(Validator):
+    def feed(self, output: str) -> Optional[str]:
+        fenced = False
+        preamble = 0
+        for line in output.splitlines(keepends=True):
+            if not line.endswith("\n"):
+                # Not complete yet
+                return None
+            if line.startswith("```"):
+                fenced = True
+                continue
+            text = line.strip()
+            if not text:
+                continue
+            if text.startswith(("-", "[")):
+                return None
+            if fenced:
+                return "the context is not a YAML list"
+            # Prose may precede the fence of the list, as long as it's short
+            preamble += len(line)
+            if preamble > MAX_PREAMBLE:
+                return "the context is not a YAML list"
+        return None
+
+    def check(self, output: str) -> Optional[str]:
+        try:
+            context = yaml.safe_load("\n".join(extract_fenced_content(output)))
+        except yaml.YAMLError as e:
+            return f"the context is not valid YAML ({e})"
+        if context is not None and not isinstance(context, list):
+            return "the context is not a YAML list"
+        return None
+
+
+class PlanValidator(Validator):
+    instructions = "Write a plan that addresses the issue."
+
+    def check(self, output: str) -> Optional[str]:
+        return None if output.strip() else "the plan is empty"
+
+
+VALIDATORS = {
+    "generate": ChangesValidator,
+    "terms": TermsValidator,
+    "context": ContextValidator,
+    "plan": PlanValidator,
+}
+
+
+def validator_for(operation: str) -> Optional[Validator]:
+    """A new validator for an operation's output, if it has one and they're enabled."""
+    if not Config.get_validate() or operation not in VALIDATORS:
+        return None
+    return VALIDATORS[operation]()
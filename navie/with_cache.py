@@ -1,8 +1,33 @@
 import os
 import hashlib
 import json
+import secrets
+import socket
+import threading
+import time
+from concurrent.futures import Future
 from pathlib import Path
-from typing import Callable, Union
+from typing import Callable, Optional, Union
+
+from navie import trace
+
+# Identical calls (same work dir and cache key) are single-flight: one caller computes
+# the result and the others wait for it. Within a process, waiters wait on a Future.
+# Across processes, the caller that computes holds a lock file next to the cache file,
+# and the others poll for the result. A lock whose owner has died, or that hasn't been
+# refreshed for STALE_LOCK_SECONDS, is broken. Each lock records a random id, so that
+# an owner whose lock was broken, and then taken by another caller, leaves the new
+# lock alone.
+STALE_LOCK_SECONDS = 120
+LOCK_HEARTBEAT_SECONDS = 10
+POLL_INITIAL_SECONDS = 0.05
+POLL_MAX_SECONDS = 1.0
+# Besides its cache.json, a work dir can hold entries by key in this subdirectory, such as
+# those imported from a cache bundle (see navie.cache_bundle)
+KEYED_CACHE_DIR = "cache"
+
+_in_flight: dict[tuple[str, str], Future] = {}
+_in_flight_lock = threading.Lock()
 
 
 def with_cache(
@@ -16,19 +41,216 @@ def with_cache(
     cache_file = Path(os.path.join(work_dir, "cache.json"))
     cache_key = compute_hash()
 
-    if cache_file.exists():
+    with trace.span("cache.lookup", cache_file=str(cache_file)) as lookup_span:
+        cached = _lookup(cache_file, cache_key)
+        lookup_span.set(cache_hit=cached is not None)
+
+    trace.current().set(cache_hit=cached is not None)
+    if cached is not None:
+        return cached["result"]
+
+    flight_key = (str(cache_file.absolute()), cache_key)
+    with _in_flight_lock:
+        future = _in_flight.get(flight_key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _in_flight[flight_key] = future
+
+    if not leader:
+        with trace.span("cache.wait", in_process=True):
+            return future.result()
+
+    try:
+        result = _compute_exclusively(cache_file, cache_key, implementation_func)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _in_flight_lock:
+            del _in_flight[flight_key]
+
+
+def keyed_cache_file(work_dir, cache_key: str) -> Path:
+    return Path(work_dir) / KEYED_CACHE_DIR / f"{cache_key}.json"
+
+
+def _lookup(cache_file: Path, cache_key: str) -> Optional[dict]:
+    cached = read_cache(cache_file, cache_key)
+    if cached is None:
+        cached = read_cache(keyed_cache_file(cache_file.parent, cache_key), cache_key)
+    return cached
+
+
+def read_cache(cache_file: Path, cache_key: str) -> Optional[dict]:
+    """The entry in the cache file, or None if it's missing or for another key."""
+    try:
         with cache_file.open("r") as f:
             cache = json.load(f)
-        if cache.get("key") == cache_key:
-            return cache["result"]
+    except (FileNotFoundError, ValueError):
+        return None
+    return cache if cache.get("key") == cache_key else None
 
-    result = implementation_func()
 
+def write_cache(cache_file: Path, cache_key: str, result):
+    """Atomically replace the cache file with an entry for the key."""
     cache_file.parent.mkdir(parents=True, exist_ok=True)
-    with open(cache_file, "w") as f:
+    tmp_file = cache_file.with_name(
+        f".{cache_file.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    )
+    with open(tmp_file, "w") as f:
         json.dump({"key": cache_key, "result": result}, f)
+    os.replace(tmp_file, cache_file)
+
+
+def _compute_exclusively(cache_file: Path, cache_key: str, implementation_func):
+    lock_file = cache_file.with_name(f"{cache_file.name}.{cache_key[:16]}.lock")
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+
+    delay = POLL_INITIAL_SECONDS
+    with trace.span("cache.wait", in_process=False) as wait_span:
+        while (lock_id := _try_lock(lock_file)) is None:
+            cached = _lookup(cache_file, cache_key)
+            if cached is not None:
+                wait_span.set(cache_hit=True)
+                return cached["result"]
+            if _lock_is_stale(lock_file):
+                _break_lock(lock_file)
+                continue
+            time.sleep(delay)
+            delay = min(delay * 2, POLL_MAX_SECONDS)
+
+    heartbeat = _Heartbeat(lock_file, lock_id)
+    try:
+        # Another process may have finished while this one waited for the lock
+        cached = _lookup(cache_file, cache_key)
+        if cached is not None:
+            return cached["result"]
+
+        result = implementation_func()
+        write_cache(cache_file, cache_key, result)
+        return result
+    finally:
+        heartbeat.stop()
+        _release(lock_file, lock_id)
+
+
+def _try_lock(lock_file: Path) -> Optional[str]:
+    """Take the lock, returning its id, or None if it's held."""
+    try:
+        fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return None
+    lock_id = secrets.token_hex(16)
+    with os.fdopen(fd, "w") as f:
+        json.dump({"pid": os.getpid(), "host": socket.gethostname(), "id": lock_id}, f)
+    return lock_id
+
+
+def _lock_id(lock_file: Path) -> Optional[str]:
+    try:
+        with lock_file.open("r") as f:
+            return json.load(f).get("id")
+    except (FileNotFoundError, ValueError, AttributeError):
+        return None
+
+
+def _release(lock_file: Path, lock_id: str):
+    # The lock may have been broken while its owner was computing, and taken by
+    # another caller since. As when breaking a lock, it's moved aside and checked, and
+    # put back if it's no longer this owner's.
+    released = lock_file.with_name(
+        f"{lock_file.name}.{os.getpid()}.{threading.get_ident()}.released"
+    )
+    try:
+        os.rename(lock_file, released)
+    except FileNotFoundError:
+        return
+    if _lock_id(released) != lock_id:
+        try:
+            os.link(released, lock_file)
+        except FileExistsError:
+            pass
+    _remove(released)
+
+
+def _lock_is_stale(lock_file: Path) -> bool:
+    try:
+        age = time.time() - lock_file.stat().st_mtime
+        with lock_file.open("r") as f:
+            owner = json.load(f)
+    except FileNotFoundError:
+        return False
+    except ValueError:
+        # Being written; it's only stale if it has been like that for a while
+        return age > STALE_LOCK_SECONDS
+
+    if age > STALE_LOCK_SECONDS:
+        return True
+    if owner.get("host") == socket.gethostname():
+        try:
+            os.kill(owner["pid"], 0)
+        except ProcessLookupError:
+            return True
+        except (PermissionError, KeyError, TypeError):
+            pass
+    return False
+
+
+def _break_lock(lock_file: Path):
+    # Another waiter may break the same stale lock and take a fresh one between the
+    # staleness check and this. Moving the lock aside first, and checking it again, means
+    # only a stale lock is ever removed.
+    broken = lock_file.with_name(
+        f"{lock_file.name}.{os.getpid()}.{threading.get_ident()}.broken"
+    )
+    try:
+        os.rename(lock_file, broken)
+    except FileNotFoundError:
+        return
+    if _lock_is_stale(broken):
+        _remove(broken)
+        return
+    # A fresh lock; put it back, unless yet another one has been taken meanwhile
+    try:
+        os.link(broken, lock_file)
+    except FileExistsError:
+        pass
+    _remove(broken)
+
+
+def _remove(path: Path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class _Heartbeat:
+    """Refreshes the mtime of a lock file while its owner is computing."""
+
+    def __init__(self, lock_file: Path, lock_id: str):
+        self.lock_file = lock_file
+        self.lock_id = lock_id
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(LOCK_HEARTBEAT_SECONDS):
+            # Don't keep alive a lock that has been broken and taken by another caller
+            if _lock_id(self.lock_file) != self.lock_id:
+                return
+            try:
+                os.utime(self.lock_file)
+            except FileNotFoundError:
+                return
 
-    return result
+    def stop(self):
+        self._stopped.set()
 
 
 if __name__ == "__main__":
@@ -5,11 +5,18 @@ import sys
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-from navie.editor import Editor
+from navie.cache_bundle import export_bundle, import_bundle
+from navie.config import Config
+from replan import Planner, replan
 
 work_dir = os.path.join(".appmap", "navie", "work")
 log_dir = os.path.join(".appmap", "navie", "log")
+# Persisted between runs by the action, keyed by repository and issue
+state_dir = os.path.join(".appmap", "navie", "state")
+# The caches of the work dir are persisted with the state, as a cache bundle
+cache_bundle = os.path.join(state_dir, "work-cache.zip")
 issue_file = os.path.join(work_dir, "issue.txt")
+plan_file = os.path.join(work_dir, "plan.md")
 if not os.path.exists(issue_file):
     print("Issue file not found")
     sys.exit(1)
@@ -17,5 +24,17 @@ if not os.path.exists(issue_file):
 with open(issue_file, "r") as f:
     issue = f.read()
 
-editor = Editor(work_dir, log_dir=log_dir)
-editor.plan(issue)
+repo = os.getenv("GITHUB_REPOSITORY") or os.path.basename(os.getcwd())
+issue_id = Config.get_issue_id() or "local"
+
+if os.path.exists(cache_bundle):
+    import_bundle(cache_bundle, work_dir)
+
+plan, decision = replan(issue, repo, issue_id, state_dir, Planner(work_dir, log_dir))
+print(f"Planned issue {issue_id} ({decision})")
+
+with open(plan_file, "w") as f:
+    f.write(plan)
+
+os.makedirs(state_dir, exist_ok=True)
+export_bundle(work_dir, cache_bundle)
@@ -0,0 +1,160 @@
+"""
+Incremental planning for an issue that is planned again each time it's edited.
+
+The issue text, its context and its plan are kept in a state file per repository and
+issue, which the action persists between runs. When the issue changes, the new text is
+compared with the previous one:
+
+- unchanged: the words are the same (only whitespace, case or punctuation changed).
+  The previous plan is reused.
+- replan: the text changed, but it names no code that it didn't name before, and most
+  of it is the same. The issue is planned again with the previous context.
+- full: anything else, or no previous state. Context is retrieved and the issue planned
+  from scratch.
+"""
+
+import json
+import os
+import re
+import time
+from difflib import SequenceMatcher
+from typing import Optional
+
+from navie.daemon import DaemonClient
+from navie.editor import Editor
+
+STATE_VERSION = 1
+
+UNCHANGED = "unchanged"
+REPLAN = "replan"
+FULL = "full"
+
+# Below this similarity of the words of the issue, context is retrieved again
+MIN_REUSE_RATIO = 0.5
+
+WORD_RE = re.compile(r"\w+")
+# Paths, dotted names, snake_case, camelCase and CamelCase, and anything in backticks
+CODE_TERM_RE = re.compile(
+    r"`([^`\n]+)`"
+    r"|(\w+(?:[./]\w+)+)"
+    r"|(\w*_\w*[A-Za-z0-9]\w*)"
+    r"|([a-z]+[A-Z]\w*)"
+    r"|([A-Z][a-z0-9]+[A-Z]\w*)"
+)
+
+
+def words(text: str) -> list[str]:
+    return WORD_RE.findall(text.lower())
+
+
+def code_terms(text: str) -> set[str]:
+    return {
+        next(group for group in match.groups() if group)
+        for match in CODE_TERM_RE.finditer(text)
+    }
+
+
+def classify_change(previous_issue: Optional[str], issue: str) -> str:
+    if previous_issue is None:
+        return FULL
+    previous_words, new_words = words(previous_issue), words(issue)
+    if previous_words == new_words:
+        return UNCHANGED
+    if not code_terms(issue) <= code_terms(previous_issue):
+        return FULL
+    if SequenceMatcher(None, previous_words, new_words).ratio() < MIN_REUSE_RATIO:
+        return FULL
+    return REPLAN
+
+
+def state_file(state_dir: str, repo: str, issue_id: str) -> str:
+    def slug(value):
+        return re.sub(r"[^A-Za-z0-9_.-]+", "_", str(value)).strip("_") or "_"
+
+    return os.path.join(state_dir, slug(repo), f"{slug(issue_id)}.json")
+
+
+def load_state(path: str, repo: str, issue_id: str) -> Optional[dict]:
+    try:
+        with open(path, "r") as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if (
+        state.get("version") != STATE_VERSION
+        or state.get("repo") != repo
+        or state.get("issue_id") != str(issue_id)
+    ):
+        return None
+    return state
+
+
+def save_state(path: str, state: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class Planner:
+    """Retrieves context and plans, through a running daemon if there is one."""
+
+    def __init__(self, work_dir: str, log_dir: Optional[str] = None):
+        self.work_dir = work_dir
+        self.log_dir = log_dir
+        self.daemon = DaemonClient.discover()
+
+    def context(self, issue: str):
+        if self.daemon:
+            return self.daemon.run("context", {"query": issue}, work_dir=self.work_dir)
+        return self._editor().context(issue)
+
+    def plan(self, issue: str, context) -> str:
+        if self.daemon:
+            return self.daemon.run(
+                "plan", {"issue": issue, "context": context}, work_dir=self.work_dir
+            )
+        return self._editor().plan(issue, context=context)
+
+    def _editor(self) -> Editor:
+        return Editor(self.work_dir, log_dir=self.log_dir)
+
+
+def replan(
+    issue: str,
+    repo: str,
+    issue_id: str,
+    state_dir: str,
+    planner: Planner,
+) -> tuple[str, str]:
+    """Plan the issue, reusing what it can from the previous run. Returns (plan, decision)."""
+    path = state_file(state_dir, repo, issue_id)
+    state = load_state(path, repo, issue_id)
+    decision = classify_change(state["issue"] if state else None, issue)
+
+    if decision == UNCHANGED:
+        assert state
+        return state["plan"], decision
+
+    if decision == REPLAN:
+        assert state
+        context = state["context"]
+    else:
+        context = planner.context(issue)
+    plan = planner.plan(issue, context)
+
+    save_state(
+        path,
+        {
+            "version": STATE_VERSION,
+            "repo": repo,
+            "issue_id": str(issue_id),
+            "issue": issue,
+            "context": context,
+            "plan": plan,
+            "decision": decision,
+            "updated_at": time.time(),
+        },
+    )
+    return plan, decision
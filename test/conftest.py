@@ -1,3 +1,24 @@
 import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+from navie.config import Config
+
+FAKE_APPMAP = os.path.join(os.path.dirname(__file__), "fake_appmap.py")
+
+
+@pytest.fixture
+def fake_appmap(monkeypatch, tmp_path):
+    """Run Client commands against test/fake_appmap.py. Yields the call log file."""
+    calls_file = tmp_path / "appmap_calls.txt"
+    monkeypatch.setattr(Config, "appmap_command", [sys.executable, FAKE_APPMAP])
+    monkeypatch.setenv("FAKE_APPMAP_CALLS", str(calls_file))
+    return calls_file
+
+
+def appmap_calls(calls_file):
+    if not calls_file.exists():
+        return []
+    return calls_file.read_text().splitlines()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+A stand-in for the `appmap` CLI, for tests that exercise Client and Editor end to end.
+
+Supports `navie` (with -i, -c, -p, -o, --trajectory-file) and `apply` (with -s, -r).
+Responses are deterministic and derived from the input command. If FAKE_APPMAP_CALLS
+is set, one line per invocation is appended to that file. If FAKE_APPMAP_SLOW_ONCE is
+set to a path that doesn't exist yet, the first `navie` call creates it and then stalls
+for FAKE_APPMAP_SLOW_SECONDS (default 10). FAKE_APPMAP_BAD_ONCE works the same way,
+except that the first call writes a malformed response before it stalls.
+"""
+
+import os
+import sys
+import time
+
+
+def _read(path):
+    with open(path, "r") as f:
+        return f.read()
+
+
+def _parse(args):
+    options = {}
+    positional = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg in ("-i", "-c", "-p", "-o", "-s", "-r", "--trajectory-file"):
+            options[arg] = args[i + 1]
+            i += 2
+        elif arg.startswith("--"):
+            i += 1
+        else:
+            positional.append(arg)
+            i += 1
+    return options, positional
+
+
+def _respond(question):
+    command, _, body = question.partition(" ")
+    body = body.strip()
+    if command == "@context":
+        return f"""- type: code-snippet
+  location: src/example.py:1-3
+  content: |
+    def example():
+        return {len(body)}
+"""
+    if command == "@plan":
+        return f"Plan:\n\nChange src/example.py to address the issue.\n\n{body}\n"
+    if command == "@list-files":
+        return '["src/example.py"]'
+    if command == "@generate" and "/nocontext" in question and body.startswith(
+        "/nocontext"
+    ):
+        return '["example"]'
+    return f"Generated:\n{body}\n"
+
+
+def _bad_response(question):
+    command, _, body = question.partition(" ")
+    if command == "@context":
+        # Longer than the prose that may precede a fenced list
+        return "I couldn't find any context for this issue.\n" * 6
+    if command == "@plan":
+        return ""
+    if command == "@generate" and body.strip().startswith("/nocontext"):
+        return "The terms mentioned in the issue are " + "example, " * 40
+    return "<change><file>src/example.py</file><original>a</change>\n"
+
+
+def _first(marker):
+    """Whether this is the first call to claim the marker file."""
+    if not marker:
+        return False
+    try:
+        os.close(os.open(marker, os.O_CREAT | os.O_EXCL))
+        return True
+    except FileExistsError:
+        return False
+
+
+def main(argv):
+    calls_file = os.getenv("FAKE_APPMAP_CALLS")
+    if calls_file:
+        with open(calls_file, "a") as f:
+            f.write(" ".join(argv) + "\n")
+
+    subcommand, args = argv[0], argv[1:]
+    options, positional = _parse(args)
+
+    if subcommand == "apply":
+        target = positional[-1]
+        content = _read(target)
+        replace = _read(options["-r"])
+        search = _read(options["-s"]) if "-s" in options else None
+        if search is None or search not in content:
+            return 1
+        with open(target, "w") as f:
+            f.write(content.replace(search, replace, 1))
+        return 0
+
+    if subcommand == "navie":
+        slow_seconds = float(os.getenv("FAKE_APPMAP_SLOW_SECONDS", "10"))
+        if _first(os.getenv("FAKE_APPMAP_SLOW_ONCE")):
+            time.sleep(slow_seconds)
+
+        question = _read(options["-i"])
+        if _first(os.getenv("FAKE_APPMAP_BAD_ONCE")):
+            with open(options["-o"], "w") as f:
+                f.write(_bad_response(question))
+            time.sleep(slow_seconds)
+            return 0
+        for option in ("-c", "-p"):
+            if option in options:
+                _read(options[option])
+        output = _respond(question)
+        if "--trajectory-file" in options:
+            with open(options["--trajectory-file"], "a") as f:
+                f.write('{"message": {"role": "user", "content": "%d"}}\n' % len(question))
+        with open(options["-o"], "w") as f:
+            f.write(output)
+        return 0
+
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
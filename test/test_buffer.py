@@ -0,0 +1,78 @@
+import os
+from textwrap import dedent
+
+from navie.buffer import DocumentBuffer, split_lines
+from navie.extract_changes import FileUpdate
+
+SOURCE = dedent(
+    """\
+    def greet(name):
+        print("Hello, " + name)
+
+
+    def farewell(name):
+        print("Goodbye, " + name)
+    """
+)
+
+
+def test_apply_changes_in_memory(tmp_path):
+    file = tmp_path / "greet.py"
+    file.write_text(SOURCE)
+    buffer = DocumentBuffer(str(file))
+
+    assert buffer.apply(
+        FileUpdate(
+            "greet.py",
+            '    print("Goodbye, " + name)',
+            '    print("Goodbye, " + name)\n    return name',
+        )
+    )
+    assert buffer.apply(FileUpdate("greet.py", "def greet(name):", "def greet(name: str):"))
+    assert not buffer.apply(FileUpdate("greet.py", "def missing():", "def found():"))
+
+    assert buffer.changed
+    assert buffer.lines[0] == "def greet(name: str):\n"
+    assert buffer.lines[-1] == "    return name\n"
+    assert file.read_text() == SOURCE
+
+
+def test_offsets_track_edits():
+    buffer = DocumentBuffer("x.py", "a\nbb\nccc\n")
+    assert buffer.offsets() == [0, 2, 5, 9]
+    assert buffer.line_at(3) == 1
+
+    buffer.apply(FileUpdate("x.py", "bb", "b\nb"))
+    assert buffer.lines == ["a\n", "b\n", "b\n", "ccc\n"]
+    assert buffer.offsets() == [0, 2, 4, 6, 10]
+
+
+def test_diff_is_empty_without_changes(tmp_path):
+    file = tmp_path / "greet.py"
+    file.write_text(SOURCE)
+    buffer = DocumentBuffer(str(file))
+    assert buffer.diff("greet.py", "greet.py") == ""
+
+    buffer.apply(FileUpdate("greet.py", "Hello", "Hi"))
+    diff = buffer.diff("greet.py", "greet.py")
+    assert diff.startswith("--- greet.py\n+++ greet.py\n@@ -1,5 +1,5 @@\n")
+    assert '-    print("Hello, " + name)\n+    print("Hi, " + name)\n' in diff
+
+
+def test_write_replaces_the_file_atomically(tmp_path):
+    file = tmp_path / "greet.py"
+    file.write_text(SOURCE)
+    os.chmod(file, 0o755)
+    buffer = DocumentBuffer(str(file))
+    buffer.apply(FileUpdate("greet.py", "Hello", "Hi"))
+
+    buffer.write()
+    assert file.read_text() == SOURCE.replace("Hello", "Hi")
+    assert os.stat(file).st_mode & 0o777 == 0o755
+    assert os.listdir(tmp_path) == ["greet.py"]
+
+
+def test_split_lines_matches_readlines():
+    assert split_lines("a\nb") == ["a\n", "b"]
+    assert split_lines("a\x0cb\n") == ["a\x0cb\n"]
+    assert split_lines("") == []
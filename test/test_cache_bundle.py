@@ -0,0 +1,111 @@
+import json
+import zipfile
+
+import pytest
+
+from conftest import appmap_calls
+from navie.cache_bundle import export_bundle, import_bundle, read_manifest
+from navie.editor import Editor
+from navie.with_cache import with_cache
+
+
+def fail():
+    raise AssertionError("computed instead of using the cache")
+
+
+def test_export_and_import_round_trip(tmp_path):
+    source, target = tmp_path / "source", tmp_path / "target"
+    with_cache(str(source / "a" / "plan"), lambda: "the plan", issue="x")
+    with_cache(str(source / "b" / "context"), lambda: [{"content": "c"}], query="y")
+    with_cache(str(source / "c" / "plan"), lambda: "the plan", issue="z")
+
+    bundle = str(tmp_path / "bundle.zip")
+    manifest = export_bundle(str(source), bundle)
+    assert sorted((e["path"], e["operation"]) for e in manifest["entries"]) == [
+        ("a/plan", "plan"),
+        ("b/context", "context"),
+        ("c/plan", "plan"),
+    ]
+    # Identical results are stored once
+    with zipfile.ZipFile(bundle) as z:
+        assert len([n for n in z.namelist() if n.startswith("objects/")]) == 2
+
+    assert import_bundle(bundle, str(target)) == {"imported": 3, "skipped": 0}
+    assert with_cache(str(target / "a" / "plan"), fail, issue="x") == "the plan"
+    assert with_cache(str(target / "b" / "context"), fail, query="y") == [
+        {"content": "c"}
+    ]
+    assert import_bundle(bundle, str(target)) == {"imported": 0, "skipped": 3}
+
+
+def test_import_never_clobbers_local_entries(tmp_path):
+    source, target = tmp_path / "source", tmp_path / "target"
+    with_cache(str(source / "plan"), lambda: "theirs", issue="x")
+    with_cache(str(target / "plan"), lambda: "ours", issue="x")
+    bundle = str(tmp_path / "bundle.zip")
+    export_bundle(str(source), bundle)
+
+    assert import_bundle(bundle, str(target)) == {"imported": 0, "skipped": 1}
+    assert with_cache(str(target / "plan"), fail, issue="x") == "ours"
+
+
+def test_selective_import(tmp_path):
+    source, target = tmp_path / "source", tmp_path / "target"
+    with_cache(str(source / "a" / "plan"), lambda: "plan a", issue="x")
+    with_cache(str(source / "a" / "context"), lambda: [], query="x")
+    with_cache(str(source / "b" / "plan"), lambda: "plan b", issue="x")
+    bundle = str(tmp_path / "bundle.zip")
+    export_bundle(str(source), bundle)
+
+    assert import_bundle(bundle, str(target), operations=["plan"], paths=["a/*"]) == {
+        "imported": 1,
+        "skipped": 0,
+    }
+    assert with_cache(str(target / "a" / "plan"), fail, issue="x") == "plan a"
+    assert not (target / "a" / "context").exists()
+    assert not (target / "b").exists()
+
+
+def test_incremental_export(tmp_path):
+    source = tmp_path / "source"
+    with_cache(str(source / "a" / "plan"), lambda: "plan a", issue="x")
+    base = str(tmp_path / "base.zip")
+    base_manifest = export_bundle(str(source), base)
+
+    with_cache(str(source / "b" / "plan"), lambda: "plan b", issue="x")
+    delta = str(tmp_path / "delta.zip")
+    manifest = export_bundle(str(source), delta, base=base)
+    assert manifest["base"] == base_manifest["id"]
+    assert [e["path"] for e in manifest["entries"]] == ["b/plan"]
+    assert read_manifest(delta)["entries"] == manifest["entries"]
+
+
+def test_import_rejects_corrupt_bundles(tmp_path):
+    source = tmp_path / "source"
+    with_cache(str(source / "plan"), lambda: "the plan", issue="x")
+    bundle = str(tmp_path / "bundle.zip")
+    manifest = export_bundle(str(source), bundle)
+
+    manifest["entries"][0]["path"] = "../escape"
+    corrupt = str(tmp_path / "corrupt.zip")
+    with zipfile.ZipFile(bundle) as z, zipfile.ZipFile(corrupt, "w") as out:
+        for name in z.namelist():
+            if name != "manifest.json":
+                out.writestr(name, z.read(name))
+        out.writestr("manifest.json", json.dumps(manifest))
+    with pytest.raises(ValueError):
+        import_bundle(corrupt, str(tmp_path / "target"))
+    assert not (tmp_path / "escape").exists()
+
+
+def test_imported_entries_serve_the_editor(tmp_path, fake_appmap):
+    source = Editor(str(tmp_path / "source" / "edit"))
+    plan = source.plan("Fix the bug")
+    assert len(appmap_calls(fake_appmap)) == 1
+
+    bundle = str(tmp_path / "bundle.zip")
+    export_bundle(str(tmp_path / "source"), bundle)
+    import_bundle(bundle, str(tmp_path / "target"))
+
+    assert Editor(str(tmp_path / "target" / "edit")).plan("Fix the bug") == plan
+    assert len(appmap_calls(fake_appmap)) == 1
@@ -0,0 +1,149 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from navie.buffer import DocumentBuffer
+from navie.candidates import BestOfN, Workspace
+from navie.mode.edit import Edit
+
+
+def change_xml(file, original, modified):
+    return f"""<change>
+<file>{file}</file>
+<original>{original}</original>
+<modified>{modified}</modified>
+</change>"""
+
+
+def test_hardlink_workspace_is_isolated_from_buffer_writes(tmp_path):
+    source = tmp_path / "source"
+    (source / "pkg").mkdir(parents=True)
+    (source / "pkg" / "a.py").write_text("a = 1\n")
+    (source / ".git").mkdir()
+    (source / ".git" / "HEAD").write_text("ref\n")
+
+    workspace = Workspace(str(source), str(tmp_path / "workspace"))
+    workspace.create()
+    copy = tmp_path / "workspace" / "pkg" / "a.py"
+    assert os.stat(copy).st_ino == os.stat(source / "pkg" / "a.py").st_ino
+    assert not (tmp_path / "workspace" / ".git").exists()
+
+    DocumentBuffer(str(copy), "a = 2\n").write()
+    assert copy.read_text() == "a = 2\n"
+    assert (source / "pkg" / "a.py").read_text() == "a = 1\n"
+
+    workspace.remove()
+    assert not (tmp_path / "workspace").exists()
+
+
+def test_worktree_workspace_carries_uncommitted_changes(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    git = ["git", "-C", str(source), "-c", "user.name=t", "-c", "user.email=t@t"]
+    try:
+        subprocess.run(git + ["init", "-q"], check=True)
+    except (OSError, subprocess.CalledProcessError):
+        pytest.skip("git is not available")
+    (source / "a.py").write_text("a = 1\n")
+    subprocess.run(git + ["add", "a.py"], check=True)
+    subprocess.run(git + ["commit", "-qm", "init"], check=True)
+    (source / "a.py").write_text("a = 2\n")
+
+    workspace = Workspace(str(source), str(tmp_path / "workspace"), "worktree")
+    workspace.create()
+    assert (tmp_path / "workspace" / "a.py").read_text() == "a = 2\n"
+    workspace.remove()
+    assert not (tmp_path / "workspace").exists()
+
+
+def test_best_of_n_returns_a_passing_candidate(tmp_path, monkeypatch, fake_appmap):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "a.py").write_text("name = 'a'\n")
+
+    edit = Edit(os.path.join(".navie", "work"), "Rename things")
+    edit.files_to_edit = ["a.py"]
+    edit._plan = change_xml("a.py", "name = 'a'", "name = 'A'")
+
+    test_command = f"{sys.executable} -c \"import a, sys; sys.exit(a.name != 'A')\""
+    best_of_n = BestOfN(edit, test_command, candidates=3)
+    winner = best_of_n.run()
+
+    assert winner.passed
+    assert list(winner.diffs) == ["a.py"]
+    # Nothing is written to the working tree until the winner is applied
+    assert (tmp_path / "a.py").read_text() == "name = 'a'\n"
+    winner.apply()
+    assert (tmp_path / "a.py").read_text() == "name = 'A'\n"
+
+    best_of_n.cleanup()
+    assert not any(os.path.exists(c.workspace.path) for c in best_of_n.results)
+
+
+def test_best_of_n_returns_none_when_no_candidate_passes(
+    tmp_path, monkeypatch, fake_appmap
+):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "a.py").write_text("name = 'a'\n")
+
+    edit = Edit(os.path.join(".navie", "work"), "Rename things")
+    edit.files_to_edit = ["a.py"]
+    edit._plan = change_xml("a.py", "name = 'a'", "name = 'A'")
+
+    best_of_n = BestOfN(edit, "exit 1", candidates=2, temperatures=(0.0, 0.5))
+    assert best_of_n.run() is None
+    assert sorted(c.temperature for c in best_of_n.results) == [0.0, 0.5]
+    assert all(c.returncode == 1 for c in best_of_n.results)
+    best_of_n.cleanup()
+
+
+def test_best_of_n_kills_the_tests_of_losing_candidates(
+    tmp_path, monkeypatch, fake_appmap
+):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "a.py").write_text("name = 'a'\n")
+
+    edit = Edit(os.path.join(".navie", "work"), "Rename things")
+    edit.files_to_edit = ["a.py"]
+    edit._plan = change_xml("a.py", "name = 'a'", "name = 'A'")
+
+    # Candidate 0 passes at once; the others run a child that outlives the shell
+    test_command = 'case "$PWD" in */0) exit 0;; *) sleep 10; echo done;; esac'
+    best_of_n = BestOfN(edit, test_command, candidates=3)
+    start = time.monotonic()
+    winner = best_of_n.run()
+    assert time.monotonic() - start < 5
+    assert winner.index == 0
+    best_of_n.cleanup()
+
+
+def test_best_of_n_returns_without_waiting_for_losing_generation(
+    tmp_path, monkeypatch, fake_appmap
+):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "a.py").write_text("name = 'a'\n")
+
+    edit = Edit(os.path.join(".navie", "work"), "Rename things")
+    edit.files_to_edit = ["a.py"]
+    edit._plan = change_xml("a.py", "name = 'a'", "name = 'A'")
+
+    generate_changes = Edit._generate_changes
+
+    def slow_for_losers(self, file, editor):
+        if self.temperature != 0.0:
+            time.sleep(3)
+        return generate_changes(self, file, editor)
+
+    monkeypatch.setattr(Edit, "_generate_changes", slow_for_losers)
+    best_of_n = BestOfN(edit, "exit 0", candidates=3)
+    start = time.monotonic()
+    winner = best_of_n.run()
+    assert time.monotonic() - start < 2
+    assert winner.index == 0
+
+    best_of_n.cleanup()
+    assert [c.diffs for c in best_of_n.results if c is not winner] == [{}, {}]
+    # Each candidate records its prompts in stats of its own
+    assert edit.prefix_stats.prompts == []
@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from conftest import appmap_calls
+from navie import daemon as daemon_module
+from navie.config import Config
+from navie.daemon import (
+    CANCELED,
+    DISCOVERY_FILE,
+    JOB_KINDS,
+    TOKEN_HEADER,
+    Daemon,
+    DaemonClient,
+    Job,
+    JobFailed,
+    JobQueue,
+)
+
+
+@pytest.fixture
+def daemon(monkeypatch, tmp_path, fake_appmap):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Config, "daemon", "auto")
+    daemon = Daemon(str(tmp_path), workers=2)
+    daemon.start()
+    thread = threading.Thread(target=daemon.serve, daemon=True)
+    thread.start()
+    yield daemon
+    daemon.shutdown()
+    thread.join(timeout=10)
+
+
+def job(id, priority=0):
+    return Job(id, "plan", {}, priority, "work")
+
+
+def test_queue_orders_by_priority_then_submission():
+    queue = JobQueue()
+    for j in [job("a"), job("b", 5), job("c"), job("d", 5)]:
+        queue.put(j)
+    canceled = job("e", 10)
+    canceled.canceled.set()
+    queue.put(canceled)
+    queue.close()
+
+    assert len(queue) == 4
+    assert [queue.get().id for _ in range(4)] == ["b", "d", "a", "c"]
+    # Drained; canceled jobs are skipped, and a closed queue returns None
+    assert queue.get() is None
+
+
+def test_jobs_run_through_the_discovered_daemon(tmp_path, daemon, fake_appmap):
+    client = DaemonClient.discover(str(tmp_path))
+    assert client is not None
+    assert client.url == daemon.url
+
+    plan = client.run("plan", {"issue": "Fix the example"}, work_dir="work")
+    assert plan.startswith("Plan:")
+    assert os.path.exists(tmp_path / "work" / "plan" / "latest" / "plan.md")
+    assert len(appmap_calls(fake_appmap)) == 1
+
+    # An identical job is answered from memory
+    job = client.submit("plan", {"issue": "Fix the example"}, work_dir="work")
+    assert job["status"] == "done"
+    assert job["cached"]
+    assert job["result"] == plan
+
+    generated = client.run("generate", {"plan": "Change it"}, work_dir="work")
+    assert generated == "Generated:\n/noformat Change it\n"
+
+
+def test_queued_jobs_can_be_canceled(tmp_path, daemon, monkeypatch):
+    client = DaemonClient.discover(str(tmp_path))
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking(job):
+        started.set()
+        release.wait(10)
+        return "done"
+
+    monkeypatch.setitem(JOB_KINDS, "blocking", blocking)
+    try:
+        first = client.submit("blocking", {"n": 1})
+        second = client.submit("blocking", {"n": 2})
+        queued = client.submit("blocking", {"n": 3})
+        assert started.wait(10)
+
+        assert client.cancel(queued["id"])["status"] == CANCELED
+        release.set()
+        assert client.wait(first["id"], timeout=10) == "done"
+        assert client.wait(second["id"], timeout=10) == "done"
+        with pytest.raises(JobFailed):
+            client.wait(queued["id"], timeout=10)
+    finally:
+        release.set()
+
+
+def test_rejects_jobs_for_other_directories(tmp_path, daemon):
+    client = DaemonClient(daemon.url, str(tmp_path / "elsewhere"), daemon.token)
+    with pytest.raises(JobFailed, match="serves"):
+        client.submit("plan", {"issue": "x"})
+    with pytest.raises(JobFailed, match="Unknown job kind"):
+        DaemonClient(daemon.url, daemon.root, daemon.token).submit("refactor", {})
+
+
+def test_discovery(tmp_path, daemon, monkeypatch):
+    monkeypatch.setattr(Config, "daemon", "off")
+    assert DaemonClient.discover(str(tmp_path)) is None
+    monkeypatch.setattr(Config, "daemon", "auto")
+    assert DaemonClient.discover(str(tmp_path / "other")) is None
+
+    daemon.shutdown()
+    for _ in range(100):
+        if not os.path.exists(tmp_path / DISCOVERY_FILE):
+            break
+        threading.Event().wait(0.05)
+    assert not os.path.exists(tmp_path / DISCOVERY_FILE)
+    assert DaemonClient.discover(str(tmp_path)) is None
+
+
+def test_edit_jobs_run_one_at_a_time(tmp_path, daemon, monkeypatch):
+    client = DaemonClient.discover(str(tmp_path))
+    lock = threading.Lock()
+    running = []
+    overlapped = []
+
+    def edit(job):
+        with lock:
+            running.append(job.id)
+            overlapped.append(len(running) > 1)
+        threading.Event().wait(0.1)
+        with lock:
+            running.remove(job.id)
+        return "edited"
+
+    monkeypatch.setitem(JOB_KINDS, "edit", edit)
+    jobs = [client.submit("edit", {"n": n}) for n in range(3)]
+    # Other jobs aren't held up behind the edits
+    assert client.run("plan", {"issue": "Fix the example"}).startswith("Plan:")
+    for job in jobs:
+        assert client.wait(job["id"], timeout=10) == "edited"
+    assert overlapped == [False, False, False]
+
+
+def test_finished_jobs_are_evicted(tmp_path, daemon, monkeypatch):
+    monkeypatch.setattr(daemon_module, "MAX_FINISHED_JOBS", 2)
+    client = DaemonClient.discover(str(tmp_path))
+    jobs = [client.submit("plan", {"issue": "Fix the example"}) for _ in range(4)]
+    client.wait(jobs[0]["id"], timeout=10)
+    for job in jobs[1:]:
+        client.wait(job["id"], timeout=10)
+    client.submit("plan", {"issue": "Fix the example"})
+
+    assert jobs[0]["id"] not in daemon.jobs
+    assert jobs[1]["id"] not in daemon.jobs
+    assert jobs[3]["id"] in daemon.jobs
+
+    monkeypatch.setattr(daemon_module, "JOB_TTL_SECONDS", 0)
+    last = client.submit("plan", {"issue": "Fix the example"})
+    assert list(daemon.jobs) == [last["id"]]
+
+
+def test_requests_need_the_token_and_json(tmp_path, daemon):
+    assert os.stat(tmp_path / DISCOVERY_FILE).st_mode & 0o777 == 0o600
+
+    with pytest.raises(JobFailed, match="X-Navie-Token"):
+        DaemonClient(daemon.url, daemon.root).submit("plan", {"issue": "x"})
+    with pytest.raises(JobFailed, match="X-Navie-Token"):
+        DaemonClient(daemon.url, daemon.root, "wrong").status("1")
+
+    # A form or text/plain POST, as a web page could send without a preflight
+    request = urllib.request.Request(
+        daemon.url + "/jobs",
+        data=json.dumps({"kind": "edit", "params": {}}).encode("utf-8"),
+        method="POST",
+        headers={"Content-Type": "text/plain", TOKEN_HEADER: daemon.token},
+    )
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(request, timeout=10)
+    assert e.value.code == 415
+    assert daemon.jobs == {}
@@ -0,0 +1,86 @@
+import difflib
+import random
+
+import pytest
+
+from navie import diff
+from navie.diff import opcodes, unified_diff
+
+
+def apply_opcodes(a, b, codes):
+    result = []
+    i = j = 0
+    for tag, i1, i2, j1, j2 in codes:
+        assert (i1, j1) == (i, j)
+        if tag == "equal":
+            assert a[i1:i2] == b[j1:j2]
+            result.extend(a[i1:i2])
+        else:
+            result.extend(b[j1:j2])
+        i, j = i2, j2
+    assert (i, j) == (len(a), len(b))
+    return result
+
+
+def random_edit(rng, lines, edits):
+    lines = list(lines)
+    for _ in range(edits):
+        choice = rng.random()
+        if choice < 0.3 and lines:
+            del lines[rng.randrange(len(lines))]
+        elif choice < 0.6:
+            lines.insert(rng.randint(0, len(lines)), f"{rng.randint(0, 15)}\n")
+        elif lines:
+            lines[rng.randrange(len(lines))] = f"{rng.randint(0, 15)}\n"
+    return lines
+
+
+def test_identical_input_has_empty_diff():
+    lines = ["a\n", "b\n"]
+    assert unified_diff(lines, list(lines), "f", "f") == ""
+    assert unified_diff([], [], "f", "f") == ""
+
+
+def test_matches_difflib_output():
+    a = [f"line {i}\n" for i in range(20)]
+    b = list(a)
+    b[2] = "changed\n"
+    b.insert(15, "inserted\n")
+    del b[18]
+    assert unified_diff(a, b, "x.py", "x.py") == "".join(
+        difflib.unified_diff(a, b, fromfile="x.py", tofile="x.py")
+    )
+
+
+@pytest.mark.parametrize("direct_size", [diff.MYERS_DIRECT_SIZE, 4])
+def test_opcodes_transform_a_into_b(monkeypatch, direct_size):
+    # A small direct size forces the patience anchor path on small inputs
+    monkeypatch.setattr(diff, "MYERS_DIRECT_SIZE", direct_size)
+    rng = random.Random(0)
+    for _ in range(500):
+        a = [f"{rng.randint(0, 12)}\n" for _ in range(rng.randint(0, 40))]
+        b = random_edit(rng, a, rng.randint(0, 6))
+        assert apply_opcodes(a, b, opcodes(a, b)) == b
+
+
+def test_falls_back_to_replace_beyond_max_distance(monkeypatch):
+    monkeypatch.setattr(diff, "MYERS_MAX_DISTANCE", 2)
+    a = ["a\n", "b\n", "c\n", "d\n"]
+    b = ["w\n", "x\n", "y\n", "z\n"]
+    assert opcodes(a, b) == [("replace", 0, 4, 0, 4)]
+
+
+def test_large_generated_file():
+    a = ["{\n", '  "value": null,\n', "},\n"] * 10_000
+    b = list(a)
+    b[15_001] = '  "value": 1,\n'
+    assert apply_opcodes(a, b, opcodes(a, b)) == b
+
+    result = unified_diff(a, b, "data.json", "data.json").splitlines()
+    assert len([line for line in result if line.startswith("@@")]) == 1
+    assert [line for line in result if line[0] in "+-"] == [
+        "--- data.json",
+        "+++ data.json",
+        '-  "value": null,',
+        '+  "value": 1,',
+    ]
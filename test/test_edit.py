@@ -0,0 +1,276 @@
+import sys
+
+from conftest import appmap_calls
+from navie.buffer import DocumentBuffer
+from navie.client import _watch_output
+from navie.config import Config
+from navie.extract_changes import FileUpdate
+from navie.mode.edit import Edit, PlanScanner, route_changes
+
+
+def change_xml(file, original, modified):
+    return f"""<change>
+<file>{file}</file>
+<original>{original}</original>
+<modified>{modified}</modified>
+</change>"""
+
+
+def test_route_changes_by_path_suffix(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    files = ["src/app/models.py", "src/app/views.py", "lib/views.py"]
+    changes = [
+        FileUpdate("src/app/models.py", "a", "b"),
+        FileUpdate(str(tmp_path / "src/app/models.py"), "c", "d"),
+        FileUpdate("app/views.py", "e", "f"),
+        FileUpdate("views.py", "g", "h"),
+        FileUpdate("other.py", "i", "j"),
+    ]
+    routed = route_changes(changes, files)
+    assert [c.original for c in routed["src/app/models.py"]] == ["a", "c"]
+    assert [c.original for c in routed["src/app/views.py"]] == ["e"]
+    # "views.py" is ambiguous, "other.py" matches nothing
+    assert routed["lib/views.py"] == []
+
+
+def test_batch_apply_generates_once_and_falls_back_per_file(
+    tmp_path, monkeypatch, fake_appmap
+):
+    monkeypatch.chdir(tmp_path)
+    for name in ("a.py", "b.py", "c.py"):
+        (tmp_path / name).write_text(f"name = '{name}'\n")
+
+    edit = Edit(str(tmp_path / "work"), "Rename things")
+    edit.batch = True
+    edit.files_to_edit = ["a.py", "b.py", "c.py"]
+    # The fake appmap echoes the plan, so its changes come back as generated code
+    edit._plan = "\n".join(
+        [
+            change_xml("a.py", "name = 'a.py'", "name = 'A'"),
+            change_xml("./b.py", "name = 'b.py'", "name = 'B'"),
+        ]
+    )
+
+    fallback_files = []
+    monkeypatch.setattr(
+        Edit, "_generate_changes", lambda self, file, editor: fallback_files.append(file) or []
+    )
+
+    confirmed = []
+    edit.apply(lambda file, diff: confirmed.append(file) or True)
+
+    assert (tmp_path / "a.py").read_text() == "name = 'A'\n"
+    assert (tmp_path / "b.py").read_text() == "name = 'B'\n"
+    assert (tmp_path / "c.py").read_text() == "name = 'c.py'\n"
+    assert confirmed == ["a.py", "b.py"]
+    assert len(appmap_calls(fake_appmap)) == 1
+    # Only the file that got no changes is generated separately
+    assert fallback_files == ["c.py"]
+
+
+def test_edit_prompts_share_everything_but_the_target_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in ("a.py", "b.py", "context1.py", "context2.py"):
+        (tmp_path / name).write_text(f"name = '{name}'\n" * 20)
+
+    edit = Edit(str(tmp_path / "work"), "Rename things")
+    edit._plan = "Rename the names"
+    edit.files = ["context2.py", "context1.py"]
+
+    prompts = []
+
+    class RecordingEditor:
+        def generate(self, message, prompt=None):
+            prompts.append(message)
+            return ""
+
+    edit._generate_changes("a.py", RecordingEditor())
+    edit.files = ["context1.py", "context2.py", "context1.py"]
+    edit._generate_changes("b.py", RecordingEditor())
+
+    assert prompts[0].endswith("Edit file a.py according to the plan.\n")
+    assert prompts[0].index("context1.py") < prompts[0].index("context2.py")
+    shared = len(prompts[0]) - len("a.py according to the plan.\n")
+    assert prompts[0][:shared] == prompts[1][:shared]
+    assert edit.prefix_stats.shared_bytes == shared
+    assert "2 prompts" in edit.prefix_stats.summary()
+
+
+def test_apply_uses_speculative_generation_for_the_same_plan(
+    tmp_path, monkeypatch, fake_appmap
+):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "a.py").write_text("name = 'a'\n")
+
+    edit = Edit(str(tmp_path / "work"), "Rename things")
+    edit.files_to_edit = ["a.py"]
+    edit._plan = change_xml("a.py", "name = 'a'", "name = 'A'")
+
+    edit.speculate()
+    edit._speculative["a.py"][1].result()
+    assert len(appmap_calls(fake_appmap)) == 1
+
+    edit.apply(lambda file, diff: True)
+    assert (tmp_path / "a.py").read_text() == "name = 'A'\n"
+    assert len(appmap_calls(fake_appmap)) == 1
+
+
+def test_speculative_generation_is_discarded_when_the_problem_changes(
+    tmp_path, monkeypatch, fake_appmap
+):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "a.py").write_text("name = 'a'\n")
+    (tmp_path / "b.py").write_text("name = 'b'\n")
+
+    edit = Edit(str(tmp_path / "work"), "Rename things")
+    edit.files_to_edit = ["a.py", "b.py"]
+    edit._plan = change_xml("a.py", "name = 'a'", "name = 'A'")
+    edit.speculate()
+    for _, future in edit._speculative.values():
+        future.result()
+
+    edit.cancel_speculation(keep=["a.py"])
+    assert list(edit._speculative) == ["a.py"]
+
+    edit.problem_statement = "Rename other things"
+    edit.files_to_edit = ["a.py"]
+    edit.apply(lambda file, diff: True)
+    assert (tmp_path / "a.py").read_text() == "name = 'A'\n"
+    # The speculative result for the old problem statement wasn't used
+    assert len(appmap_calls(fake_appmap)) == 3
+
+
+def test_chunked_edit_generates_touched_regions_and_merges_them(
+    tmp_path, monkeypatch, fake_appmap
+):
+    import navie.mode.edit as edit_module
+    import navie.mode.prompt as prompt_module
+
+    monkeypatch.setattr(edit_module, "CHUNK_MIN_LINES", 50)
+    monkeypatch.chdir(tmp_path)
+    source = "".join(f"def f{i}():\n    return {i}\n\n\n" for i in range(100))
+    (tmp_path / "big.py").write_text(source)
+
+    edit = Edit(str(tmp_path / "work"), "Change f10 and f90")
+    edit.chunk_large_files = True
+    edit.files = ["big.py"]
+    edit.files_to_edit = ["big.py"]
+    # The fake appmap echoes the plan, so each region gets both changes back
+    edit._plan = "\n".join(
+        [
+            "Change `f10` and `f90`.",
+            change_xml("big.py", "    return 10", "    return 1000"),
+            change_xml("big.py", "    return 90", "    return 9000"),
+        ]
+    )
+
+    def fail(file):
+        raise AssertionError(f"{file} was read again for a region")
+
+    # Regions are rendered from the buffer, so the file is read once
+    monkeypatch.setattr(prompt_module, "render_file", fail)
+    edit.apply(lambda file, diff: True)
+
+    result = (tmp_path / "big.py").read_text()
+    assert "def f10():\n    return 1000\n" in result
+    assert "def f90():\n    return 9000\n" in result
+    assert result.count("return") == 100
+    # One request per region, neither of which includes the whole file
+    assert len(appmap_calls(fake_appmap)) == 2
+    assert all(len(p) < len(source) for p in edit.prefix_stats.prompts)
+
+
+def test_plan_scanner_reports_complete_lines_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in ("a.py", "b.py", "b.pyx"):
+        (tmp_path / name).write_text("")
+
+    found = []
+    scanner = PlanScanner(found.append)
+    scanner.feed("Change a.py and b.p")
+    assert found == []
+    scanner.feed("Change a.py and b.pyx\nThen a.py again")
+    assert found == ["a.py", "b.pyx"]
+    scanner.feed("Change a.py and b.pyx\nThen a.py again, and b.py", final=True)
+    assert found == ["a.py", "b.pyx", "b.py"]
+
+
+def test_plan_prefetches_files_and_starts_generation(tmp_path, monkeypatch, fake_appmap):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "a.py").write_text("name = 'a'\n")
+    (tmp_path / "b.py").write_text("name = 'b'\n")
+
+    edit = Edit(str(tmp_path / "work"), "Rename things in a.py and b.py")
+    edit.interactive = False
+    edit.prefetch_files = True
+    edit.early_generation = True
+    edit.plan()
+    # The fake appmap's plan repeats the problem statement
+    assert sorted(edit.prefetched) == ["a.py", "b.py"]
+    assert sorted(edit._speculative) == ["a.py", "b.py"]
+
+    edit.apply(lambda file, diff: True)
+    # One plan, one generation per file, and no more
+    assert len(appmap_calls(fake_appmap)) == 3
+
+
+def test_fuzzy_matches_need_a_lower_min_confidence(tmp_path, capsys):
+    source = "def greet(name):\n    message = 'Hello, ' + name\n    return message\n"
+    change = FileUpdate(
+        "greet.py",
+        "def greet(name):\n    message = 'Hi, ' + name\n    return message",
+        "def greet(name):\n    return 'Hi, ' + name",
+    )
+    edit = Edit(str(tmp_path / "work"), "Simplify greet")
+
+    buffer = DocumentBuffer("greet.py", source)
+    edit._apply_changes(buffer, [change], None, str(tmp_path))
+    assert buffer.text == source
+    output = capsys.readouterr().out
+    assert "Rejected change to greet.py" in output
+    assert "-    message = 'Hi, ' + name\n+    message = 'Hello, ' + name" in output
+
+    edit.min_confidence = 0.5
+    edit._apply_changes(buffer, [change], None, str(tmp_path))
+    assert buffer.text == "def greet(name):\n    return 'Hi, ' + name\n"
+    assert "only match its original code" in capsys.readouterr().out
+
+
+def test_output_that_ends_mid_character_is_still_streamed(tmp_path):
+    output_file = tmp_path / "plan.md"
+    outputs = []
+    with _watch_output(["navie", "-o", str(output_file)], outputs.append):
+        # A plan written up to the middle of a multi-byte character
+        output_file.write_bytes("Change café.py".encode("utf-8")[:-4])
+    assert outputs[-1] == "Change caf�"
+
+
+def test_interactive_batch_edit_generates_once(tmp_path, monkeypatch, fake_appmap):
+    import navie.mode.edit as edit_module
+    from navie.mode.interactions import Interactions
+
+    monkeypatch.chdir(tmp_path)
+    for name in ("a.py", "b.py"):
+        (tmp_path / name).write_text(f"name = '{name}'\n")
+
+    def plan(self):
+        # The fake appmap echoes the plan, so its changes come back as generated code
+        self._plan = "\n".join(
+            [
+                change_xml("a.py", "name = 'a.py'", "name = 'A'"),
+                change_xml("b.py", "name = 'b.py'", "name = 'B'"),
+            ]
+        )
+        self.files_to_edit = ["a.py", "b.py"]
+        return self._plan
+
+    monkeypatch.setattr(Edit, "plan", plan)
+    monkeypatch.setattr(Interactions, "prompt_for_edit", lambda self: False)
+    monkeypatch.setattr(Interactions, "confirm_diff", lambda self, file, diff: True)
+    monkeypatch.setattr(sys, "argv", ["edit", "--batch", "-i", "Rename things"])
+    monkeypatch.setattr(Config, "issue_id", None)
+    edit_module.main()
+
+    assert (tmp_path / "a.py").read_text() == "name = 'A'\n"
+    assert (tmp_path / "b.py").read_text() == "name = 'B'\n"
+    assert len(appmap_calls(fake_appmap)) == 1
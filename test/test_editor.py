@@ -0,0 +1,102 @@
+from conftest import appmap_calls
+from navie import editor as editor_module
+from navie.editor import Editor, merge_context, rank_context
+
+
+def item(location, content=""):
+    return {"type": "code-snippet", "location": location, "content": content}
+
+
+def test_merge_context_dedupes_by_file_and_line_range():
+    merged, hits = merge_context(
+        [
+            [item("a.py:1-10"), item("b.py:5-8")],
+            [item("a.py:2-4"), item("b.py:1-20"), item("c.py")],
+            [item("a.py:11-12"), item("c.py:3-4")],
+        ]
+    )
+    assert [(m["location"], n) for m, n in zip(merged, hits)] == [
+        ("a.py:1-10", 2),
+        ("b.py:1-20", 2),
+        ("c.py", 2),
+        ("a.py:11-12", 1),
+    ]
+    assert all("hits" not in m for m in merged)
+
+
+def test_rank_context_prefers_hits_then_shared_identifiers():
+    ranked = rank_context(
+        [
+            item("a.py:1-2", "def unrelated(): pass"),
+            item("b.py:1-2", "def parse_config(): pass"),
+            item("c.py:1-2", "def other(): pass"),
+        ],
+        "parse_config fails on empty files",
+        [1, 1, 3],
+    )
+    assert [r["location"] for r in ranked] == ["c.py:1-2", "b.py:1-2", "a.py:1-2"]
+
+
+def test_context_fanout_runs_and_caches_each_query(tmp_path, fake_appmap):
+    editor = Editor(str(tmp_path / "work"))
+    context = editor.context_fanout(
+        "Fix example", terms=["example", "helper"], include_patterns=["src/**"]
+    )
+
+    calls = appmap_calls(fake_appmap)
+    assert len(calls) == 4
+    # The fake returns the same location for every query
+    assert len(context) == 1
+    assert context[0]["location"] == "src/example.py:1-3"
+    assert "hits" not in context[0]
+    assert editor._context == context
+
+    # Queries are cached individually, so a new term only runs one more query
+    editor.context_fanout(
+        "Fix example", terms=["example", "helper", "other"], include_patterns=["src/**"]
+    )
+    assert len(appmap_calls(fake_appmap)) == 5
+
+
+def test_concurrent_calls_get_their_own_call_dirs(tmp_path, fake_appmap):
+    from concurrent.futures import ThreadPoolExecutor
+
+    editor = Editor(str(tmp_path / "work"))
+    plans = [f"Plan number {i}" for i in range(6)]
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        outputs = list(
+            executor.map(lambda plan: editor.generate(plan, cache=False), plans)
+        )
+
+    assert outputs == [f"Generated:\n/noformat {plan}\n" for plan in plans]
+    generate_dir = tmp_path / "work" / "generate"
+    call_dirs = [p for p in generate_dir.iterdir() if p.is_dir() and not p.is_symlink()]
+    assert len(call_dirs) == 6
+    latest = generate_dir / "latest"
+    assert latest.is_symlink()
+    assert (latest / "generate.md").read_text() in outputs
+
+
+def test_old_call_dirs_are_pruned(tmp_path, fake_appmap, monkeypatch):
+    monkeypatch.setattr(editor_module, "MAX_CALL_DIRS", 3)
+    editor = Editor(str(tmp_path / "work"))
+    for i in range(5):
+        editor.generate(f"Plan number {i}", cache=False)
+
+    generate_dir = tmp_path / "work" / "generate"
+    call_dirs = [p for p in generate_dir.iterdir() if p.is_dir() and not p.is_symlink()]
+    assert len(call_dirs) == 3
+    assert (generate_dir / "latest" / "generate.md").read_text().endswith(
+        "Plan number 4\n"
+    )
+
+
+def test_cached_calls_reuse_the_latest_call(tmp_path, fake_appmap):
+    editor = Editor(str(tmp_path / "work"))
+    editor.plan("Fix the bug")
+    editor.plan("Fix the bug")
+
+    plan_dir = tmp_path / "work" / "plan"
+    assert len([p for p in plan_dir.iterdir() if p.is_dir() and not p.is_symlink()]) == 1
+    assert (plan_dir / "latest" / "plan.md").read_text().startswith("Plan:")
+    assert len(appmap_calls(fake_appmap)) == 1
@@ -0,0 +1,105 @@
+import sys
+import time
+
+import pytest
+
+from conftest import appmap_calls
+from navie import hedge
+from navie.client import Client
+from navie.config import Config
+from navie.hedge import MIN_SAMPLES, Hedger
+from navie.scratch import Scratch
+
+
+@pytest.fixture
+def hedger(monkeypatch, tmp_path):
+    """A hedger that knows generate takes about 0.1s, and a first call that stalls."""
+    hedger = Hedger(percentile=95, max_rate=1.0)
+    for _ in range(MIN_SAMPLES):
+        hedger.record("generate", 0.1)
+    monkeypatch.setattr(hedge, "_hedger", hedger)
+    monkeypatch.setattr(Config, "hedge", "true")
+    monkeypatch.setenv("FAKE_APPMAP_SLOW_ONCE", str(tmp_path / "slow"))
+    return hedger
+
+
+def generate(work_dir, transport="files"):
+    work_dir.mkdir()
+    scratch = Scratch(str(work_dir), transport=transport)
+    try:
+        plan_file = scratch.put("plan.md", "Change the example")
+        output_file = scratch.path("generate.md")
+        Client(str(work_dir), scratch=scratch).generate(plan_file, output_file)
+        return scratch.read_output(output_file)
+    finally:
+        scratch.close()
+
+
+def test_delay_is_a_percentile_of_recent_latencies():
+    hedger = Hedger(percentile=90, max_rate=1.0)
+    for i in range(1, MIN_SAMPLES):
+        hedger.record("plan", i / 100)
+    assert hedger.delay("plan") is None
+    hedger.record("plan", MIN_SAMPLES / 100)
+    assert hedger.delay("plan") == pytest.approx(0.19)
+    assert hedger.delay("generate") is None
+
+
+@pytest.mark.parametrize("transport", ["files", "fifo"])
+def test_slow_call_is_hedged_and_the_hedge_wins(
+    tmp_path, fake_appmap, hedger, transport
+):
+    start = time.perf_counter()
+    output = generate(tmp_path / "work", transport)
+    assert time.perf_counter() - start < 5
+    assert output == "Generated:\n/noformat Change the example\n"
+    assert len(appmap_calls(fake_appmap)) == 2
+    assert hedger.stats() == {"calls": 1, "hedged": 1, "won": 1}
+    # The primary's time, up to when it lost, is recorded rather than the hedge's
+    assert len(hedger._latencies["generate"]) == MIN_SAMPLES + 1
+    assert hedger._latencies["generate"][-1] > 0.1
+
+
+def test_hedges_are_capped(tmp_path, monkeypatch, fake_appmap, hedger):
+    monkeypatch.setenv("FAKE_APPMAP_SLOW_SECONDS", "0.5")
+    hedger.max_rate = 0.0
+    output = generate(tmp_path / "work")
+    assert output.startswith("Generated:")
+    assert len(appmap_calls(fake_appmap)) == 1
+    assert hedger.stats() == {"calls": 1, "hedged": 0, "won": 0}
+
+
+def test_hedging_is_off_by_default(tmp_path, monkeypatch, fake_appmap, hedger):
+    monkeypatch.setattr(Config, "hedge", "false")
+    monkeypatch.setenv("FAKE_APPMAP_SLOW_SECONDS", "0.5")
+    generate(tmp_path / "work")
+    assert hedger.stats()["calls"] == 0
+
+
+def test_primary_is_killed_when_the_hedge_fails_to_start():
+    hedger = Hedger(percentile=50, max_rate=1.0)
+    for _ in range(MIN_SAMPLES):
+        hedger.record("generate", 0.05)
+    spawned = []
+
+    def read(path):
+        raise OSError("input is gone")
+
+    command = [sys.executable, "-c", "import time; time.sleep(10)", "-i", "input.txt"]
+    with pytest.raises(OSError):
+        hedger.run(command, "generate", read, on_spawn=spawned.append)
+    assert spawned[0].poll() is not None
+
+
+def test_latencies_are_kept_per_client_method(
+    tmp_path, monkeypatch, fake_appmap, hedger
+):
+    monkeypatch.delenv("FAKE_APPMAP_SLOW_ONCE")
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    scratch = Scratch(str(work_dir))
+    issue_file = scratch.put("issue.txt", "Fix parse_config")
+    # Terms are asked for with @generate, but are timed apart from generation
+    Client(str(work_dir), scratch=scratch).terms(issue_file, scratch.path("terms.json"))
+    assert len(hedger._latencies["terms"]) == 1
+    assert len(hedger._latencies["generate"]) == MIN_SAMPLES
@@ -0,0 +1,85 @@
+from textwrap import dedent
+
+from navie.buffer import DocumentBuffer
+from navie.extract_changes import FileUpdate
+from navie.locator import BlockLocator
+
+SOURCE = dedent(
+    """\
+    class Greeter:
+        def greet(self, name):
+            message = "Hello, " + name
+            print(message)
+            return message
+
+        def farewell(self, name):
+            message = "Goodbye, " + name
+            print(message)
+            return message
+    """
+)
+
+
+def lines():
+    return SOURCE.splitlines(keepends=True)
+
+
+def test_exact_match():
+    match = BlockLocator(lines()).locate(
+        '        message = "Goodbye, " + name\n        print(message)'
+    )
+    assert (match.start, match.end, match.kind, match.score) == (7, 9, "exact", 1.0)
+
+
+def test_whitespace_insensitive_match():
+    match = BlockLocator(lines()).locate(
+        'def farewell(self,  name):\n    message = "Goodbye, " + name\n'
+    )
+    assert (match.start, match.end, match.kind) == (6, 8, "normalized")
+    assert match.score < 1.0
+
+
+def test_fuzzy_match_is_seeded_by_anchor_lines():
+    match = BlockLocator(lines()).locate(
+        dedent(
+            """\
+            def farewell(self, name):
+                message = "Bye, " + name
+                print(message)
+                return message
+            """
+        )
+    )
+    assert (match.start, match.end, match.kind) == (6, 10, "fuzzy")
+    assert 0.5 < match.score < 0.9
+
+
+def test_no_match():
+    assert BlockLocator(lines()).locate("completely = unrelated()\nstuff()") is None
+
+
+def test_buffer_reindents_normalized_matches():
+    buffer = DocumentBuffer("greeter.py", SOURCE)
+    original = 'def greet(self, name):\n    message = "Hello, " + name'
+    modified = 'def greet(self, name: str):\n    message = "Hi, " + name'
+    assert not buffer.apply(FileUpdate("greeter.py", original, modified))
+
+    match = buffer.locate(original)
+    buffer.apply_match(match, original, modified)
+    assert buffer.lines[1:3] == [
+        "    def greet(self, name: str):\n",
+        '        message = "Hi, " + name\n',
+    ]
+
+
+def test_buffer_deletes_matched_lines():
+    buffer = DocumentBuffer("greeter.py", SOURCE)
+    original = 'message = "Hello, " + name\nprint(message)'
+
+    match = buffer.locate(original)
+    buffer.apply_match(match, original, "")
+    assert buffer.lines[:3] == [
+        "class Greeter:\n",
+        "    def greet(self, name):\n",
+        "        return message\n",
+    ]
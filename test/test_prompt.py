@@ -0,0 +1,104 @@
+import os
+
+import pytest
+
+from navie.mode import prompt
+from navie.mode.prompt import (
+    clear_render_cache,
+    context_file_prompt,
+    render_file,
+    sliced_context_file_prompt,
+)
+
+
+@pytest.fixture(autouse=True)
+def empty_render_cache():
+    clear_render_cache()
+    yield
+    clear_render_cache()
+
+
+def expected_prompt(file, lines):
+    content = "".join([f"{i+1:6}: {line}" for i, line in enumerate(lines)])
+    return f"""<file>
+<path>{file}</path>
+<contents><!CDATA[
+{content}
+]]></contents>
+</file>
+"""
+
+
+def test_renders_line_numbered_contents(tmp_path):
+    file = tmp_path / "example.py"
+    file.write_text("def example():\r\n    return 1\n\nprint(example())")
+
+    assert context_file_prompt(str(file)) == expected_prompt(
+        str(file), ["def example():\n", "    return 1\n", "\n", "print(example())"]
+    )
+
+
+def test_rendering_is_cached_until_the_file_changes(tmp_path):
+    file = tmp_path / "example.py"
+    file.write_text("a = 1\n")
+    first = render_file(str(file))
+    assert render_file(str(file)) is first
+
+    file.write_text("a = 22\n")
+    mtime_ns = os.stat(file).st_mtime_ns
+    os.utime(file, ns=(mtime_ns, mtime_ns + 1_000_000))
+    second = render_file(str(file))
+    assert second is not first
+    assert second.lines == ["     1: a = 22\n"]
+
+
+def test_windowed_rendering(tmp_path):
+    file = tmp_path / "example.py"
+    file.write_text("".join(f"line {i}\n" for i in range(1, 11)))
+
+    rendered = context_file_prompt(str(file), start_line=4, end_line=5)
+    assert "<lines>4-5 of 10</lines>" in rendered
+    assert "     4: line 4\n     5: line 5\n" in rendered
+    assert "line 3" not in rendered and "line 6" not in rendered
+
+
+def test_binary_files_are_omitted(tmp_path):
+    file = tmp_path / "image.png"
+    file.write_bytes(b"\x89PNG\r\n\x1a\n\0\0\0")
+
+    assert "binary file of 11 bytes omitted" in context_file_prompt(str(file))
+
+
+def test_oversized_files_render_by_window(tmp_path, monkeypatch):
+    monkeypatch.setattr(prompt, "MMAP_THRESHOLD_BYTES", 64)
+    monkeypatch.setattr(prompt, "MAX_RENDER_BYTES", 128)
+    file = tmp_path / "large.py"
+    file.write_text("".join(f"value_{i} = {i}\n" for i in range(1, 101)))
+
+    assert "too large to include in full" in context_file_prompt(str(file))
+
+    rendered = context_file_prompt(str(file), start_line=99, end_line=200)
+    assert "<lines>99-100 of 100</lines>" in rendered
+    assert "    99: value_99 = 99\n   100: value_100 = 100\n" in rendered
+
+
+def test_sliced_prompts_use_the_rendering(tmp_path, monkeypatch):
+    monkeypatch.setattr(prompt, "MMAP_THRESHOLD_BYTES", 64)
+    monkeypatch.setattr(prompt, "MAX_RENDER_BYTES", 128)
+    file = tmp_path / "large.py"
+    file.write_text("".join(f"def value_{i}():\n    return {i}\n" for i in range(200)))
+    rendered = render_file(str(file))
+    assert rendered.kind == "oversized"
+
+    def fail(*args, **kwargs):
+        raise AssertionError("The file was read in full")
+
+    # An oversized file isn't read in full or sliced, just sent from its beginning
+    monkeypatch.setattr(prompt, "slice_ranges", fail)
+    assert "<lines>1-150 of 400</lines>" in sliced_context_file_prompt(
+        str(file), "Fix `value_180`"
+    )
+
+    monkeypatch.setattr(prompt, "MAX_RENDER_BYTES", 1024 * 1024)
+    clear_render_cache()
+    assert render_file(str(file)).text() == file.read_text()
@@ -0,0 +1,121 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from conftest import FAKE_APPMAP, appmap_calls
+
+PLAN_DIR = os.path.join(os.path.dirname(__file__), "..", "plan")
+sys.path.insert(0, PLAN_DIR)
+
+from replan import (  # noqa: E402
+    FULL,
+    REPLAN,
+    UNCHANGED,
+    Planner,
+    classify_change,
+    replan,
+    state_file,
+)
+
+ISSUE = """Empty config files crash the loader
+
+parse_config raises KeyError when navie/config.yml is empty. It should return an empty
+dict instead."""
+
+
+@pytest.mark.parametrize(
+    "previous, issue, decision",
+    [
+        (None, ISSUE, FULL),
+        (ISSUE, ISSUE, UNCHANGED),
+        (ISSUE, "  " + ISSUE.upper().replace(".", "!") + "\n", UNCHANGED),
+        (ISSUE, ISSUE.replace("crash", "break"), REPLAN),
+        (ISSUE, ISSUE + " Please add a test.", REPLAN),
+        (ISSUE, ISSUE + " The same happens in load_defaults.", FULL),
+        (ISSUE, ISSUE.replace("navie/config.yml", "`settings.toml`"), FULL),
+        (ISSUE, "Add dark mode to the settings page of the web app", FULL),
+    ],
+)
+def test_classify_change(previous, issue, decision):
+    assert classify_change(previous, issue) == decision
+
+
+def test_replan_reuses_context_and_plans(tmp_path, monkeypatch, fake_appmap):
+    monkeypatch.chdir(tmp_path)
+    state_dir = str(tmp_path / "state")
+    planner = Planner(str(tmp_path / "work"))
+
+    plan, decision = replan(ISSUE, "org/repo", "7", state_dir, planner)
+    assert decision == FULL
+    assert plan.startswith("Plan:")
+    calls = appmap_calls(fake_appmap)
+    assert len(calls) == 2
+
+    with open(state_file(state_dir, "org/repo", "7")) as f:
+        state = json.load(f)
+    assert state["context"][0]["location"] == "src/example.py:1-3"
+    assert state["plan"] == plan
+
+    # A whitespace-only edit reuses the plan
+    assert replan(ISSUE + "\n\n", "org/repo", "7", state_dir, planner) == (
+        plan,
+        UNCHANGED,
+    )
+    assert len(appmap_calls(fake_appmap)) == 2
+
+    # A wording change plans again, with the saved context
+    new_issue = ISSUE.replace("crash", "break")
+    new_plan, decision = replan(new_issue, "org/repo", "7", state_dir, planner)
+    assert decision == REPLAN
+    assert "break" in new_plan
+    calls = appmap_calls(fake_appmap)
+    assert len(calls) == 3
+    assert "-c" in calls[-1].split()
+
+    # State is kept per repository and issue
+    assert replan(ISSUE, "org/repo", "8", state_dir, planner)[1] == FULL
+    assert replan(ISSUE, "org/other", "7", state_dir, planner)[1] == FULL
+
+
+def test_plan_script_runs_incrementally(tmp_path):
+    work_dir = tmp_path / ".appmap" / "navie" / "work"
+    work_dir.mkdir(parents=True)
+    (work_dir / "issue.txt").write_text(ISSUE)
+    calls_file = tmp_path / "appmap_calls.txt"
+    env = {
+        **os.environ,
+        "APPMAP_COMMAND": f"{sys.executable} {FAKE_APPMAP}",
+        "APPMAP_NAVIE_ISSUE_ID": "7",
+        "APPMAP_NAVIE_DAEMON": "off",
+        "GITHUB_REPOSITORY": "org/repo",
+        "FAKE_APPMAP_CALLS": str(calls_file),
+    }
+
+    def run():
+        result = subprocess.run(
+            [sys.executable, os.path.join(PLAN_DIR, "plan.py")],
+            cwd=tmp_path,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return result.stdout
+
+    assert "(full)" in run()
+    assert (work_dir / "plan.md").read_text().startswith("Plan:")
+    assert "(unchanged)" in run()
+    assert len(appmap_calls(calls_file)) == 2
+
+    # On a fresh checkout, with only the persisted state directory, the issue state
+    # is lost but the work caches are restored from their bundle
+    shutil.rmtree(work_dir)
+    work_dir.mkdir()
+    (work_dir / "issue.txt").write_text(ISSUE)
+    os.remove(state_file(str(tmp_path / ".appmap" / "navie" / "state"), "org/repo", "7"))
+    assert "(full)" in run()
+    assert len(appmap_calls(calls_file)) == 2
@@ -0,0 +1,95 @@
+import re
+import time
+from subprocess import CompletedProcess
+
+import pytest
+
+from navie.config import Config
+from navie.editor import Editor
+from navie.replay import FINGERPRINT_ENV, ReplayMissError, record, replay
+
+from conftest import appmap_calls
+
+
+def test_record_then_replay_without_subprocess(fake_appmap, monkeypatch, tmp_path):
+    archive_file = str(tmp_path / "session.jsonl.gz")
+
+    monkeypatch.setattr(Config, "record_file", archive_file)
+    recorded_plan = Editor(str(tmp_path / "record")).plan("Fix the bug", cache=False)
+    assert len(appmap_calls(fake_appmap)) == 1
+
+    monkeypatch.setattr(Config, "record_file", None)
+    monkeypatch.setattr(Config, "replay_file", archive_file)
+    monkeypatch.setattr(Config, "appmap_command", ["does-not-exist"])
+    replayed_plan = Editor(str(tmp_path / "replay")).plan("Fix the bug", cache=False)
+
+    assert replayed_plan == recorded_plan
+    assert len(appmap_calls(fake_appmap)) == 1
+
+
+def test_replay_is_keyed_on_inputs_and_env(fake_appmap, monkeypatch, tmp_path):
+    archive_file = str(tmp_path / "session.jsonl.gz")
+    monkeypatch.delenv("APPMAP_NAVIE_MODEL", raising=False)
+
+    monkeypatch.setattr(Config, "record_file", archive_file)
+    Editor(str(tmp_path / "record")).plan("Fix the bug", cache=False)
+
+    monkeypatch.setattr(Config, "record_file", None)
+    monkeypatch.setattr(Config, "replay_file", archive_file)
+    monkeypatch.setattr(Config, "appmap_command", ["does-not-exist"])
+    editor = Editor(str(tmp_path / "replay"))
+    assert editor.plan("Fix the bug", cache=False).startswith("Plan:")
+    with pytest.raises(ReplayMissError):
+        editor.plan("Fix another bug", cache=False)
+
+    # The same inputs miss once an environment variable of the fingerprint changes
+    assert "APPMAP_NAVIE_MODEL" in FINGERPRINT_ENV
+    monkeypatch.setenv("APPMAP_NAVIE_MODEL", "another-model")
+    with pytest.raises(ReplayMissError):
+        editor.plan("Fix the bug", cache=False)
+
+
+def test_record_and_replay_apply(fake_appmap, monkeypatch, tmp_path):
+    archive_file = str(tmp_path / "session.jsonl.gz")
+    target = tmp_path / "example.py"
+
+    monkeypatch.setattr(Config, "record_file", archive_file)
+    target.write_text("x = 1\n")
+    Editor(str(tmp_path / "record")).apply(str(target), "x = 2", search="x = 1")
+    assert target.read_text() == "x = 2\n"
+
+    monkeypatch.setattr(Config, "record_file", None)
+    monkeypatch.setattr(Config, "replay_file", archive_file)
+    target.write_text("x = 1\n")
+    Editor(str(tmp_path / "replay")).apply(str(target), "x = 2", search="x = 1")
+    assert target.read_text() == "x = 2\n"
+    assert len(appmap_calls(fake_appmap)) == 1
+
+
+def test_replay_reports_and_can_wait_out_the_recorded_time(monkeypatch, tmp_path):
+    question = tmp_path / "question.txt"
+    question.write_text("@plan Fix the bug")
+    output = tmp_path / "answer.md"
+    args = ["navie", "-i", str(question), "-o", str(output)]
+    command = Config.get_appmap_command() + args
+    archive_file = str(tmp_path / "session.jsonl.gz")
+
+    def execute():
+        time.sleep(0.5)
+        output.write_text("Plan")
+        return CompletedProcess(command, 0)
+
+    record(archive_file, command, {}, execute)
+
+    log_file = tmp_path / "replay.log"
+    start = time.monotonic()
+    replay(archive_file, command, {}, str(log_file))
+    assert time.monotonic() - start < 0.5
+    recorded = re.search(r"\(recorded in ([\d.]+)s\)", log_file.read_text())
+    assert float(recorded.group(1)) >= 0.5
+
+    monkeypatch.setattr(Config, "replay_timing", "true")
+    start = time.monotonic()
+    replay(archive_file, command, {}, str(log_file))
+    assert time.monotonic() - start >= 0.5
+    assert output.read_text() == "Plan"
@@ -0,0 +1,94 @@
+import os
+import stat
+
+import pytest
+
+from conftest import appmap_calls
+from navie.config import Config
+from navie.editor import Editor
+from navie.scratch import Scratch, resolve_transport
+
+
+@pytest.fixture
+def transport(monkeypatch, tmp_path):
+    scratch_root = tmp_path / "scratch"
+    monkeypatch.setattr(Config, "scratch_dir", str(scratch_root))
+    monkeypatch.setattr(Config, "debug", "false")
+
+    def use(name):
+        monkeypatch.setattr(Config, "transport", name)
+        return scratch_root
+
+    return use
+
+
+def call_files(work_dir, operation):
+    return sorted(os.listdir(os.path.join(work_dir, operation, "latest")))
+
+
+@pytest.mark.parametrize("name", ["tmpfs", "fifo"])
+def test_payloads_stay_out_of_the_work_dir(tmp_path, fake_appmap, transport, name):
+    scratch_root = transport(name)
+    work_dir = str(tmp_path / "work")
+    editor = Editor(work_dir)
+
+    plan = editor.plan("Fix the example", context="some context", prompt="Be brief")
+    assert plan.startswith("Plan:")
+    assert "Fix the example" in plan
+
+    generated = editor.generate(plan="Change it", context="some context")
+    assert generated == "Generated:\n/noformat /nocontext Change it\n"
+
+    # Only logs are written for each call, and the scratch dirs are removed
+    assert call_files(work_dir, "plan") == ["plan.log"]
+    assert call_files(work_dir, "generate") == ["generate.log"]
+    assert os.listdir(scratch_root) == []
+
+    calls = appmap_calls(fake_appmap)
+    assert len(calls) == 2
+    assert str(scratch_root) in calls[0]
+
+
+def test_debug_materializes_payloads(tmp_path, fake_appmap, transport):
+    transport("fifo")
+    Config.set_debug("true")
+    work_dir = str(tmp_path / "work")
+
+    Editor(work_dir).plan("Fix the example", context="some context")
+
+    assert call_files(work_dir, "plan") == [
+        "plan.context.yaml",
+        "plan.input.txt",
+        "plan.log",
+        "plan.md",
+        "plan.txt",
+    ]
+    with open(os.path.join(work_dir, "plan", "latest", "plan.txt")) as f:
+        assert f.read() == "@plan /nocontext Fix the example"
+
+
+def test_fifo_payloads_are_pipes(tmp_path, transport):
+    transport("fifo")
+    scratch = Scratch(str(tmp_path))
+    try:
+        path = scratch.put("input.txt", "hello")
+        assert scratch.read(path) == "hello"
+        assert scratch.size(path) == 5
+        assert not os.path.exists(path)
+
+        scratch.expose(path)
+        assert stat.S_ISFIFO(os.stat(path).st_mode)
+        for _ in range(2):
+            with scratch.serving():
+                with open(path) as f:
+                    assert f.read() == "hello"
+    finally:
+        scratch.close()
+    assert not os.path.exists(scratch.root)
+
+
+def test_recording_uses_files(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, "record_file", str(tmp_path / "session.jsonl"))
+    assert resolve_transport("fifo") == "files"
+    with pytest.raises(ValueError):
+        resolve_transport("sockets")
@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+from conftest import appmap_calls
+from navie.config import Config
+from navie.editor import Editor
+from navie import similarity as similarity_module
+from navie.similarity import SimilarityIndex, signature, similarity
+
+ISSUE = (
+    "parse_config crashes when the config file is empty. It should return an empty "
+    "dict instead of raising KeyError, and log a warning with the file name."
+)
+TYPO = ISSUE.replace("crashes", "crahses")
+OTHER = "Add a resident daemon that serves plan jobs over HTTP with a priority queue."
+
+
+@pytest.fixture
+def similarity_dir(monkeypatch, tmp_path):
+    similarity_dir = str(tmp_path / "similar")
+    monkeypatch.setattr(Config, "similarity_dir", similarity_dir)
+    return similarity_dir
+
+
+def test_signatures_estimate_similarity():
+    assert similarity(signature(ISSUE), signature(ISSUE)) == 1.0
+    assert similarity(signature(ISSUE), signature(TYPO)) >= 0.8
+    assert similarity(signature(ISSUE), signature(OTHER)) < 0.2
+    # Case and punctuation don't matter
+    assert signature(ISSUE.upper().replace(".", "!")) == signature(ISSUE)
+    assert signature("...") is None
+
+
+def test_index_matches_near_duplicates_with_the_same_params(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    index.add("plan", ISSUE, "the plan", {"options": None})
+
+    similar = index.lookup("plan", TYPO, {"options": None})
+    assert similar.result == "the plan"
+    assert similar.score >= 0.8
+    assert index.lookup("plan", TYPO, {"options": "/tokenlimit=100"}) is None
+    assert index.lookup("context", TYPO, {"options": None}) is None
+    assert index.lookup("plan", OTHER, {"options": None}) is None
+
+    # Entries are persisted, and seen by other instances
+    assert SimilarityIndex(str(tmp_path)).lookup("plan", TYPO, {"options": None})
+
+
+def test_index_is_appended_to_and_results_are_stored_by_content(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    other = SimilarityIndex(str(tmp_path))
+    index.add("plan", ISSUE, "the plan")
+    with open(index.index_file) as f:
+        before = f.read()
+    other.add("plan", OTHER, "the plan")
+    index.add("plan", ISSUE, "a better plan")
+    with open(index.index_file) as f:
+        after = f.read()
+
+    assert after.startswith(before)
+    assert len(after.splitlines()) == 3
+    assert len(os.listdir(index.results_dir)) == 2
+    # The latest result for a text wins, and each index sees the other's entries
+    assert other.lookup("plan", ISSUE).result == "a better plan"
+    assert index.lookup("plan", OTHER).result == "the plan"
+
+
+def test_index_is_compacted(tmp_path, monkeypatch):
+    monkeypatch.setattr(similarity_module, "MAX_ENTRIES", 2)
+    index = SimilarityIndex(str(tmp_path))
+    texts = [f"{ISSUE} {n}" * (n + 1) for n in range(5)]
+    for n, text in enumerate(texts):
+        index.add("plan", text, f"plan {n}")
+
+    with open(index.index_file) as f:
+        assert len(f.readlines()) == 2
+    assert len(os.listdir(index.results_dir)) == 2
+    assert SimilarityIndex(str(tmp_path)).lookup("plan", texts[4]).result == "plan 4"
+
+
+def test_editor_reuses_the_context_of_a_similar_query(
+    tmp_path, fake_appmap, similarity_dir
+):
+    first = Editor(str(tmp_path / "first")).context(ISSUE)
+    assert len(appmap_calls(fake_appmap)) == 1
+
+    second = Editor(str(tmp_path / "second")).context(TYPO)
+    assert second == first
+    assert len(appmap_calls(fake_appmap)) == 1
+
+    Editor(str(tmp_path / "third")).context(OTHER)
+    assert len(appmap_calls(fake_appmap)) == 2
+
+
+def test_editor_plans_from_the_plan_of_a_similar_issue(
+    tmp_path, fake_appmap, similarity_dir
+):
+    first = Editor(str(tmp_path / "first")).plan(ISSUE)
+    assert "near-duplicate" not in first
+
+    # The fake appmap repeats the issue, including the similar plan
+    second = Editor(str(tmp_path / "second")).plan(TYPO)
+    assert "near-duplicate of this issue" in second
+    assert first in second
+    assert len(appmap_calls(fake_appmap)) == 2
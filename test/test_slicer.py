@@ -0,0 +1,107 @@
+from textwrap import dedent
+
+from navie.mode.prompt import clear_render_cache, sliced_context_file_prompt
+from navie.slicer import code_names, parse_terms, slice_ranges
+
+PYTHON_SOURCE = dedent(
+    """\
+    import os
+    from typing import Optional
+
+
+    class Parser:
+        def __init__(self):
+            self.tokens = []
+
+        def parse(self, text):
+            return text.split()
+
+        def reset(self):
+            self.tokens = []
+
+
+    def render(value):
+        return str(value)
+
+
+    def unrelated():
+        return None
+    """
+)
+
+
+def test_python_slices_keep_headers_and_matching_symbols():
+    ranges = slice_ranges("parser.py", PYTHON_SOURCE, "Fix Parser.parse", min_lines=0)
+    # imports, the class header and the parse method; not reset, render or unrelated
+    covered = {n for start, end in ranges for n in range(start, end + 1)}
+    assert {1, 2, 5, 9, 10} <= covered
+    assert 13 not in covered and 17 not in covered and 21 not in covered
+
+
+def test_terms_select_symbols():
+    ranges = slice_ranges("parser.py", PYTHON_SOURCE, "", ["render"], min_lines=0)
+    covered = {n for start, end in ranges for n in range(start, end + 1)}
+    assert {16, 17} <= covered
+    assert 10 not in covered
+
+
+def test_only_code_names_in_the_focus_select_symbols():
+    assert code_names(
+        "Reset the Parser: call `reset` from Parser.parse(), using parse_tokens() "
+        "and DocumentBuffer or HTTPServer."
+    ) == {
+        "reset",
+        "Parser",
+        "parse",
+        "parse_tokens",
+        "DocumentBuffer",
+        "HTTPServer",
+    }
+    # Plain words don't select the functions that happen to share their name
+    assert slice_ranges("parser.py", PYTHON_SOURCE, "Render it", min_lines=0) is None
+    assert slice_ranges("parser.py", PYTHON_SOURCE, "Render it", ["render"], min_lines=0)
+
+
+def test_short_or_unmatched_files_are_not_sliced():
+    assert slice_ranges("parser.py", PYTHON_SOURCE, "Fix Parser.parse") is None
+    assert slice_ranges("parser.py", PYTHON_SOURCE, "nothing", min_lines=0) is None
+
+
+def test_indentation_fallback_for_other_languages():
+    source = dedent(
+        """\
+        import { x } from "y";
+
+        function first() {
+          return 1;
+        }
+
+        function second() {
+          return 2;
+        }
+        """
+    )
+    ranges = slice_ranges("example.ts", source, "Change second()", min_lines=0)
+    covered = {n for start, end in ranges for n in range(start, end + 1)}
+    assert {1, 7, 8, 9} <= covered
+    assert 4 not in covered
+
+
+def test_sliced_prompt_uses_original_line_numbers(tmp_path):
+    clear_render_cache()
+    file = tmp_path / "parser.py"
+    file.write_text(PYTHON_SOURCE + "\n" * 200)
+
+    prompt = sliced_context_file_prompt(str(file), "Fix `render`")
+    assert "    16: def render(value):\n" in prompt
+    assert "    17:     return str(value)\n" in prompt
+    assert "def unrelated" not in prompt
+    assert "      ...\n" in prompt
+
+
+def test_parse_terms():
+    assert parse_terms(['["Parser", "parse"]\n', "render"]) == [
+        "Parser",
+        "parse",
+        "render",
+    ]
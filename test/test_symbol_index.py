@@ -0,0 +1,130 @@
+import os
+from textwrap import dedent
+
+from conftest import appmap_calls
+from navie.editor import Editor
+from navie.symbol_index import SymbolIndex, extract_symbols
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(dedent(text))
+
+
+def make_repo(root):
+    write(
+        root / "pkg" / "models.py",
+        """\
+        class Order:
+            def total(self):
+                return 1
+
+
+        def load_orders():
+            return [Order()]
+        """,
+    )
+    write(
+        root / "web" / "cart.js",
+        """\
+        class Cart {
+          checkout() {
+            return true;
+          }
+        }
+
+        function emptyCart(cart) {
+          return null;
+        }
+        """,
+    )
+    write(root / "node_modules" / "dep.js", "function ignored() {}\n")
+
+
+def test_extract_symbols():
+    symbols = extract_symbols(
+        "pkg/models.py", "class A:\n    def f(self):\n        pass\n\ndef g():\n    pass\n"
+    )
+    assert symbols == [
+        ("A", "class", 1, 3),
+        ("f", "method", 2, 3),
+        ("g", "function", 5, 6),
+        ("pkg.models", "module", 1, 6),
+        ("models", "file", 1, 6),
+    ]
+
+
+def test_lookup_and_incremental_update(tmp_path):
+    make_repo(tmp_path)
+    index = SymbolIndex(str(tmp_path))
+    assert index.update() == 2
+    assert index.update() == 0
+
+    [order] = index.lookup("Order")
+    assert (order.kind, order.path, order.start, order.end) == ("class", "pkg/models.py", 1, 3)
+    [cart] = index.lookup("Cart")
+    assert (cart.kind, cart.path, cart.start, cart.end) == ("class", "web/cart.js", 1, 5)
+    assert [s.kind for s in index.lookup("emptyCart")] == ["function"]
+    assert index.lookup("ignored") == []
+    assert index.lookup("Orde") == []
+
+    write(tmp_path / "pkg" / "models.py", "def load_orders():\n    return []\n")
+    os.utime(tmp_path / "pkg" / "models.py", ns=(1, 1))
+    assert SymbolIndex(str(tmp_path)).update() == 1
+    assert index.lookup("Order") == []
+
+
+def test_update_leaves_mappings_in_use_open(tmp_path):
+    make_repo(tmp_path)
+    index = SymbolIndex(str(tmp_path))
+    index.update()
+    # As a lookup in another thread would hold it
+    data = index._mapped()
+
+    write(tmp_path / "pkg" / "models.py", "def load_orders():\n    return []\n")
+    os.utime(tmp_path / "pkg" / "models.py", ns=(1, 1))
+    assert index.update() == 1
+    assert data.find(b"Order\t") != -1
+    assert index.lookup("Order") == []
+
+
+def test_answers_terms_files_and_context(tmp_path):
+    make_repo(tmp_path)
+    index = SymbolIndex(str(tmp_path))
+    index.update()
+
+    issue = "Order.total is wrong when load_orders is called from pkg.models"
+    assert index.answer_terms(issue) == ["Order", "total", "load_orders", "pkg.models"]
+    assert index.answer_terms("Nothing relevant here") is None
+    assert index.resolve_files("See pkg.models and cart.js") == [
+        "pkg/models.py",
+        "web/cart.js",
+    ]
+
+    context = index.answer_context(issue)
+    assert [c["location"] for c in context] == [
+        "pkg/models.py:1-3",
+        "pkg/models.py:2-3",
+        "pkg/models.py:6-7",
+    ]
+    assert context[1] == {
+        "type": "code-snippet",
+        "location": "pkg/models.py:2-3",
+        "content": "    def total(self):\n        return 1\n",
+    }
+    assert index.answer_context("Fix load_orders") is None
+
+
+def test_editor_skips_appmap_when_the_index_is_confident(tmp_path, fake_appmap):
+    make_repo(tmp_path)
+    index = SymbolIndex(str(tmp_path))
+    index.update()
+    editor = Editor(str(tmp_path / "work"), symbol_index=index)
+
+    assert editor.suggest_terms("Fix Order and emptyCart") == ['["Order", "emptyCart"]']
+    context = editor.context("Fix Order and emptyCart")
+    assert [c["location"] for c in context] == ["pkg/models.py:1-3", "web/cart.js:7-9"]
+    assert appmap_calls(fake_appmap) == []
+
+    editor.context("Fix the bug")
+    assert len(appmap_calls(fake_appmap)) == 1
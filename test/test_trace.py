@@ -0,0 +1,93 @@
+import json
+from collections import deque
+
+import pytest
+
+from navie import trace
+from navie.config import Config
+from navie.editor import Editor
+
+
+@pytest.fixture
+def trace_file(monkeypatch, tmp_path):
+    trace_file = tmp_path / "trace.json"
+    monkeypatch.setattr(Config, "trace_file", str(trace_file))
+    trace.reset()
+    yield trace_file
+    trace.reset()
+
+
+def test_span_is_noop_when_disabled(monkeypatch):
+    monkeypatch.setattr(Config, "trace_file", None)
+    assert trace.span("anything") is trace.NOOP_SPAN
+    assert trace.current() is trace.NOOP_SPAN
+
+
+def test_editor_spans_nest_and_record_cache_hits(fake_appmap, trace_file, tmp_path):
+    editor = Editor(str(tmp_path / "work"))
+    editor.plan("Fix the bug")
+    editor.plan("Fix the bug")
+
+    spans = trace.finished_spans()
+    plans = [s for s in spans if s.name == "editor.plan"]
+    assert [s.attributes.get("cache_hit") for s in plans] == [False, True]
+
+    executes = [s for s in spans if s.name == "client.execute"]
+    assert len(executes) == 1
+    assert executes[0].attributes["subcommand"] == "navie"
+    assert executes[0].attributes["input_bytes"] > 0
+    assert executes[0].attributes["output_bytes"] > 0
+
+    attempt = next(s for s in spans if s.name == "client.attempt")
+    assert attempt.parent is executes[0]
+    assert executes[0].parent is plans[0]
+
+
+def test_export_chrome_and_otlp(fake_appmap, trace_file, tmp_path):
+    Editor(str(tmp_path / "work")).plan("Fix the bug")
+
+    trace.export()
+    chrome = json.loads(trace_file.read_text())
+    names = {event["name"] for event in chrome["traceEvents"]}
+    assert {"editor.plan", "client.execute", "cache.lookup"} <= names
+    assert all(event["ph"] == "X" for event in chrome["traceEvents"])
+
+    otlp_file = tmp_path / "trace.otlp.json"
+    trace.export(str(otlp_file))
+    otlp = json.loads(otlp_file.read_text())
+    spans = otlp["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    by_id = {s["spanId"]: s for s in spans}
+    execute = next(s for s in spans if s["name"] == "client.execute")
+    assert by_id[execute["parentSpanId"]]["name"] == "editor.plan"
+    assert len({s["traceId"] for s in spans}) == 1
+
+
+def test_sub_editor_operations_are_traced_under_its_span(
+    fake_appmap, trace_file, tmp_path
+):
+    editor = Editor(str(tmp_path / "work"))
+    with trace.span("solve"):
+        sub_editor = editor.sub_editor("first")
+    sub_editor.plan("Fix the bug")
+    sub_editor.sub_editor("nested").plan("Fix another bug")
+
+    spans = trace.finished_spans()
+    subs = [s for s in spans if s.name == "editor.sub_editor"]
+    assert [s.attributes["work_dir"] for s in subs] == ["first", "nested"]
+    assert subs[0].parent.name == "solve"
+    assert subs[1].parent is subs[0]
+
+    plans = [s for s in spans if s.name == "editor.plan"]
+    assert [s.parent for s in plans] == subs
+    # Calls within an operation stay under the operation's span
+    execute = next(s for s in spans if s.name == "client.execute")
+    assert execute.parent is plans[0]
+    assert subs[0].end_ns >= plans[1].end_ns
+
+
+def test_only_the_most_recent_spans_are_kept(trace_file, monkeypatch):
+    monkeypatch.setattr(trace, "_finished_spans", deque(maxlen=3))
+    for i in range(5):
+        with trace.span(f"span-{i}"):
+            pass
+    assert [s.name for s in trace.finished_spans()] == ["span-2", "span-3", "span-4"]
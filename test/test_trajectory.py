@@ -0,0 +1,75 @@
+import json
+import os
+
+from navie.config import Config
+from navie.editor import Editor
+from navie.trajectory import TrajectoryIndex, main, report, summarize_segment
+
+
+def test_each_call_writes_its_own_segment(fake_appmap, monkeypatch, tmp_path):
+    trajectory_dir = tmp_path / "trajectory"
+    monkeypatch.setattr(Config, "issue_id", "issue-1")
+    editor = Editor(str(tmp_path / "work"), trajectory_dir=str(trajectory_dir))
+    editor.plan("Fix the bug", cache=False)
+    editor.plan("Fix the bug", cache=False)
+    editor.context("Fix the bug", cache=False)
+
+    segments = sorted(f for f in os.listdir(trajectory_dir) if f.endswith(".jsonl"))
+    assert len(segments) == 3
+    assert all("work" in f for f in segments)
+
+    summaries = TrajectoryIndex(str(trajectory_dir)).refresh()
+    assert sorted(s["operation"] for s in summaries) == ["@context", "@plan", "@plan"]
+    assert {s["issue"] for s in summaries} == {"issue-1"}
+    assert len({s["call_id"] for s in summaries}) == 3
+
+
+def test_summarize_prefers_reported_usage(tmp_path):
+    segment = tmp_path / "work.call-1.jsonl"
+    segment.write_text(
+        "\n".join(
+            [
+                json.dumps({"message": {"role": "user", "content": "x" * 400}}),
+                json.dumps(
+                    {
+                        "model": "gpt-4o",
+                        "usage": {"prompt_tokens": 1000, "completion_tokens": 200},
+                    }
+                ),
+            ]
+        )
+    )
+    (tmp_path / "work.call-1.meta.json").write_text(
+        json.dumps({"operation": "@generate", "elapsed": 2.5})
+    )
+
+    summary = summarize_segment(str(segment))
+    assert summary["input_tokens"] == 1000
+    assert summary["output_tokens"] == 200
+    assert summary["model"] == "gpt-4o"
+    assert not summary["estimated"]
+
+    [row] = report([summary], "operation")
+    assert row["cost"] == (1000 * 2.5 + 200 * 10.0) / 1_000_000
+    assert row["latency_p50"] == 2.5
+
+
+def test_index_reuses_unchanged_summaries(tmp_path):
+    segment = tmp_path / "work.call-1.jsonl"
+    segment.write_text(json.dumps({"message": {"role": "assistant", "content": "y" * 40}}))
+
+    index = TrajectoryIndex(str(tmp_path))
+    [summary] = index.refresh()
+    assert summary["output_tokens"] == 10
+
+    index.entries["work.call-1.jsonl"]["summary"]["output_tokens"] = -1
+    assert TrajectoryIndex(str(tmp_path)).refresh()[0]["output_tokens"] == 10
+    assert index.refresh()[0]["output_tokens"] == -1
+
+
+def test_main_prints_report(fake_appmap, tmp_path, capsys):
+    trajectory_dir = tmp_path / "trajectory"
+    Editor(str(tmp_path / "work"), trajectory_dir=str(trajectory_dir)).plan("Fix it")
+
+    assert main([str(trajectory_dir), "--by", "operation"]) == 0
+    assert "@plan" in capsys.readouterr().out
@@ -0,0 +1,130 @@
+import time
+
+import pytest
+
+from conftest import appmap_calls
+from navie.config import Config
+from navie.editor import Editor
+from navie.validators import (
+    ChangesValidator,
+    ContextValidator,
+    PlanValidator,
+    TermsValidator,
+)
+
+CHANGE = """<change>
+<file>src/example.py</file>
+<original><![CDATA[a]]></original>
+<modified><![CDATA[b]]></modified>
+</change>
+"""
+
+
+def test_changes_validator():
+    validator = ChangesValidator()
+    assert validator.feed(CHANGE[:40]) is None
+    assert validator.feed(CHANGE) is None
+    assert validator.check(CHANGE + "Done.") is None
+    assert "not closed" in ChangesValidator().check(CHANGE + CHANGE[:40])
+    assert "not well-formed" in ChangesValidator().feed(
+        "<change><file>x</file><original>a</change>"
+    )
+    assert "no <modified>" in ChangesValidator().feed(
+        "<change><file>x</file><original>a</original></change>"
+    )
+    # Changes whose CDATA is closed with a fence are repaired, as by extract_changes
+    fenced = CHANGE.replace("]]></modified>", "```</modified>")
+    assert ChangesValidator().check(fenced) is None
+
+
+def test_terms_validator():
+    assert TermsValidator().check('["parse_config", "Config"]') is None
+    assert TermsValidator().check('Terms:\n```json\n["parse_config"]\n```\n') is None
+    assert TermsValidator().check('{"terms": []}') == "the terms are not a JSON list"
+    assert TermsValidator().check("parse_config") == "the terms are not valid JSON"
+    assert TermsValidator().feed("Here are the terms: ") is None
+    assert TermsValidator().feed("The terms are " + "example, " * 40)
+
+
+def test_context_validator():
+    assert ContextValidator().feed("- type: code-snippet\n  loca") is None
+    assert ContextValidator().feed("```yaml\n- type: code-snippet\n") is None
+    assert ContextValidator().feed("Sorry, I") is None
+    assert ContextValidator().feed("Sorry, I can't.\n" * 20) == (
+        "the context is not a YAML list"
+    )
+    assert ContextValidator().feed("```yaml\nlocation: x\n") == (
+        "the context is not a YAML list"
+    )
+    # Prose before the fence of the list is accepted, as by check
+    fenced = "Here is the context:\n```yaml\n- location: src/example.py\n```\n"
+    for end in range(len(fenced) + 1):
+        assert ContextValidator().feed(fenced[:end]) is None
+    assert ContextValidator().check(fenced) is None
+    assert ContextValidator().check("- a\n- b\n") is None
+    assert ContextValidator().check("") is None
+    assert ContextValidator().check("a: b\n") == "the context is not a YAML list"
+
+
+def test_plan_validator():
+    assert PlanValidator().check("Change src/example.py") is None
+    assert PlanValidator().check("  \n") == "the plan is empty"
+
+
+@pytest.mark.parametrize(
+    "call, expected, slow_seconds",
+    [
+        (lambda e: e.generate(plan="Change the example"), "Generated:", 10),
+        (lambda e: e.suggest_terms("Fix parse_config"), ['["example"]'], 10),
+        (lambda e: e.context("Fix parse_config"), [{"type": "code-snippet"}], 10),
+        (lambda e: e.plan("Fix parse_config"), "Plan:", 0),
+    ],
+)
+def test_invalid_output_is_stopped_and_asked_again(
+    tmp_path, monkeypatch, fake_appmap, call, expected, slow_seconds
+):
+    monkeypatch.setenv("FAKE_APPMAP_BAD_ONCE", str(tmp_path / "bad"))
+    monkeypatch.setenv("FAKE_APPMAP_SLOW_SECONDS", str(slow_seconds))
+
+    start = time.perf_counter()
+    result = call(Editor(str(tmp_path / "work")))
+    assert time.perf_counter() - start < 5
+
+    if isinstance(expected, str):
+        assert result.startswith(expected)
+    elif isinstance(expected[0], dict):
+        assert result[0]["type"] == expected[0]["type"]
+    else:
+        assert result == expected
+    assert len(appmap_calls(fake_appmap)) == 2
+
+
+def test_reask_adds_a_correction_to_the_prompt(tmp_path, monkeypatch, fake_appmap):
+    monkeypatch.setenv("FAKE_APPMAP_BAD_ONCE", str(tmp_path / "bad"))
+    Editor(str(tmp_path / "work")).generate(plan="Change the example", prompt="Be brief")
+
+    args = appmap_calls(fake_appmap)[-1].split()
+    with open(args[args.index("-p") + 1]) as f:
+        prompt = f.read()
+    assert prompt.startswith("Be brief\n\nYour previous response was invalid: a <change>")
+    assert "well-formed <change>" in prompt
+
+
+def test_validation_can_be_turned_off(tmp_path, monkeypatch, fake_appmap):
+    monkeypatch.setattr(Config, "validate", "false")
+    monkeypatch.setenv("FAKE_APPMAP_BAD_ONCE", str(tmp_path / "bad"))
+    monkeypatch.setenv("FAKE_APPMAP_SLOW_SECONDS", "0")
+    assert Editor(str(tmp_path / "work")).plan("Fix parse_config") == ""
+    assert len(appmap_calls(fake_appmap)) == 1
+
+
+def test_terms_log_the_output_file_of_the_valid_attempt(
+    tmp_path, monkeypatch, fake_appmap
+):
+    monkeypatch.setenv("FAKE_APPMAP_BAD_ONCE", str(tmp_path / "bad"))
+    monkeypatch.setenv("FAKE_APPMAP_SLOW_SECONDS", "0")
+    log = []
+    Editor(str(tmp_path / "work"), log=log.append).suggest_terms("Fix parse_config")
+
+    args = appmap_calls(fake_appmap)[-1].split()
+    assert f"  {args[args.index('-o') + 1]}" in log
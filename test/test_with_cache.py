@@ -0,0 +1,151 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from navie.with_cache import _break_lock, _release, _try_lock, with_cache
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def test_concurrent_identical_calls_compute_once(tmp_path):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return "result"
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(with_cache(str(tmp_path), compute, query="q"))
+        )
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["result"] * 8
+    assert len(calls) == 1
+    assert json.loads((tmp_path / "cache.json").read_text())["result"] == "result"
+    assert not list(tmp_path.glob("*.lock"))
+
+
+CHILD = """
+import sys, time
+sys.path.insert(0, {root!r})
+from navie.with_cache import _break_lock, with_cache
+
+def compute():
+    with open({calls!r}, "a") as f:
+        f.write("call\\n")
+    time.sleep(0.5)
+    return {{"answer": 42}}
+
+print(with_cache({work_dir!r}, compute, query="q")["answer"])
+"""
+
+
+def test_concurrent_processes_compute_once(tmp_path):
+    calls = tmp_path / "calls.txt"
+    script = CHILD.format(root=ROOT, calls=str(calls), work_dir=str(tmp_path / "work"))
+    processes = [
+        subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE, text=True)
+        for _ in range(3)
+    ]
+    outputs = [process.communicate()[0].strip() for process in processes]
+
+    assert outputs == ["42"] * 3
+    assert calls.read_text() == "call\n"
+
+
+def test_lock_of_a_dead_process_is_broken(tmp_path):
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    # Find the name of the lock file for this key by taking it while computing
+    lock_names = []
+
+    def compute():
+        lock_names.extend(p.name for p in tmp_path.glob("*.lock"))
+        return "first"
+
+    with_cache(str(tmp_path), compute, query="q")
+    (tmp_path / "cache.json").unlink()
+    (tmp_path / lock_names[0]).write_text(
+        json.dumps({"pid": dead.pid, "host": socket.gethostname()})
+    )
+
+    start = time.monotonic()
+    assert with_cache(str(tmp_path), lambda: "second", query="q") == "second"
+    assert time.monotonic() - start < 5
+
+
+def test_breaking_a_lock_keeps_a_fresh_one(tmp_path):
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    lock_file = tmp_path / "cache.json.0123456789abcdef.lock"
+
+    # A stale lock is broken
+    lock_file.write_text(json.dumps({"pid": dead.pid, "host": socket.gethostname()}))
+    _break_lock(lock_file)
+    assert not lock_file.exists()
+
+    # A waiter that found the lock stale, but was beaten to breaking it by another
+    # waiter that has since taken a fresh lock, leaves the fresh lock alone
+    fresh = json.dumps({"pid": os.getpid(), "host": socket.gethostname()})
+    lock_file.write_text(fresh)
+    _break_lock(lock_file)
+    assert lock_file.read_text() == fresh
+    assert [p.name for p in tmp_path.iterdir()] == [lock_file.name]
+
+
+def test_releasing_a_broken_lock_keeps_the_new_owners(tmp_path):
+    lock_file = tmp_path / "cache.json.0123456789abcdef.lock"
+    lock_id = _try_lock(lock_file)
+    assert lock_id is not None
+    assert _try_lock(lock_file) is None
+
+    # The lock is broken while its owner computes, and another caller takes it
+    lock_file.unlink()
+    new_id = _try_lock(lock_file)
+    _release(lock_file, lock_id)
+    assert json.loads(lock_file.read_text())["id"] == new_id
+    assert [p.name for p in tmp_path.iterdir()] == [lock_file.name]
+
+    _release(lock_file, new_id)
+    assert not list(tmp_path.iterdir())
+
+
+def test_waiters_racing_on_a_stale_lock_compute_once(tmp_path):
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    work_dir = tmp_path / "work"
+    lock_names = []
+
+    def compute():
+        lock_names.extend(p.name for p in work_dir.glob("*.lock"))
+        return {"answer": 42}
+
+    with_cache(str(work_dir), compute, query="q")
+    (work_dir / "cache.json").unlink()
+    (work_dir / lock_names[0]).write_text(
+        json.dumps({"pid": dead.pid, "host": socket.gethostname()})
+    )
+
+    calls = tmp_path / "calls.txt"
+    script = CHILD.format(root=ROOT, calls=str(calls), work_dir=str(work_dir))
+    processes = [
+        subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE, text=True)
+        for _ in range(4)
+    ]
+    outputs = [process.communicate()[0].strip() for process in processes]
+
+    assert outputs == ["42"] * 4
+    assert calls.read_text() == "call\n"
+    assert not list(work_dir.glob("*.lock*"))